@@ -0,0 +1,212 @@
+# --- START OF FILE api_clients/llm_scheduler.py ---
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from bot.utils import metrics
+
+# --- Классы приоритета (меньше = важнее) ---
+PRIORITY_INTERACTIVE = 0 # Ручные запросы (/summary)
+PRIORITY_BATCH = 1       # Ночная рассылка и прочие фоновые задачи
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch"}
+
+TOKEN_WINDOW_SECONDS = 60.0
+
+
+class SchedulerRejected(Exception):
+    """Запрос к LLM отклонен планировщиком (очередь переполнена или истек таймаут ожидания)."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Ticket:
+    __slots__ = ("chat_id", "priority", "tokens", "actual_tokens", "future", "enqueued_at", "granted", "_window_entry")
+
+    def __init__(self, chat_id: int, priority: int, tokens: int, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.priority = priority
+        self.tokens = tokens
+        self.actual_tokens: Optional[int] = None # Заполняется вызывающим кодом из usage ответа
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self._window_entry: Optional[list] = None
+
+
+class LLMScheduler:
+    """
+    Глобальный планировщик запросов к LLM:
+    - ограничивает число одновременных запросов (max_in_flight);
+    - ограничивает бюджет токенов в минуту (tokens_per_minute, 0 = без лимита);
+    - обслуживает классы приоритета строго по порядку, внутри класса - round-robin по чатам.
+    """
+
+    def __init__(self, max_in_flight: int, tokens_per_minute: int, max_queue: int, max_wait: Dict[int, float]):
+        self._max_in_flight = max(1, max_in_flight)
+        self._tokens_per_minute = max(0, tokens_per_minute)
+        self._max_queue = max(0, max_queue)
+        self._max_wait = max_wait
+        # priority -> (chat_id -> очередь тикетов); порядок ключей OrderedDict задает round-robin
+        self._queues: Dict[int, "OrderedDict[int, Deque[_Ticket]]"] = {p: OrderedDict() for p in sorted(PRIORITY_NAMES)}
+        self._queued = 0
+        self._in_flight = 0
+        self._window: Deque[list] = deque() # [timestamp, tokens]
+        self._window_tokens = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    # --- Публичный API ---
+    @asynccontextmanager
+    async def slot(self, chat_id: int, priority: int = PRIORITY_INTERACTIVE, tokens: int = 0):
+        """Ждет свободного слота и бюджета токенов, освобождает слот по выходу из блока."""
+        ticket = await self.acquire(chat_id, priority, tokens)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    async def acquire(self, chat_id: int, priority: int = PRIORITY_INTERACTIVE, tokens: int = 0) -> _Ticket:
+        priority_name = PRIORITY_NAMES.get(priority, str(priority))
+        if self._queued >= self._max_queue and (self._queued or self._in_flight >= self._max_in_flight):
+            metrics.inc("llm_rejected_total", priority=priority_name, reason="queue_full")
+            logging.warning("LLM-планировщик: очередь переполнена (%d), запрос чата %s (%s) отклонен.", self._queued, chat_id, priority_name)
+            raise SchedulerRejected("queue_full")
+
+        ticket = _Ticket(chat_id, priority, max(0, tokens), asyncio.get_running_loop().create_future())
+        self._queues[priority].setdefault(chat_id, deque()).append(ticket)
+        self._queued += 1
+        self._dispatch()
+
+        timeout = self._max_wait.get(priority) or None
+        try:
+            await asyncio.wait_for(ticket.future, timeout=timeout)
+        except asyncio.TimeoutError:
+            # Слот мог быть выдан в том же витке цикла, что и сработал таймаут - возвращаем его
+            if ticket.granted:
+                self.release(ticket)
+            else:
+                self._discard(ticket)
+            metrics.inc("llm_rejected_total", priority=priority_name, reason="timeout")
+            logging.warning("LLM-планировщик: таймаут ожидания (%.0f с) для чата %s (%s), запрос отклонен.", timeout, chat_id, priority_name)
+            raise SchedulerRejected("timeout")
+        except asyncio.CancelledError:
+            if ticket.granted:
+                self.release(ticket)
+            else:
+                self._discard(ticket)
+            raise
+
+        wait = time.monotonic() - ticket.enqueued_at
+        metrics.observe("llm_queue_wait_seconds", wait, priority=priority_name)
+        if wait >= 1.0:
+            logging.info("LLM-планировщик: запрос чата %s (%s) ждал в очереди %.1f с.", chat_id, priority_name, wait)
+        return ticket
+
+    def release(self, ticket: _Ticket):
+        if not ticket.granted:
+            return
+        ticket.granted = False
+        self._in_flight -= 1
+        # Корректируем бюджет по фактическому расходу токенов (если он известен)
+        entry = ticket._window_entry
+        if entry is not None and ticket.actual_tokens is not None:
+            delta = ticket.actual_tokens - entry[1]
+            entry[1] += delta
+            self._window_tokens += delta
+        self._update_gauges()
+        self._dispatch()
+
+    @property
+    def max_in_flight(self) -> int:
+        return self._max_in_flight
+
+    def get_stats(self) -> Dict[str, int]:
+        self._prune(time.monotonic())
+        return {
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "tokens_in_window": self._window_tokens,
+            "max_in_flight": self._max_in_flight,
+            "tokens_per_minute": self._tokens_per_minute,
+        }
+
+    # --- Внутренняя логика ---
+    def _prune(self, now: float):
+        while self._window and self._window[0][0] <= now - TOKEN_WINDOW_SECONDS:
+            _, tokens = self._window.popleft()
+            self._window_tokens -= tokens
+
+    def _has_budget(self, tokens: int, now: float) -> bool:
+        if not self._tokens_per_minute:
+            return True
+        self._prune(now)
+        # Запрос крупнее всего бюджета пропускаем только в пустое окно, иначе он не пройдет никогда
+        return self._window_tokens + tokens <= self._tokens_per_minute or self._window_tokens <= 0
+
+    def _peek(self) -> Optional[_Ticket]:
+        for queue in self._queues.values():
+            if queue:
+                return next(iter(queue.values()))[0]
+        return None
+
+    def _pop(self, ticket: _Ticket):
+        queue = self._queues[ticket.priority]
+        chat_queue = queue.pop(ticket.chat_id)
+        chat_queue.popleft()
+        if chat_queue:
+            queue[ticket.chat_id] = chat_queue # Переносим чат в конец - round-robin
+        self._queued -= 1
+
+    def _discard(self, ticket: _Ticket):
+        queue = self._queues[ticket.priority]
+        chat_queue = queue.get(ticket.chat_id)
+        if chat_queue is None or ticket not in chat_queue:
+            return
+        chat_queue.remove(ticket)
+        if not chat_queue:
+            del queue[ticket.chat_id]
+        self._queued -= 1
+        self._update_gauges()
+
+    def _dispatch(self):
+        while self._queued and self._in_flight < self._max_in_flight:
+            ticket = self._peek()
+            if ticket is None:
+                break
+            now = time.monotonic()
+            if not self._has_budget(ticket.tokens, now):
+                self._schedule_retry(now)
+                break
+            self._pop(ticket)
+            if ticket.future.done():
+                continue # Ожидающий уже отменен
+            entry = [now, ticket.tokens]
+            self._window.append(entry)
+            self._window_tokens += ticket.tokens
+            ticket._window_entry = entry
+            ticket.granted = True
+            self._in_flight += 1
+            ticket.future.set_result(None)
+        self._update_gauges()
+
+    def _schedule_retry(self, now: float):
+        if self._timer is not None or not self._window:
+            return
+        delay = max(0.05, self._window[0][0] + TOKEN_WINDOW_SECONDS - now)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _update_gauges(self):
+        metrics.set_gauge("llm_in_flight", self._in_flight)
+        metrics.set_gauge("llm_queue_depth", self._queued)
+        metrics.set_gauge("llm_tokens_in_window", self._window_tokens)
+
+# --- END OF FILE api_clients/llm_scheduler.py ---
@@ -0,0 +1,119 @@
+# --- START OF FILE api_clients/llm_usage.py ---
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from bot.utils import metrics
+from db.base import LLMUsageRecord
+from db.db import save_llm_usage
+
+
+class LLMUsageRecorder:
+    """
+    Учет запросов к LLM (токены, стоимость, задержка, исход) в таблице llm_usage.
+    record() только обновляет метрики и кладет запись в буфер - без обращения к БД;
+    фоновая задача сбрасывает буфер пачкой раз в flush_interval секунд или при
+    накоплении batch_size записей. Если БД недоступна, записи ждут следующей попытки
+    (сверх max_buffer самые старые отбрасываются).
+    """
+
+    def __init__(self, batch_size: int = 50, flush_interval: float = 10.0, max_buffer: int = 5000):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_buffer = max(self.batch_size, max_buffer)
+        self._buffer: List[LLMUsageRecord] = []
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    def record(self, chat_id: int, model: str, purpose: str, outcome: str, usage: Optional[dict] = None,
+               latency: Optional[float] = None, source_chars: int = 0, sent_chars: int = 0):
+        """Регистрирует запрос к LLM. usage - блок usage из ответа OpenRouter (если есть), latency - секунды."""
+        usage = usage or {}
+        record = LLMUsageRecord(
+            created_at=datetime.now(timezone.utc),
+            chat_id=chat_id,
+            model=model,
+            purpose=purpose,
+            outcome=outcome,
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            total_tokens=usage.get("total_tokens"),
+            cost=usage.get("cost"),
+            latency_ms=int(latency * 1000) if latency is not None else None,
+            source_chars=source_chars,
+            sent_chars=sent_chars,
+        )
+        metrics.inc("llm_requests_total", model=model, purpose=purpose, outcome=outcome)
+        if record.prompt_tokens:
+            metrics.inc("llm_tokens_total", record.prompt_tokens, model=model, kind="prompt")
+        if record.completion_tokens:
+            metrics.inc("llm_tokens_total", record.completion_tokens, model=model, kind="completion")
+        if record.cost:
+            metrics.inc("llm_cost_total", record.cost, model=model)
+        if latency is not None:
+            metrics.observe("llm_request_seconds", latency, model=model, outcome=outcome)
+        if source_chars > sent_chars:
+            metrics.inc("llm_history_chars_dropped_total", source_chars - sent_chars, purpose=purpose)
+
+        self._buffer.append(record)
+        if len(self._buffer) > self.max_buffer:
+            dropped = len(self._buffer) - self.max_buffer
+            del self._buffer[:dropped]
+            metrics.inc("llm_usage_dropped_total", dropped)
+            logging.warning("Буфер учета LLM переполнен, отброшено %s старых записей.", dropped)
+        metrics.set_gauge("llm_usage_buffered", len(self._buffer))
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Сохраняет накопленные записи. Возвращает число сохраненных."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._buffer:
+                return 0
+            batch, self._buffer = self._buffer, []
+            if not await save_llm_usage(batch):
+                # Возвращаем пачку в начало буфера - повторим при следующем сбросе
+                self._buffer[:0] = batch[-self.max_buffer:]
+                metrics.set_gauge("llm_usage_buffered", len(self._buffer))
+                return 0
+            metrics.set_gauge("llm_usage_buffered", len(self._buffer))
+            logging.debug("Сохранено записей учета LLM: %s.", len(batch))
+            return len(batch)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.exception("❌ Ошибка фонового сохранения учета LLM: %s", e)
+
+    def start(self):
+        """Запускает фоновый сброс буфера (вызывается при старте приложения)."""
+        if self._task and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновую задачу и сохраняет остаток буфера (до закрытия хранилища)."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._wakeup = None
+        await self.flush()
+
+# --- END OF FILE api_clients/llm_usage.py ---
@@ -1,10 +1,25 @@
 # --- START OF FILE api_clients/openrouter.py ---
 
+import asyncio
 import httpx
 import logging
+import time
 # import textwrap # <--- УДАЛЕН НЕНУЖНЫЙ ИМПОРТ
 from typing import List, Optional, Dict
-from config.config import OPENROUTER_API_KEY
+from config.config import (
+    OPENROUTER_API_KEY,
+    LLM_MAX_IN_FLIGHT,
+    LLM_TOKENS_PER_MINUTE,
+    LLM_MAX_QUEUE,
+    LLM_QUEUE_TIMEOUT_INTERACTIVE,
+    LLM_QUEUE_TIMEOUT_BATCH,
+    SUMMARY_EXTRACTIVE_SELECTION,
+    LLM_USAGE_BATCH_SIZE,
+    LLM_USAGE_FLUSH_SECONDS,
+)
+from api_clients.llm_scheduler import LLMScheduler, SchedulerRejected, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from api_clients.llm_usage import LLMUsageRecorder
+from bot.utils.extractive import select_representative
 
 # --- Константы ---
 MODEL = "deepseek/deepseek-chat" # Или "deepseek/deepseek-chat-v3-0324:free"
@@ -17,16 +32,40 @@ HEADERS = {
     "Content-Type": "application/json",
 }
 CONTEXT_MAX_LENGTH = 15000
+# Грубая оценка токенов для планировщика (точное значение берется из usage ответа)
+CHARS_PER_TOKEN = 3
+ESTIMATED_COMPLETION_TOKENS = 1500
+
+# --- Глобальный планировщик запросов к модели ---
+llm_scheduler = LLMScheduler(
+    max_in_flight=LLM_MAX_IN_FLIGHT,
+    tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+    max_queue=LLM_MAX_QUEUE,
+    max_wait={PRIORITY_INTERACTIVE: LLM_QUEUE_TIMEOUT_INTERACTIVE, PRIORITY_BATCH: LLM_QUEUE_TIMEOUT_BATCH},
+)
+# --- Учет токенов/стоимости запросов (пишется в БД пачками, запускается в main.py) ---
+llm_usage = LLMUsageRecorder(batch_size=LLM_USAGE_BATCH_SIZE, flush_interval=LLM_USAGE_FLUSH_SECONDS)
 
 # --- Функция для запроса сводки ---
 async def summarize_chat(
     chat_history_blocks: List[str],
     system_prompt: Optional[str] = None,
-    user_prompt: Optional[str] = None # Этот аргумент теперь ОБЯЗАТЕЛЕН (или должен иметь проверку)
+    user_prompt: Optional[str] = None, # Этот аргумент теперь ОБЯЗАТЕЛЕН (или должен иметь проверку)
+    chat_id: int = 0,
+    priority: int = PRIORITY_INTERACTIVE,
+    context_max_length: int = CONTEXT_MAX_LENGTH,
+    purpose: str = "summary",
+    model: Optional[str] = None,
+    message_texts: Optional[List[str]] = None
 ) -> Optional[str]:
     """
     Отправляет историю чата и промпты на модель через OpenRouter API.
+    Запрос проходит через глобальный планировщик (лимит параллельности, бюджет токенов, приоритеты)
+    и учитывается в llm_usage (purpose - summary или digest). model - None означает MODEL.
+    Если планировщик отклонил запрос (очередь переполнена, таймаут ожидания), пробрасывается SchedulerRejected.
+    message_texts - текст каждого блока без времени и автора (для экстрактивного отбора по темам).
     """
+    model = model or MODEL
     if not OPENROUTER_API_KEY:
         logging.error("Ключ API OpenRouter (OPENROUTER_API_KEY) не установлен.")
         return None
@@ -44,16 +83,31 @@ async def summarize_chat(
     # ----> ИСПОЛЬЗУЕМ ПЕРЕДАННЫЙ USER_PROMPT НАПРЯМУЮ <----
     final_user_prompt = user_prompt
 
+    source_chars = sum(len(block) + 1 for block in chat_history_blocks)
+
+    # --- Экстрактивный отбор: если история не влезает, берем представительные сообщения всего дня ---
+    if SUMMARY_EXTRACTIVE_SELECTION and source_chars > context_max_length:
+        try:
+            # CPU-работа (NumPy) - в отдельном потоке, чтобы не блокировать event loop
+            # Темы определяются по тексту сообщений (message_texts), бюджет - по блокам целиком
+            selected = await asyncio.to_thread(select_representative, chat_history_blocks, context_max_length,
+                                               message_texts)
+            logging.info("Экстрактивный отбор для чата %s: %s из %s сообщений.", chat_id, len(selected), len(chat_history_blocks))
+            if selected: # Пустой отбор (нет ни одного слова) - остается обрезка по хвосту
+                chat_history_blocks = [chat_history_blocks[i] for i in selected]
+        except Exception as e:
+            logging.exception("❌ Ошибка экстрактивного отбора, используем обрезку по хвосту: %s", e)
+
     # --- Подготовка истории сообщений (с обрезкой) ---
     trimmed_history = ""
     current_length = 0
     for block in reversed(chat_history_blocks):
         block_len = len(block) + 1
-        if current_length + block_len <= CONTEXT_MAX_LENGTH:
+        if current_length + block_len <= context_max_length:
             trimmed_history = block + "\n" + trimmed_history
             current_length += block_len
         else:
-            logging.warning(f"История чата обрезана до ~{current_length} символов из-за лимита ({CONTEXT_MAX_LENGTH}).")
+            logging.warning("История чата обрезана до ~%s символов из-за лимита (%s).", current_length, context_max_length)
             break
 
     if not trimmed_history:
@@ -66,36 +120,62 @@ async def summarize_chat(
         {"role": "user", "content": final_user_prompt},
         {"role": "user", "content": "Вот история сообщений для анализа:\n\n" + trimmed_history.strip()}
     ]
-    request_payload = { "model": MODEL, "messages": messages }
+    # usage.include - OpenRouter возвращает в usage еще и стоимость запроса
+    request_payload = { "model": model, "messages": messages, "usage": {"include": True} }
+    prompt_chars = sum(len(m["content"]) for m in messages)
+    estimated_tokens = prompt_chars // CHARS_PER_TOKEN + ESTIMATED_COMPLETION_TOKENS
 
     # --- Выполнение запроса ---
-    logging.info(f"📤 Отправка запроса в OpenRouter (модель: {MODEL}, символов истории: ~{current_length})")
+    usage: Optional[dict] = None
+    started: Optional[float] = None
+    outcome = "error"
     try:
-        async with httpx.AsyncClient(timeout=TIMEOUT) as client:
-            response = await client.post(API_URL, headers=HEADERS, json=request_payload)
-            logging.info(f"Ответ от OpenRouter получен, статус: {response.status_code}")
+        async with llm_scheduler.slot(chat_id, priority=priority, tokens=estimated_tokens) as ticket:
+            logging.info("📤 Отправка запроса в OpenRouter (модель: %s, символов истории: ~%s)", model, current_length)
+            started = time.monotonic()
+            async with httpx.AsyncClient(timeout=TIMEOUT) as client:
+                response = await client.post(API_URL, headers=HEADERS, json=request_payload)
+            logging.info("Ответ от OpenRouter получен, статус: %s", response.status_code)
             response.raise_for_status()
             data = response.json()
+            usage = data.get("usage") or {}
+            if usage.get("total_tokens") is not None:
+                ticket.actual_tokens = usage["total_tokens"]
             if "choices" in data and data["choices"] and "message" in data["choices"][0] and "content" in data["choices"][0]["message"]:
                 summary_text = data["choices"][0]["message"]["content"].strip()
-                logging.info(f"✅ Получена сводка от модели '{MODEL}' (длина: {len(summary_text)} символов).")
-                logging.debug(f"Начало сводки: '{summary_text[:100]}...'")
+                outcome = "ok" if summary_text else "empty"
+                logging.info("✅ Получена сводка от модели '%s' (длина: %s символов, токенов: %s).",
+                             model, len(summary_text), usage.get("total_tokens"))
+                logging.debug("Начало сводки: '%s...'", summary_text[:100])
                 return summary_text
             else:
-                logging.error(f"❌ Неожиданная структура ответа от OpenRouter: {data}")
+                outcome = "bad_response"
+                logging.error("❌ Неожиданная структура ответа от OpenRouter: %s", data)
                 return None
     # ... (обработка ошибок остается без изменений) ...
+    except SchedulerRejected as e:
+        outcome = "rejected"
+        logging.warning("⏳ Запрос к OpenRouter для чата %s отклонен планировщиком: %s", chat_id, e.reason)
+        raise # Вызывающий отвечает пользователю "занято, попробуйте позже"
     except httpx.HTTPStatusError as e:
-        logging.exception(f"❌ HTTP ошибка от OpenRouter: Статус {e.response.status_code}")
-        try: error_details = e.response.json(); logging.error(f"Детали ошибки от OpenRouter: {error_details}")
-        except Exception: logging.error(f"Тело ответа при ошибке: {e.response.text}")
+        outcome = f"http_{e.response.status_code}"
+        logging.exception("❌ HTTP ошибка от OpenRouter: Статус %s", e.response.status_code)
+        try: error_details = e.response.json(); logging.error("Детали ошибки от OpenRouter: %s", error_details)
+        except Exception: logging.error("Тело ответа при ошибке: %s", e.response.text)
         if e.response.status_code == 429: logging.warning("⏳ Достигнут лимит запросов OpenRouter (429).")
         return None
     except httpx.TimeoutException as e:
-         logging.error(f"❌ Таймаут при запросе к OpenRouter: {e}")
+         outcome = "timeout"
+         logging.error("❌ Таймаут при запросе к OpenRouter: %s", e)
          return None
     except Exception as e:
-        logging.exception(f"❌ Непредвиденная ошибка при запросе к OpenRouter: {e}")
+        logging.exception("❌ Непредвиденная ошибка при запросе к OpenRouter: %s", e)
         return None
+    finally:
+        llm_usage.record(
+            chat_id, model, purpose, outcome, usage=usage,
+            latency=time.monotonic() - started if started is not None else None,
+            source_chars=source_chars, sent_chars=current_length,
+        )
 
 # --- END OF FILE api_clients/openrouter.py ---
@@ -0,0 +1,96 @@
+# --- START OF FILE api_clients/telegram_session.py ---
+
+import asyncio
+import logging
+import ssl
+import time
+from typing import Optional
+
+import certifi
+from aiohttp import ClientSession, TCPConnector
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+from aiogram import __version__ as aiogram_version
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+
+from bot.utils import metrics
+
+
+class RequestTimingMiddleware(BaseRequestMiddleware):
+    """Замеряет длительность каждого запроса к Bot API (метрика telegram_api_request_seconds по методу)."""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            response = await make_request(bot, method)
+            outcome = "ok"
+            return response
+        finally:
+            metrics.observe("telegram_api_request_seconds", time.monotonic() - started,
+                            method=method.__api_method__, outcome=outcome)
+
+
+class PooledAiohttpSession(AiohttpSession):
+    """
+    AiohttpSession с явно создаваемым TCPConnector: размер пула и keep-alive задаются здесь,
+    без обращения к внутренним полям aiogram. Переопределены только create_session и close -
+    точки расширения сессии; прокси не поддерживается.
+    """
+
+    def __init__(self, limit: int = 100, keepalive_timeout: float = 60.0, **kwargs):
+        super().__init__(limit=limit, **kwargs)
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self._client: Optional[ClientSession] = None
+
+    def _create_connector(self) -> TCPConnector:
+        options = {
+            "ssl": ssl.create_default_context(cafile=certifi.where()),
+            "limit": self.limit,
+            "ttl_dns_cache": 3600,
+        }
+        # keepalive_timeout <= 0 - без переиспользования соединений (aiohttp не допускает оба параметра сразу)
+        if self.keepalive_timeout > 0:
+            options["keepalive_timeout"] = self.keepalive_timeout
+        else:
+            options["force_close"] = True
+        return TCPConnector(**options)
+
+    async def create_session(self) -> ClientSession:
+        if self._client is None or self._client.closed:
+            self._client = ClientSession(
+                connector=self._create_connector(),
+                headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{aiogram_version}"},
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None and not self._client.closed:
+            await self._client.close()
+            # Дать aiohttp закрыть транспорты до остановки цикла
+            await asyncio.sleep(0)
+        self._client = None
+        await super().close()
+
+
+def create_bot_session(api_url: Optional[str] = None, is_local: bool = False, limit: int = 100,
+                       timeout: float = 60.0, keepalive_timeout: float = 60.0) -> AiohttpSession:
+    """
+    HTTP-сессия бота к Bot API с настраиваемым пулом соединений.
+    api_url - адрес собственного сервера telegram-bot-api (или локальной заглушки) вместо api.telegram.org;
+    is_local - сервер запущен с --local (файлы до 2000 МБ, getFile возвращает локальный путь).
+    limit - максимум одновременных соединений, timeout - таймаут запроса (секунды),
+    keepalive_timeout - сколько держать простаивающее соединение открытым (секунды): рассылка
+    сводок и запросы между обновлениями не платят заново за TCP и TLS; 0 - без keep-alive.
+    """
+    api = TelegramAPIServer.from_base(api_url, is_local=is_local) if api_url else PRODUCTION
+    session = PooledAiohttpSession(api=api, limit=limit, timeout=timeout, keepalive_timeout=keepalive_timeout)
+    session.middleware(RequestTimingMiddleware())
+    logging.info("Сессия Bot API: %s%s, до %s соединений, таймаут %s с, keep-alive %s с.",
+                 api_url or "api.telegram.org", " (local)" if is_local else "", limit, timeout, keepalive_timeout)
+    return session
+
+# --- END OF FILE api_clients/telegram_session.py ---
@@ -1,43 +1,69 @@
 # --- START OF FILE bot/handlers/admin_handlers.py ---
 
+import asyncio
+import html
 import io
 import logging
+import os
 from datetime import datetime, timedelta, timezone
-from typing import TYPE_CHECKING, List, Dict, Optional # Убедимся, что Optional импортирован
+from typing import TYPE_CHECKING, Awaitable, Callable, List, Dict, Optional # Убедимся, что Optional импортирован
 
 # Используем Bot для type hinting
 from aiogram import Router, Bot
-from aiogram.types import Message, InputFile
+from aiogram.types import Message, InputFile, BufferedInputFile, FSInputFile
 from aiogram.filters import Command
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.utils import simpleSplit
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+# reportlab и apscheduler импортируются лениво (внутри функций), чтобы не замедлять холодный старт
 
 # Импорты из других модулей проекта
 from db.db import (
     get_registered_chats,
+    get_active_chats,
     get_messages_for_summary,
-    # get_setting, # Убрали, т.к. /set_prompt удален
-    # set_setting
+    get_recent_messages,
+    save_summary,
+    get_summaries,
+    get_llm_usage_stats,
 )
-from api_clients.openrouter import summarize_chat
-from config.config import ADMIN_CHAT_ID # Импортируем ID админа (int или None)
+from db.chat_settings import ChatSettings, get_chat_settings, set_chat_setting, FIELD_PARSERS, LANGUAGES
+from db.export import EXPORT_FORMATS, export_to_file, parse_export_date
+from db.base import SUMMARY_EMPTY_TEXT
+from api_clients.openrouter import summarize_chat, llm_scheduler, MODEL, CONTEXT_MAX_LENGTH
+from api_clients.llm_scheduler import PRIORITY_INTERACTIVE, PRIORITY_BATCH, SchedulerRejected
+from config.config import (
+    ADMIN_CHAT_ID, # ID админа (int или None)
+    PROFILER_MAX_SECONDS,
+    PROFILER_INTERVAL_MS,
+    DIGEST_WEEKLY_ENABLED,
+    DIGEST_MONTHLY_ENABLED,
+    EXPORT_MAX_UPLOAD_MB,
+    SUMMARY_EXTRACTIVE_SELECTION,
+    SUMMARY_FETCH_MAX_CHARS,
+)
+from bot.utils import profiler
 
-# --- Настройка шрифта для PDF ---
-PDF_FONT = 'Helvetica'
+# --- Настройка шрифта для PDF (ленивая, при первом вызове /pdf) ---
 PDF_FONT_PATH = 'DejaVuSans.ttf'
-try:
-    pdfmetrics.registerFont(TTFont('DejaVuSans', PDF_FONT_PATH))
-    PDF_FONT = 'DejaVuSans'
-    logging.info(f"Шрифт '{PDF_FONT_PATH}' успешно зарегистрирован для PDF.")
-except Exception as e:
-    logging.warning(
-        f"Не найден или не удалось загрузить шрифт '{PDF_FONT_PATH}' ({e}). "
-        f"PDF может некорректно отображать кириллицу. Используется '{PDF_FONT}'."
-    )
+_pdf_font: Optional[str] = None
+
+def _get_pdf_font() -> str:
+    """Регистрирует шрифт с кириллицей при первом обращении и возвращает имя шрифта для PDF."""
+    global _pdf_font
+    if _pdf_font is not None:
+        return _pdf_font
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    _pdf_font = 'Helvetica'
+    try:
+        pdfmetrics.registerFont(TTFont('DejaVuSans', PDF_FONT_PATH))
+        _pdf_font = 'DejaVuSans'
+        logging.info("Шрифт '%s' успешно зарегистрирован для PDF.", PDF_FONT_PATH)
+    except Exception as e:
+        logging.warning(
+            "Не найден или не удалось загрузить шрифт '%s' (%s). "
+            "PDF может некорректно отображать кириллицу. Используется '%s'.",
+            PDF_FONT_PATH, e, _pdf_font
+        )
+    return _pdf_font
 # --- Конец настройки шрифта ---
 
 router = Router()
@@ -46,28 +72,63 @@ router = Router()
 if ADMIN_CHAT_ID is None:
     logging.warning("ADMIN_CHAT_ID не задан или некорректен в config.py. Админ-команды будут недоступны.")
 elif not isinstance(ADMIN_CHAT_ID, int):
-     logging.error(f"ADMIN_CHAT_ID из config.py не является числом (тип: {type(ADMIN_CHAT_ID)}). Админ-команды не будут работать.")
+     logging.error("ADMIN_CHAT_ID из config.py не является числом (тип: %s). Админ-команды не будут работать.", type(ADMIN_CHAT_ID))
      ADMIN_CHAT_ID = None
 else:
-     logging.info(f"ADMIN_CHAT_ID для проверки прав администратора: {ADMIN_CHAT_ID}")
+     logging.info("ADMIN_CHAT_ID для проверки прав администратора: %s", ADMIN_CHAT_ID)
 
 # --- Хэндлеры админских команд с внутренней проверкой прав ---
 
-# Команда /set_prompt удалена или закомментирована
+@router.message(Command("settings"))
+async def cmd_settings(message: Message):
+    """Показывает или меняет настройки чата: /settings <chat_id> [поле значение|reset] (проверка админа внутри)."""
+    if not isinstance(ADMIN_CHAT_ID, int) or message.from_user.id != ADMIN_CHAT_ID:
+        logging.warning("Доступ к /settings запрещен для user %s.", message.from_user.id)
+        return
+    # Промпт может содержать пробелы и переносы - значение берем целиком после имени поля
+    args = message.text.split(maxsplit=3)
+    if len(args) < 2 or not args[1].lstrip('-').isdigit() or len(args) == 3:
+        await message.reply(
+            "❗️ Формат: <code>/settings &lt;chat_id&gt;</code> - показать, "
+            "<code>/settings &lt;chat_id&gt; &lt;поле&gt; &lt;значение|reset&gt;</code> - изменить.\n"
+            f"Поля: {', '.join(FIELD_PARSERS)}. Языки: {', '.join(LANGUAGES)}."
+        )
+        return
+    chat_id = int(args[1])
+    if len(args) == 4:
+        field, raw = args[2].lower(), args[3]
+        try:
+            await set_chat_setting(chat_id, field, None if raw.strip().lower() == "reset" else raw)
+        except ValueError as e:
+            await message.reply(f"❗️ Некорректное значение: {html.escape(str(e))}")
+            return
+        except ConnectionError:
+            await message.reply("❌ Не удалось сохранить настройку.")
+            return
+        logging.info("Настройка %s чата %s изменена пользователем %s.", field, chat_id, message.from_user.id)
+    settings = get_chat_settings(chat_id)
+    lines = [f"<b>Настройки чата</b> <code>{chat_id}</code>:"]
+    for field, value in settings._asdict().items():
+        shown = "по умолчанию" if value is None else html.escape(str(value))
+        if field == "prompt" and value is not None and len(value) > 300:
+            shown = html.escape(value[:300]) + "…"
+        lines.append(f"• <b>{field}</b>: {shown}")
+    await message.reply("\n".join(lines))
+
 
 @router.message(Command("chats"))
 async def cmd_chats(message: Message):
     """Показывает список активных чатов (проверка админа внутри)."""
-    logging.debug(f"Хэндлер /chats вызван пользователем {message.from_user.id}.")
+    logging.debug("Хэндлер /chats вызван пользователем %s.", message.from_user.id)
     if not isinstance(ADMIN_CHAT_ID, int) or message.from_user.id != ADMIN_CHAT_ID:
-        logging.warning(f"Доступ к /chats запрещен для user {message.from_user.id}.")
+        logging.warning("Доступ к /chats запрещен для user %s.", message.from_user.id)
         return
-    logging.info(f"Пользователь {message.from_user.id} (АДМИН) прошел проверку и выполняет /chats")
+    logging.info("Пользователь %s (АДМИН) прошел проверку и выполняет /chats", message.from_user.id)
     # ... (остальной код cmd_chats) ...
     try:
         logging.info("Запрашиваю список зарегистрированных чатов из БД...")
         chat_ids: List[int] = await get_registered_chats()
-        logging.info(f"Получено {len(chat_ids)} ID чатов из БД.")
+        logging.info("Получено %s ID чатов из БД.", len(chat_ids))
         if not chat_ids:
             await message.reply("Нет зарегистрированных чатов.")
             logging.info("Список чатов пуст.")
@@ -77,38 +138,38 @@ async def cmd_chats(message: Message):
         processed_count = 0
         for cid in chat_ids:
             try:
-                logging.debug(f"Получение информации для chat_id: {cid}")
+                logging.debug("Получение информации для chat_id: %s", cid)
                 chat_info = await message.bot.get_chat(chat_id=cid)
                 title = chat_info.title or chat_info.full_name or f"ID: {cid}"
                 link_part = ""
                 if chat_info.type in ('group', 'supergroup', 'channel') and chat_info.invite_link:
                     link_part = f" (<a href='{chat_info.invite_link}'>ссылка</a>)"
                 lines.append(f"• {title} (<code>{cid}</code>){link_part}")
-                logging.debug(f"Успешно получена информация для chat_id: {cid}")
+                logging.debug("Успешно получена информация для chat_id: %s", cid)
                 processed_count += 1
             except Exception as e:
-                logging.warning(f"Не удалось получить информацию о чате {cid}: {e}")
+                logging.warning("Не удалось получить информацию о чате %s: %s", cid, e)
                 lines.append(f"• ID: <code>{cid}</code> (ошибка доступа или чат не существует)")
-        logging.info(f"Информация о {processed_count} из {len(chat_ids)} чатов собрана.")
+        logging.info("Информация о %s из %s чатов собрана.", processed_count, len(chat_ids))
         full_text = "\n".join(lines)
         MAX_LEN = 4096
-        logging.info(f"Отправляю список чатов пользователю {message.from_user.id}...")
+        logging.info("Отправляю список чатов пользователю %s...", message.from_user.id)
         for i in range(0, len(full_text), MAX_LEN):
             await message.reply(full_text[i:i + MAX_LEN], parse_mode="HTML")
         logging.info("Список чатов успешно отправлен.")
     except Exception as e:
-        logging.exception(f"Критическая ошибка при выполнении команды /chats: {e}")
+        logging.exception("Критическая ошибка при выполнении команды /chats: %s", e)
         await message.reply("❌ Произошла ошибка при получении списка чатов.")
 
 
 @router.message(Command("pdf"))
 async def cmd_pdf(message: Message):
     """Создает PDF с историей сообщений за 24ч (проверка админа внутри)."""
-    logging.debug(f"Хэндлер /pdf вызван пользователем {message.from_user.id}.")
+    logging.debug("Хэндлер /pdf вызван пользователем %s.", message.from_user.id)
     if not isinstance(ADMIN_CHAT_ID, int) or message.from_user.id != ADMIN_CHAT_ID:
-        logging.warning(f"Доступ к /pdf запрещен для user {message.from_user.id}.")
+        logging.warning("Доступ к /pdf запрещен для user %s.", message.from_user.id)
         return
-    logging.info(f"Пользователь {message.from_user.id} (АДМИН) прошел проверку и выполняет /pdf")
+    logging.info("Пользователь %s (АДМИН) прошел проверку и выполняет /pdf", message.from_user.id)
     # ... (остальной код cmd_pdf) ...
     args = message.text.split()
     if len(args) < 2 or not args[1].lstrip('-').isdigit():
@@ -120,12 +181,16 @@ async def cmd_pdf(message: Message):
         return
     try:
         since_time = datetime.now(timezone.utc) - timedelta(days=1)
-        logging.info(f"Запрос PDF для чата {chat_id_to_fetch} с {since_time.isoformat()}")
+        logging.info("Запрос PDF для чата %s с %s", chat_id_to_fetch, since_time)
         messages_data: List[Dict] = await get_messages_for_summary(chat_id_to_fetch, since_time)
         if not messages_data:
             await message.reply(f"Сообщений в чате <code>{chat_id_to_fetch}</code> за последние 24 часа не найдено.")
             return
-        logging.info(f"Найдено {len(messages_data)} сообщений для PDF в чате {chat_id_to_fetch}.")
+        logging.info("Найдено %s сообщений для PDF в чате %s.", len(messages_data), chat_id_to_fetch)
+        from reportlab.pdfgen import canvas
+        from reportlab.lib.pagesizes import letter
+        from reportlab.lib.utils import simpleSplit
+        PDF_FONT = _get_pdf_font()
         buf = io.BytesIO()
         c = canvas.Canvas(buf, pagesize=letter); width, height = letter; margin = 40
         textobject = c.beginText(); textobject.setTextOrigin(margin, height - margin)
@@ -146,47 +211,150 @@ async def cmd_pdf(message: Message):
             textobject.moveCursor(0, line_height / 2)
         c.drawText(textobject); c.save(); buf.seek(0)
         pdf_filename = f"history_{chat_id_to_fetch}_{since_time.strftime('%Y%m%d')}.pdf"
-        logging.info(f"Отправка PDF {pdf_filename} пользователю {message.from_user.id}")
+        logging.info("Отправка PDF %s пользователю %s", pdf_filename, message.from_user.id)
         await message.reply_document(InputFile(buf, filename=pdf_filename), caption=f"История чата <code>{chat_id_to_fetch}</code> за последние 24 часа.")
         logging.info("PDF успешно отправлен.")
     except Exception as e:
-        logging.exception(f"Ошибка при создании или отправке PDF для чата {chat_id_to_fetch}: {e}")
+        logging.exception("Ошибка при создании или отправке PDF для чата %s: %s", chat_id_to_fetch, e)
         await message.reply("❌ Произошла ошибка при создании PDF.")
 
 
-# --- Функция отправки сводки (с новым промптом) ---
-async def send_summary(bot: Bot, chat_id: int):
-    """Собирает сообщения за 24 часа, генерирует и отправляет сводку."""
-    logging.info(f"Начало генерации сводки для чата {chat_id}")
-    now_aware = datetime.now(timezone.utc)
-    since_aware = now_aware - timedelta(days=1)
+@router.message(Command("export"))
+async def cmd_export(message: Message):
+    """Выгружает историю чата за период в CSV/JSONL (gzip) и присылает файлом (проверка админа внутри)."""
+    if not isinstance(ADMIN_CHAT_ID, int) or message.from_user.id != ADMIN_CHAT_ID:
+        logging.warning("Доступ к /export запрещен для user %s.", message.from_user.id)
+        return
+    usage = ("❗️ Формат: `/export <chat_id> [from] [to] [csv|jsonl]`\n"
+             "Даты - YYYY-MM-DD (to включительно), по умолчанию - последние 24 часа.\n"
+             "Пример: `/export -1001234567890 2024-01-01 2024-01-31 jsonl`")
+    args = message.text.split()[1:]
+    if not args or not args[0].lstrip('-').isdigit():
+        await message.reply(usage)
+        return
+    chat_id_to_export = int(args[0])
+    fmt = "csv"
+    if args[-1].lower() in EXPORT_FORMATS:
+        fmt = args.pop().lower()
+    dates = args[1:]
+    if len(dates) > 2:
+        await message.reply(usage)
+        return
+    try:
+        until = parse_export_date(dates[1], end=True) if len(dates) == 2 else datetime.now(timezone.utc)
+        since = parse_export_date(dates[0]) if dates else until - timedelta(days=1)
+    except ValueError:
+        await message.reply(usage)
+        return
+    if since >= until:
+        await message.reply("❗️ Начало периода должно быть раньше конца.")
+        return
 
-    logging.info(f"Запрос сообщений для сводки чата {chat_id} с {since_aware.isoformat()}")
+    logging.info("Выгрузка чата %s за [%s, %s) в %s по запросу %s", chat_id_to_export, since, until, fmt, message.from_user.id)
+    path = None
     try:
-        messages_data: List[Dict] = await get_messages_for_summary(chat_id, since=since_aware)
-        logging.info(f"📥 Получено сообщений: {len(messages_data)} для чата {chat_id}")
+        path, rows = await export_to_file(chat_id_to_export, since, until, fmt)
+        if not rows:
+            await message.reply(f"Сообщений в чате <code>{chat_id_to_export}</code> за указанный период не найдено.")
+            return
+        size = os.path.getsize(path)
+        if size > EXPORT_MAX_UPLOAD_MB * 1024 * 1024:
+            await message.reply(
+                f"❗️ Файл выгрузки ({size / 1024 / 1024:.1f} МБ) превышает лимит отправки {EXPORT_MAX_UPLOAD_MB} МБ. "
+                f"Сузьте период или воспользуйтесь CLI: <code>python -m db.export {chat_id_to_export}</code>"
+            )
+            return
+        filename = f"history_{chat_id_to_export}_{since.strftime('%Y%m%d')}_{until.strftime('%Y%m%d')}.{fmt}.gz"
+        await message.reply_document(
+            FSInputFile(path, filename=filename),
+            caption=f"История чата <code>{chat_id_to_export}</code>: {rows} сообщений ({fmt}, gzip)."
+        )
+        logging.info("Выгрузка %s (%s строк, %s байт) отправлена.", filename, rows, size)
     except Exception as e:
-        logging.exception(f"❌ Ошибка при получении сообщений для сводки чата {chat_id}: {e}")
+        logging.exception("Ошибка при выгрузке истории чата %s: %s", chat_id_to_export, e)
+        await message.reply("❌ Произошла ошибка при выгрузке истории.")
+    finally:
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+@router.message(Command("stats"))
+async def cmd_stats(message: Message):
+    """Показывает использование LLM (токены, стоимость, задержки) по чатам и по дням (проверка админа внутри)."""
+    if not isinstance(ADMIN_CHAT_ID, int) or message.from_user.id != ADMIN_CHAT_ID:
+        logging.warning("Доступ к /stats запрещен для user %s.", message.from_user.id)
         return
+    args = message.text.split()
+    days = 7
+    if len(args) >= 2:
+        if not args[1].isdigit() or int(args[1]) < 1:
+            await message.reply("❗️ Укажите период в днях.\nПример: `/stats 30`")
+            return
+        days = int(args[1])
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    by_chat = await get_llm_usage_stats(since, "chat")
+    if not by_chat:
+        await message.reply(f"Запросов к LLM за последние {days} дн. не найдено.")
+        return
+    by_day = await get_llm_usage_stats(since, "day")
+
+    def _row(stat: Dict) -> str:
+        saved = 1 - stat["sent_chars"] / stat["source_chars"] if stat["source_chars"] else 0
+        return (f"{stat['calls']} запр. ({stat['failures']} неуд.), токены {stat['prompt_tokens']}+"
+                f"{stat['completion_tokens']}={stat['total_tokens']}, ${stat['cost']:.4f}, "
+                f"{stat['avg_latency_ms'] / 1000:.1f} с, обрезано {saved:.0%}")
 
-    MIN_MESSAGES_FOR_SUMMARY = 5
-    if not messages_data or len(messages_data) < MIN_MESSAGES_FOR_SUMMARY:
-        logging.info(f"Недостаточно сообщений ({len(messages_data)}) для сводки в чате {chat_id}.")
+    total = {key: sum(s[key] for s in by_chat) for key in ("calls", "total_tokens", "cost")}
+    lines = [
+        f"<b>Использование LLM за {days} дн.:</b> {total['calls']} запросов, "
+        f"{total['total_tokens']} токенов, ${total['cost']:.4f}",
+        "", "<b>По дням (UTC):</b>",
+    ]
+    lines += [f"• {stat['key']}: {_row(stat)}" for stat in by_day]
+    lines += ["", "<b>По чатам (топ 20 по токенам):</b>"]
+    lines += [f"• <code>{stat['key']}</code>: {_row(stat)}" for stat in by_chat[:20]]
+    await _send_long_message(message.bot, message.chat.id, "\n".join(lines))
+
+
+@router.message(Command("profile"))
+async def cmd_profile(message: Message):
+    """Запускает сэмплирующий профилировщик на N секунд и присылает folded stacks (проверка админа внутри)."""
+    if not isinstance(ADMIN_CHAT_ID, int) or message.from_user.id != ADMIN_CHAT_ID:
+        logging.warning("Доступ к /profile запрещен для user %s.", message.from_user.id)
+        return
+    args = message.text.split()
+    duration = 10
+    if len(args) >= 2:
+        if not args[1].isdigit() or int(args[1]) < 1:
+            await message.reply("❗️ Укажите длительность в секундах.\nПример: `/profile 15`")
+            return
+        duration = int(args[1])
+    duration = min(duration, PROFILER_MAX_SECONDS)
+    if profiler.is_running():
+        await message.reply("⏳ Профилировщик уже запущен, дождитесь завершения.")
+        return
+    await message.reply(f"🔬 Профилирую {duration} с...")
+    try:
+        folded = await profiler.profile(duration, interval=PROFILER_INTERVAL_MS / 1000)
+    except RuntimeError:
+        await message.reply("⏳ Профилировщик уже запущен, дождитесь завершения.")
+        return
+    except Exception as e:
+        logging.exception("Ошибка при профилировании: %s", e)
+        await message.reply("❌ Произошла ошибка при профилировании.")
         return
+    filename = f"profile_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.folded"
+    await message.reply_document(
+        BufferedInputFile(folded.encode("utf-8"), filename=filename),
+        caption="Folded stacks: flamegraph.pl или https://www.speedscope.app"
+    )
 
-    message_blocks: List[str] = []
-    for m in messages_data:
-        msg_timestamp: datetime = m["timestamp"]
-        if msg_timestamp.tzinfo is None: msg_timestamp = msg_timestamp.replace(tzinfo=timezone.utc)
-        elif msg_timestamp.tzinfo != timezone.utc: msg_timestamp = msg_timestamp.astimezone(timezone.utc)
-        ts = msg_timestamp.strftime('%H:%M')
-        sender = m.get("username", "Unknown")
-        text = m.get("text", "") or "[пусто]"
-        MAX_MSG_LEN = 1000
-        message_blocks.append(f"[{ts}] {sender}: {text[:MAX_MSG_LEN]}")
-
-    # ----> НОВЫЙ ПРОМПТ ЗДЕСЬ <----
-    summary_prompt = """
+
+# --- Промпт ежедневной сводки (чат может задать свой через /settings <chat_id> prompt ...) ---
+SUMMARY_PROMPT = """
 Проанализируй сообщения из этого чата за последние 24 часа и создай сводку в следующем формате:
 
 1.  **Топ 5 тем:** Перечисли до 5 основных тем, которые обсуждались в чате за этот период. Если тем меньше 5, перечисли все.
@@ -195,77 +363,305 @@ async def send_summary(bot: Bot, chat_id: int):
 4.  **Предложение новой темы:** Предложи ОДНУ новую, интересную тему для обсуждения, которая может быть связана с предыдущими дискуссиями или общими интересами участников (если их можно определить).
 5.  **"Токсичный" участник (если есть):** Определи участника, чьи сообщения могли быть наиболее негативными, деструктивными, токсичными или бесполезными для дискуссии, и кратко (1 предложение) объясни почему. Если таких участников нет, напиши "Не выявлено".
 
-Ответ должен быть только на русском языке. Будь объективен и структурирован.
-    """.strip()
-    logging.info(f"Используется стандартный промпт для чата {chat_id}.")
-    # ----> КОНЕЦ НОВОГО ПРОМПТА <----
+Ответ должен быть только на {language} языке. Будь объективен и структурирован.
+""".strip()
+# Добавляется к собственному промпту чата, чтобы настройка language действовала и для него
+LANGUAGE_INSTRUCTION = "Ответ должен быть только на {language} языке."
+
+
+def _summary_prompt(settings: ChatSettings) -> str:
+    language = LANGUAGES.get(settings.language, LANGUAGES["ru"])
+    if settings.prompt:
+        return f"{settings.prompt}\n\n{LANGUAGE_INSTRUCTION.format(language=language)}"
+    return SUMMARY_PROMPT.format(language=language)
 
-    logging.info(f"⏳ Отправляем {len(message_blocks)} блоков сообщений в OpenAI для чата {chat_id}...")
+
+# --- Функция отправки сводки ---
+async def send_summary(bot: Bot, chat_id: int, priority: int = PRIORITY_INTERACTIVE):
+    """Собирает сообщения за 24 часа, генерирует и отправляет сводку.
+    priority - класс приоритета запроса к LLM (ручной /summary или ночная рассылка)."""
+    logging.debug("Начало генерации сводки для чата %s", chat_id)
+    settings = get_chat_settings(chat_id) # Из кэша, без запроса к БД
+    now_aware = datetime.now(timezone.utc)
+    since_aware = now_aware - timedelta(days=1)
+
+    # Из БД читается только то, что может попасть в запрос: без экстрактивного отбора - ровно контекст
+    # модели, с отбором - кандидаты в пределах SUMMARY_FETCH_MAX_CHARS (чтение от новых к старым)
+    budget = max(SUMMARY_FETCH_MAX_CHARS, CONTEXT_MAX_LENGTH) if SUMMARY_EXTRACTIVE_SELECTION else CONTEXT_MAX_LENGTH
+    logging.debug("Запрос сообщений для сводки чата %s с %s (бюджет %s символов)", chat_id, since_aware, budget)
+    try:
+        messages_data, complete = await get_recent_messages(chat_id, since_aware, budget)
+        logging.info("📥 Получено сообщений: %s для чата %s%s", len(messages_data), chat_id,
+                     "" if complete else " (более старые не вошли в бюджет)")
+    except Exception as e:
+        logging.exception("❌ Ошибка при получении сообщений для сводки чата %s: %s", chat_id, e)
+        return
+
+    # Неполная выборка означает, что сообщений больше, чем влезло в бюджет
+    if not messages_data or (complete and len(messages_data) < settings.min_messages):
+        logging.info("Недостаточно сообщений (%s) для сводки в чате %s.", len(messages_data), chat_id)
+        return
+
+    # Время уже aware UTC, текст обрезан хранилищем
+    message_blocks: List[str] = [
+        f"[{ts:%H:%M}] {sender}: {text or SUMMARY_EMPTY_TEXT}" for ts, sender, text in messages_data
+    ]
+
+    summary_prompt = _summary_prompt(settings)
+    logging.debug("Используется %s промпт для чата %s.", "собственный" if settings.prompt else "стандартный", chat_id)
+
+    logging.info("⏳ Отправляем %s блоков сообщений в OpenAI для чата %s...", len(message_blocks), chat_id)
     summary_text: Optional[str] = None
     try:
         # Передаем промпт как user_prompt, т.к. summarize_chat ожидает его там
         # (Можно переделать summarize_chat, чтобы он принимал основной промпт как system)
-        summary_text = await summarize_chat(message_blocks, user_prompt=summary_prompt)
+        summary_text = await summarize_chat(message_blocks, user_prompt=summary_prompt, chat_id=chat_id,
+                                            priority=priority, model=settings.model,
+                                            message_texts=[text or "" for _, _, text in messages_data])
+    except SchedulerRejected as e:
+        await _report_rejected(bot, chat_id, priority, "сводки", e)
+        return
     except Exception as e:
-        logging.exception(f"❌ Ошибка при запросе к OpenAI для чата {chat_id}: {e}")
+        logging.exception("❌ Ошибка при запросе к OpenAI для чата %s: %s", chat_id, e)
         try: await bot.send_message(chat_id, "⚠️ Произошла ошибка при генерации сводки.")
         except Exception: pass
         return
 
     if not summary_text:
-        logging.warning(f"OpenAI вернул пустую сводку для чата {chat_id}.")
+        logging.warning("OpenAI вернул пустую сводку для чата %s.", chat_id)
         return
 
+    # Сохраняем сводку: из ежедневных сводок потом собираются недельные/месячные дайджесты
+    await save_summary(chat_id, "day", since_aware, now_aware, settings.model or MODEL, summary_text)
+
     try:
-        full_summary_text = f"📝 <b>Сводка за последние 24 часа:</b>\n\n{summary_text}"
-        MAX_LEN = 4096
-        for i in range(0, len(full_summary_text), MAX_LEN):
-            await bot.send_message(chat_id, full_summary_text[i:i + MAX_LEN], parse_mode="HTML")
-        logging.info(f"✅ Сводка успешно отправлена в чат {chat_id}")
+        await _send_long_message(bot, chat_id, f"📝 <b>Сводка за последние 24 часа:</b>\n\n{summary_text}")
+        logging.info("✅ Сводка успешно отправлена в чат %s", chat_id)
         # Убрали set_setting для времени последней сводки
     except Exception as e:
-        logging.exception(f"❌ Ошибка при отправке сводки в чат {chat_id}: {e}")
+        logging.exception("❌ Ошибка при отправке сводки в чат %s: %s", chat_id, e)
+
+
+async def _report_rejected(bot: Bot, chat_id: int, priority: int, what: str, error: SchedulerRejected):
+    """Запрос к модели отклонен планировщиком: на ручной запрос отвечаем "занято", ночную рассылку только логируем."""
+    if priority != PRIORITY_INTERACTIVE:
+        logging.warning("Генерация %s для чата %s пропущена: планировщик LLM отклонил запрос (%s).",
+                        what, chat_id, error.reason)
+        return
+    try: await bot.send_message(chat_id, f"⏳ Сейчас слишком много запросов к модели, генерация {what} отложена. Попробуйте позже.")
+    except Exception: pass
+
+
+async def _send_long_message(bot: Bot, chat_id: int, text: str):
+    """Отправляет текст, разбивая его на части по лимиту Telegram."""
+    MAX_LEN = 4096
+    for i in range(0, len(text), MAX_LEN):
+        await bot.send_message(chat_id, text[i:i + MAX_LEN], parse_mode="HTML")
+
+
+# --- Дайджесты из сохраненных ежедневных сводок ---
+# period -> (длительность окна в днях, подпись для заголовка)
+DIGEST_PERIODS = {
+    "week": (7, "неделю"),
+    "month": (30, "месяц"),
+}
+# Минимум ежедневных сводок для дайджеста и лимит контекста (сводки намного компактнее сырых сообщений)
+MIN_DAILY_SUMMARIES_FOR_DIGEST = 2
+DIGEST_CONTEXT_MAX_LENGTH = 60000
+
+DIGEST_PROMPT = """
+Ниже приведены ежедневные сводки этого чата за {period_title}, каждая помечена датой.
+На их основе составь итоговый дайджест в следующем формате:
+
+1.  **Главные темы за {period_title}:** до 7 ключевых тем и как развивалось их обсуждение.
+2.  **Самые активные участники:** до 5 участников, которые чаще всего упоминаются как активные.
+3.  **Ключевые события и решения:** что важного произошло или было решено.
+4.  **Динамика настроения чата:** как менялась атмосфера обсуждений (1-2 предложения).
+5.  **Тема на следующий период:** предложи ОДНУ тему для обсуждения.
+
+Ответ должен быть только на {language} языке. Будь объективен и структурирован.
+""".strip()
+
+
+async def send_digest(bot: Bot, chat_id: int, period: str, priority: int = PRIORITY_INTERACTIVE):
+    """
+    Собирает недельный или месячный дайджест из сохраненных ежедневных сводок
+    (а не из сырых сообщений), сохраняет и отправляет его.
+    """
+    days, period_title = DIGEST_PERIODS[period]
+    settings = get_chat_settings(chat_id)
+    now_aware = datetime.now(timezone.utc)
+    since_aware = now_aware - timedelta(days=days)
+
+    daily_summaries = await get_summaries(chat_id, "day", since_aware, now_aware)
+    # Если за день сводок несколько (ручные /summary + ночная), берем последнюю за каждую дату
+    latest_by_date: Dict[str, Dict] = {}
+    for summary in daily_summaries:
+        latest_by_date[summary["window_end"].strftime('%Y-%m-%d')] = summary
+    logging.info("📥 Найдено ежедневных сводок для дайджеста (%s): %s (дней: %s) в чате %s",
+                 period, len(daily_summaries), len(latest_by_date), chat_id)
+
+    if len(latest_by_date) < MIN_DAILY_SUMMARIES_FOR_DIGEST:
+        logging.info("Недостаточно ежедневных сводок (%s) для дайджеста в чате %s.", len(latest_by_date), chat_id)
+        if priority == PRIORITY_INTERACTIVE:
+            try: await bot.send_message(chat_id, f"ℹ️ Недостаточно ежедневных сводок за {period_title} для дайджеста.")
+            except Exception: pass
+        return
+
+    per_summary_limit = DIGEST_CONTEXT_MAX_LENGTH // len(latest_by_date)
+    summary_blocks = [
+        f"=== {date} ===\n{summary['text'][:per_summary_limit]}"
+        for date, summary in sorted(latest_by_date.items())
+    ]
+    context_max_length = sum(len(block) + 1 for block in summary_blocks)
+
+    logging.info("⏳ Отправляем %s ежедневных сводок в OpenAI для дайджеста (%s) чата %s...",
+                 len(summary_blocks), period, chat_id)
+    try:
+        digest_text = await summarize_chat(
+            summary_blocks,
+            user_prompt=DIGEST_PROMPT.format(period_title=period_title,
+                                             language=LANGUAGES.get(settings.language, LANGUAGES["ru"])),
+            chat_id=chat_id, priority=priority, context_max_length=context_max_length, purpose="digest",
+            model=settings.model
+        )
+    except SchedulerRejected as e:
+        await _report_rejected(bot, chat_id, priority, "дайджеста", e)
+        return
+    except Exception as e:
+        logging.exception("❌ Ошибка при запросе к OpenAI для дайджеста чата %s: %s", chat_id, e)
+        return
+
+    if not digest_text:
+        logging.warning("OpenAI вернул пустой дайджест для чата %s.", chat_id)
+        return
+
+    await save_summary(chat_id, period, since_aware, now_aware, settings.model or MODEL, digest_text)
+    try:
+        await _send_long_message(bot, chat_id, f"🗓 <b>Дайджест за {period_title}:</b>\n\n{digest_text}")
+        logging.info("✅ Дайджест (%s) успешно отправлен в чат %s", period, chat_id)
+    except Exception as e:
+        logging.exception("❌ Ошибка при отправке дайджеста в чат %s: %s", chat_id, e)
 
 
 # --- Настройка планировщика ---
 def setup_scheduler(bot: Bot):
-    """Настраивает и запускает планировщик для ежедневной отправки сводок."""
+    """Настраивает и запускает планировщик для ежедневной отправки сводок (каждый час - чатам, у которых сейчас час сводки)."""
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
     scheduler = AsyncIOScheduler(timezone="UTC")
     try:
         scheduler.add_job(
-            trigger_all_summaries, trigger="cron", hour=21, minute=0,
-            args=[bot], id="daily_summaries", replace_existing=True, misfire_grace_time=300
+            trigger_all_summaries, trigger="cron", minute=0,
+            # Пропущенные запуски сливаются в один и выполняются в пределах часа; часы, пропущенные
+            # целиком (предыдущий запуск шел дольше часа), досылает сам trigger_all_summaries
+            args=[bot], id="daily_summaries", replace_existing=True, coalesce=True, max_instances=1,
+            misfire_grace_time=3000
         )
+        # Дайджесты - после ежедневной рассылки, чтобы учесть сегодняшние сводки
+        if DIGEST_WEEKLY_ENABLED:
+            scheduler.add_job(
+                trigger_all_digests, trigger="cron", day_of_week="sun", hour=21, minute=30,
+                args=[bot, "week"], id="weekly_digests", replace_existing=True, misfire_grace_time=3600
+            )
+        if DIGEST_MONTHLY_ENABLED:
+            scheduler.add_job(
+                trigger_all_digests, trigger="cron", day="last", hour=22, minute=0,
+                args=[bot, "month"], id="monthly_digests", replace_existing=True, misfire_grace_time=3600
+            )
         scheduler.start()
         next_run = scheduler.get_job('daily_summaries').next_run_time
-        if next_run: logging.info(f"Планировщик настроен. Следующий запуск сводок: {next_run.strftime('%Y-%m-%d %H:%M:%S %Z')}.")
+        if next_run: logging.info("Планировщик настроен. Следующий запуск сводок: %s.", next_run.strftime('%Y-%m-%d %H:%M:%S %Z'))
         else: logging.warning("Не удалось определить время следующего запуска планировщика.")
     except Exception as e:
-        logging.exception(f"❌ Не удалось запустить планировщик: {e}")
+        logging.exception("❌ Не удалось запустить планировщик: %s", e)
 
 
 # --- Функция запуска сводок по расписанию ---
-async def trigger_all_summaries(bot: Bot):
-    """Запускает отправку сводок для всех зарегистрированных чатов."""
-    logging.info("🚀 Запуск ежедневной рассылки сводок по расписанию...")
+# Начало последнего обработанного планового часа (для досылки пропущенных часов)
+_last_summary_hour: Optional[datetime] = None
+
+
+async def _run_for_chats(chat_ids: List[int], send: Callable[[int], Awaitable[None]], name: str):
+    """
+    Запускает рассылку по чатам параллельно: одновременно до 2 * LLM_MAX_IN_FLIGHT задач, чтобы
+    слоты планировщика LLM были заняты, а ожидающие запросы он упорядочивал сам (приоритеты,
+    round-robin по чатам). Ошибка одного чата не прерывает остальные.
+    """
+    limit = asyncio.Semaphore(2 * llm_scheduler.max_in_flight)
+
+    async def run(chat_id: int):
+        async with limit:
+            logging.info("Запуск задачи %s для чата %s...", name, chat_id)
+            try:
+                await send(chat_id)
+            except Exception as e:
+                logging.exception("❌ Исключение при вызове %s для чата %s в планировщике: %s", name, chat_id, e)
+
+    await asyncio.gather(*(run(chat_id) for chat_id in chat_ids))
+
+
+def _due_summary_hours(now: datetime) -> List[int]:
+    """
+    Часы сводки (UTC), которые нужно обработать в плановом запуске: текущий и все пропущенные после
+    предыдущего обработанного (не больше суток назад) - например, если прошлый запуск шел дольше часа.
+    """
+    global _last_summary_hour
+    current = now.replace(minute=0, second=0, microsecond=0)
+    hours = [current.hour]
+    if _last_summary_hour is not None:
+        step = max(_last_summary_hour + timedelta(hours=1), current - timedelta(hours=23))
+        while step < current:
+            hours.insert(-1, step.hour)
+            step += timedelta(hours=1)
+    _last_summary_hour = current
+    if len(hours) > 1:
+        logging.warning("Пропущены запуски рассылки сводок, досылаем часы: %s.", ", ".join(f"{h:02d}" for h in hours[:-1]))
+    return hours
+
+
+async def trigger_all_summaries(bot: Bot, hour: Optional[int] = None):
+    """
+    Запускает отправку сводок для активных чатов, у которых час сводки (UTC) равен hour (по умолчанию -
+    текущий плюс пропущенные запуски) и за последние сутки могло набраться не меньше min_messages сообщений.
+    """
+    hours = [hour] if hour is not None else _due_summary_hours(datetime.now(timezone.utc))
+    logging.info("🚀 Запуск ежедневной рассылки сводок по расписанию (час %s UTC)...",
+                 ", ".join(f"{h:02d}" for h in hours))
     try:
-        registered_chats: List[int] = await get_registered_chats()
-        logging.info(f"Найдено {len(registered_chats)} зарегистрированных чатов для отправки сводки.")
+        # Один запрос по индексу активности: чаты без сообщений за сутки не читаются вовсе.
+        # Счетчик - оценка сверху (два дневных бакета), точную проверку делает send_summary
+        active_chats = await get_active_chats(datetime.now(timezone.utc) - timedelta(days=1))
+        # Час сводки и порог берутся из кэша настроек - без запросов к БД на каждый чат
+        registered_chats: List[int] = []
+        for chat_id, recent_count in active_chats:
+            settings = get_chat_settings(chat_id)
+            if settings.summary_hour in hours and recent_count >= settings.min_messages:
+                registered_chats.append(chat_id)
+        logging.info("Активных за сутки чатов: %s, к отправке сводки в этот час: %s.",
+                     len(active_chats), len(registered_chats))
         if not registered_chats:
-            logging.info("Нет зарегистрированных чатов, рассылка не требуется.")
+            logging.info("Нет чатов со сводкой в этот час, рассылка не требуется.")
             return
 
-        # Убрана проверка времени последней сводки
-        for chat_id in registered_chats:
-            logging.info(f"Запуск задачи отправки сводки для чата {chat_id}...")
-            try:
-                await send_summary(bot, chat_id)
-            except Exception as e:
-                logging.exception(f"❌ Исключение при вызове send_summary для чата {chat_id} в планировщике: {e}")
+        await _run_for_chats(registered_chats, lambda chat_id: send_summary(bot, chat_id, priority=PRIORITY_BATCH),
+                             "send_summary")
 
     except Exception as e:
-        logging.exception(f"❌ Критическая ошибка при выполнении trigger_all_summaries: {e}")
+        logging.exception("❌ Критическая ошибка при выполнении trigger_all_summaries: %s", e)
     finally:
         logging.info("🏁 Ежедневная рассылка сводок завершена.")
 
+
+async def trigger_all_digests(bot: Bot, period: str):
+    """Запускает отправку дайджестов (week/month) для всех зарегистрированных чатов."""
+    logging.info("🚀 Запуск рассылки дайджестов (%s) по расписанию...", period)
+    try:
+        registered_chats: List[int] = await get_registered_chats()
+        await _run_for_chats(registered_chats, lambda chat_id: send_digest(bot, chat_id, period, priority=PRIORITY_BATCH),
+                             "send_digest")
+    except Exception as e:
+        logging.exception("❌ Критическая ошибка при выполнении trigger_all_digests: %s", e)
+    finally:
+        logging.info("🏁 Рассылка дайджестов (%s) завершена.", period)
+
 # --- END OF FILE admin_handlers.py ---
@@ -1,16 +1,16 @@
 # --- START OF FILE user_handlers.py ---
 
 import logging
-from datetime import timezone # Импортируем для работы с временными метками
+from datetime import datetime, timezone # Импортируем для работы с временными метками
 
 from aiogram import Router, F # <--- Убедитесь, что F импортирован
 from aiogram.types import Message
 from aiogram.filters import Command, CommandStart
 
 # Импортируем функции из других модулей
-from db.db import save_message, register_chat
+from db.db import save_message, save_message_edit, is_recently_saved
 # Импортируем функцию для вызова сводки
-from bot.handlers.admin_handlers import send_summary # Этот импорт нужен для /summary
+from bot.handlers.admin_handlers import send_summary, send_digest, DIGEST_PERIODS # Нужны для /summary
 
 router = Router()
 
@@ -26,46 +26,81 @@ async def cmd_start(message: Message):
         f"1. Добавьте меня в любую группу.\n"
         f"2. Сделай админом с возможностью читать сообщения.\n"
         f"3. Раз в сутки (около полуночи) я буду присылать сводку сообщений за последние 24 часа.\n"
+        f"4. /summary - сводка за 24 часа, /summary week и /summary month - дайджест за неделю/месяц.\n"
     )
     try:
         await message.reply(text, parse_mode="HTML")
     except Exception as e:
-        logging.exception(f"Ошибка при отправке ответа на /start пользователю {message.from_user.id}: {e}")
+        logging.exception("Ошибка при отправке ответа на /start пользователю %s: %s", message.from_user.id, e)
 
 # ----> ОБРАБОТЧИК КОМАНДЫ /summary <----
 @router.message(Command("summary"))
 async def cmd_summary(message: Message):
-    """Позволяет любому участнику чата вызвать сводку за последние 24 часа."""
+    """
+    Позволяет любому участнику чата вызвать сводку за последние 24 часа
+    или дайджест из сохраненных сводок: /summary week, /summary month.
+    """
     chat_id = message.chat.id
     user_id = message.from_user.id if message.from_user else "unknown"
-    logging.info(f"Запрошена сводка командой /summary для чата {chat_id} пользователем {user_id}")
+    args = (message.text or "").split()
+    period = args[1].lower() if len(args) >= 2 else None
+    if period is not None and period not in DIGEST_PERIODS:
+        await message.reply("❗️ Использование: /summary, /summary week или /summary month")
+        return
+    logging.info("Запрошена сводка командой /summary (%s) для чата %s пользователем %s", period or "day", chat_id, user_id)
     try:
-        await send_summary(message.bot, chat_id)
+        if period:
+            await send_digest(message.bot, chat_id, period)
+        else:
+            await send_summary(message.bot, chat_id)
     except Exception as e:
-        logging.exception(f"Критическая ошибка при обработке /summary для чата {chat_id}: {e}")
+        logging.exception("Критическая ошибка при обработке /summary для чата %s: %s", chat_id, e)
         try:
             await message.reply("❌ Произошла непредвиденная ошибка при запросе сводки.")
         except Exception as send_error:
-             logging.error(f"Не удалось отправить сообщение об ошибке /summary в чат {chat_id}: {send_error}")
+             logging.error("Не удалось отправить сообщение об ошибке /summary в чат %s: %s", chat_id, send_error)
 
 
-# ----> ОБРАБОТЧИК ОБЫЧНЫХ ТЕКСТОВЫХ СООБЩЕНИЙ <----
-@router.message(F.text & ~F.text.startswith('/'))
-async def handle_text_message(message: Message):
-    """Сохраняет ТОЛЬКО обычные текстовые сообщения (не команды) в БД."""
-    if not message.from_user: return
-    await register_chat(message.chat.id)
-    text_to_save = message.text
-    sender_name = message.from_user.username or message.from_user.full_name or f"User_{message.from_user.id}"
+def _sender_name(message: Message) -> str:
+    return message.from_user.username or message.from_user.full_name or f"User_{message.from_user.id}"
+
+
+async def _store_message(message: Message, text_to_save: str, kind: str):
+    """Сохраняет текст сообщения в БД; повторные доставки того же message_id пропускаются без запроса к БД."""
+    if is_recently_saved(message.chat.id, message.message_id):
+        logging.debug("Повторная доставка сообщения %s чата %s, пропускаем.", message.message_id, message.chat.id)
+        return
+    # Чат регистрируется (и его активность учитывается) при сохранении сообщения - отдельный запрос не нужен
     timestamp_to_save = message.date
     if timestamp_to_save.tzinfo is None: timestamp_to_save = timestamp_to_save.replace(tzinfo=timezone.utc)
     elif timestamp_to_save.tzinfo != timezone.utc: timestamp_to_save = timestamp_to_save.astimezone(timezone.utc)
     try:
         await save_message(
-            chat_id=message.chat.id, username=sender_name, text=text_to_save, timestamp=timestamp_to_save
+            chat_id=message.chat.id, username=_sender_name(message), text=text_to_save,
+            timestamp=timestamp_to_save, telegram_message_id=message.message_id
+        )
+    except Exception as e:
+        logging.exception("Ошибка при сохранении %s сообщения в БД для чата %s: %s", kind, message.chat.id, e)
+
+
+async def _store_edit(message: Message, new_text: str, kind: str):
+    """Обновляет текст отредактированного сообщения; если исходного нет в БД - сохраняет как новое."""
+    edited_at = message.edit_date or datetime.now(timezone.utc)
+    try:
+        await save_message_edit(
+            chat_id=message.chat.id, username=_sender_name(message), text=new_text,
+            timestamp=message.date, telegram_message_id=message.message_id, edited_at=edited_at
         )
     except Exception as e:
-        logging.exception(f"Ошибка при сохранении ТЕКСТОВОГО сообщения в БД для чата {message.chat.id}: {e}")
+        logging.exception("Ошибка при сохранении правки %s сообщения в БД для чата %s: %s", kind, message.chat.id, e)
+
+
+# ----> ОБРАБОТЧИК ОБЫЧНЫХ ТЕКСТОВЫХ СООБЩЕНИЙ <----
+@router.message(F.text & ~F.text.startswith('/'))
+async def handle_text_message(message: Message):
+    """Сохраняет ТОЛЬКО обычные текстовые сообщения (не команды) в БД."""
+    if not message.from_user: return
+    await _store_message(message, message.text, "ТЕКСТОВОГО")
 
 
 # ----> ОБРАБОТЧИК ПОДПИСЕЙ К МЕДИА (CAPTION) <----
@@ -73,17 +108,21 @@ async def handle_text_message(message: Message):
 async def handle_caption_message(message: Message):
     """Сохраняет ТОЛЬКО подписи к медиа (фото, видео, документы) в БД."""
     if not message.from_user: return
-    await register_chat(message.chat.id)
-    text_to_save = message.caption
-    sender_name = message.from_user.username or message.from_user.full_name or f"User_{message.from_user.id}"
-    timestamp_to_save = message.date
-    if timestamp_to_save.tzinfo is None: timestamp_to_save = timestamp_to_save.replace(tzinfo=timezone.utc)
-    elif timestamp_to_save.tzinfo != timezone.utc: timestamp_to_save = timestamp_to_save.astimezone(timezone.utc)
-    try:
-        await save_message(
-            chat_id=message.chat.id, username=sender_name, text=text_to_save, timestamp=timestamp_to_save
-        )
-    except Exception as e:
-        logging.exception(f"Ошибка при сохранении CAPTION сообщения в БД для чата {message.chat.id}: {e}")
+    await _store_message(message, message.caption, "CAPTION")
+
+
+# ----> ОБРАБОТЧИКИ ОТРЕДАКТИРОВАННЫХ СООБЩЕНИЙ <----
+@router.edited_message(F.text & ~F.text.startswith('/'))
+async def handle_edited_text_message(message: Message):
+    """Обновляет сохраненный текст при редактировании сообщения."""
+    if not message.from_user: return
+    await _store_edit(message, message.text, "ТЕКСТОВОГО")
+
+
+@router.edited_message(F.caption)
+async def handle_edited_caption_message(message: Message):
+    """Обновляет сохраненную подпись при редактировании медиа."""
+    if not message.from_user: return
+    await _store_edit(message, message.caption, "CAPTION")
 
 # --- END OF FILE user_handlers.py ---
@@ -43,7 +43,7 @@ class AuthMiddleware(BaseMiddleware):
         command_text = text.lstrip().lower()
 
         # Список админ-команд (без параметров)
-        admin_commands_start = ("/chats", "/pdf", "/set_prompt")
+        admin_commands_start = ("/chats", "/pdf", "/export", "/stats", "/settings", "/set_prompt", "/profile")
 
         is_admin_command = False
         for cmd in admin_commands_start:
@@ -53,7 +53,7 @@ class AuthMiddleware(BaseMiddleware):
 
         # Если это админ-команда и пользователь НЕ админ
         if is_admin_command and user_id != ADMIN_CHAT_ID:
-            logging.info(f"Пользователь {user_id} попытался выполнить админ-команду: {command_text.split()[0]}")
+            logging.info("Пользователь %s попытался выполнить админ-команду: %s", user_id, command_text.split()[0])
             # Просто не вызываем следующий хэндлер (handler)
             # Сообщение будет проигнорировано ботом
             return None # Или можно отправить сообщение "Нет доступа"
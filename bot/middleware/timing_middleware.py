@@ -0,0 +1,87 @@
+# --- START OF FILE bot/middleware/timing_middleware.py ---
+
+import logging
+import time
+from typing import Callable, Dict, Any, Awaitable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update, TelegramObject
+
+from bot.utils import metrics
+
+# Ключ в data, через который внутренний middleware сообщает внешнему имя хэндлера
+TIMING_CONTEXT_KEY = "timing_context"
+
+
+def _extract_chat_id(event: Optional[TelegramObject]) -> Optional[int]:
+    """Достает chat_id из вложенного события (Message, ChatMemberUpdated, CallbackQuery и т.п.)."""
+    if event is None:
+        return None
+    chat = getattr(event, "chat", None)
+    if chat is None:
+        chat = getattr(getattr(event, "message", None), "chat", None)
+    return getattr(chat, "id", None)
+
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """
+    Внешний (outer) middleware для dp.update: замеряет wall- и CPU-время обработки каждого обновления.
+    CPU-время считается по потоку event loop и включает работу других корутин,
+    выполнявшихся в это же время, поэтому это оценка сверху.
+    """
+
+    def __init__(self, slow_threshold_ms: int):
+        self.slow_threshold_ms = slow_threshold_ms
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        timing_context: Dict[str, str] = {}
+        data[TIMING_CONTEXT_KEY] = timing_context
+        wall_started = time.perf_counter()
+        cpu_started = time.thread_time()
+        try:
+            return await handler(event, data)
+        finally:
+            wall_ms = (time.perf_counter() - wall_started) * 1000
+            cpu_ms = (time.thread_time() - cpu_started) * 1000
+            update_type = event.event_type
+            handler_name = timing_context.get("handler", "unhandled")
+            chat_id = _extract_chat_id(event.event)
+            metrics.observe("update_wall_seconds", wall_ms / 1000, update_type=update_type, handler=handler_name)
+            metrics.observe("update_cpu_seconds", cpu_ms / 1000, update_type=update_type, handler=handler_name)
+            fields = {"update_id": event.update_id, "update_type": update_type, "handler": handler_name,
+                      "chat_id": chat_id, "wall_ms": round(wall_ms, 2), "cpu_ms": round(cpu_ms, 2)}
+            if wall_ms >= self.slow_threshold_ms:
+                metrics.inc("update_slow_total", update_type=update_type, handler=handler_name)
+                logging.warning("🐢 Медленное обновление %s (%s, %s, чат %s): %.1f мс wall, %.1f мс CPU",
+                                event.update_id, update_type, handler_name, chat_id, wall_ms, cpu_ms, extra=fields)
+            else:
+                logging.debug("Обновление %s (%s, %s, чат %s): %.1f мс wall, %.1f мс CPU",
+                              event.update_id, update_type, handler_name, chat_id, wall_ms, cpu_ms,
+                              extra={**fields, "sampled": True})
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """
+    Внутренний middleware: сообщает UpdateTimingMiddleware, какой хэндлер обработал событие
+    (во внешнем middleware хэндлер еще не выбран).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        timing_context = data.get(TIMING_CONTEXT_KEY)
+        handler_object = data.get("handler")
+        if timing_context is not None and handler_object is not None:
+            callback = handler_object.callback
+            timing_context["handler"] = getattr(callback, "__qualname__", repr(callback))
+        return await handler(event, data)
+
+# --- END OF FILE bot/middleware/timing_middleware.py ---
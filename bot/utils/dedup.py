@@ -0,0 +1,34 @@
+# --- START OF FILE bot/utils/dedup.py ---
+
+from collections import OrderedDict
+from typing import Hashable
+
+
+class RecentlySeen:
+    """
+    Ограниченный по размеру LRU-набор недавно обработанных ключей.
+    Используется, чтобы повторно доставленные Telegram обновления не ходили в БД.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = max(0, maxsize)
+        self._items: "OrderedDict[Hashable, None]" = OrderedDict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        if key in self._items:
+            self._items.move_to_end(key)
+            return True
+        return False
+
+    def add(self, key: Hashable):
+        if not self.maxsize:
+            return
+        self._items[key] = None
+        self._items.move_to_end(key)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+# --- END OF FILE bot/utils/dedup.py ---
@@ -0,0 +1,199 @@
+# --- START OF FILE bot/utils/extractive.py ---
+
+import logging
+from typing import List, Optional, Sequence
+
+# Экстрактивный отбор сообщений перед отправкой в LLM: если история за день не влезает
+# в контекст, вместо хвоста берем сообщения, лучше всего представляющие весь день.
+# TF-IDF считается векторно в NumPy (хэширование признаков со знаком в VECTOR_DIM измерений),
+# сообщения кластеризуются сферическим k-means по темам, и из каждого кластера берутся
+# самые центральные (ближайшие к центроиду) сообщения - пропорционально размеру кластера.
+# numpy импортируется лениво, чтобы не замедлять холодный старт.
+
+# Хэш слова - полиномиальный по кодам символов (mod 2^64): считается сразу для всего текста через префиксные суммы
+HASH_BASE = 1099511628211
+HASH_BASE_INVERSE = pow(HASH_BASE, -1, 1 << 64)
+MIN_TOKEN_LENGTH = 2
+# Размерность векторов после хэширования признаков и число "корзин" для подсчета document frequency
+VECTOR_DIM = 256
+HASH_BUCKETS = 1 << 20
+MAX_CLUSTERS = 32
+# Примерно столько выбранных сообщений приходится на один кластер
+MESSAGES_PER_CLUSTER = 6
+# Центроиды обучаются на случайной подвыборке, затем назначаются все сообщения
+KMEANS_SAMPLE = 4096
+KMEANS_ITERATIONS = 10
+RANDOM_SEED = 727
+
+
+def _tokenize(texts: Sequence[str]):
+    """
+    Векторная токенизация: весь текст переводится в массив кодов символов, слова - непрерывные
+    последовательности букв (латиница, кириллица и прочие алфавиты; цифры, знаки и эмодзи - разделители)
+    длиной от MIN_TOKEN_LENGTH. Возвращает (номер сообщения, хэш слова) для каждого вхождения.
+    """
+    import numpy as np
+
+    lengths = [len(text) for text in texts]
+    joined = "\n".join(texts).lower()
+    if len(joined) != sum(lengths) + len(texts) - 1:
+        # Редкие символы меняют длину при lower() ("İ") - тогда приводим к нижнему регистру по отдельности
+        lowered = [text.lower() for text in texts]
+        lengths = [len(text) for text in lowered]
+        joined = "\n".join(lowered)
+    codes = np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32)
+    is_letter = (((codes >= 97) & (codes <= 122)) | ((codes >= 0xC0) & (codes < 0x2000))
+                 | ((codes >= 0x3040) & (codes < 0xFB00)))
+    edges = np.diff(np.concatenate(([False], is_letter, [False])).astype(np.int8))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    keep = ends - starts >= MIN_TOKEN_LENGTH
+    starts, ends = starts[keep], ends[keep]
+
+    # hash(слово) = sum(code[i] * B^(i - start)): разность префиксных сумм, нормированная на B^-start
+    with np.errstate(over="ignore"):
+        powers = np.full(len(codes) + 1, HASH_BASE, dtype=np.uint64)
+        powers[0] = 1
+        powers = np.cumprod(powers, dtype=np.uint64)
+        prefix = np.zeros(len(codes) + 1, dtype=np.uint64)
+        np.cumsum(codes.astype(np.uint64) * powers[:-1], out=prefix[1:])
+        inverse_powers = np.full(len(codes) + 1, HASH_BASE_INVERSE, dtype=np.uint64)
+        inverse_powers[0] = 1
+        inverse_powers = np.cumprod(inverse_powers, dtype=np.uint64)
+        hashes = (prefix[ends] - prefix[starts]) * inverse_powers[starts]
+
+    # Сообщения разделены "\n" (не буква), поэтому слово целиком лежит в одном сообщении
+    doc_starts = np.zeros(len(texts), dtype=np.int64)
+    np.cumsum(np.array(lengths[:-1], dtype=np.int64) + 1, out=doc_starts[1:])
+    docs = np.searchsorted(doc_starts, starts, side="right") - 1
+    return docs, hashes
+
+
+def _tfidf_vectors(texts: Sequence[str]):
+    """Возвращает матрицу (n, VECTOR_DIM) float32 нормированных TF-IDF векторов (сообщения без слов - нулевые строки)."""
+    import numpy as np
+
+    n = len(texts)
+    vectors = np.zeros((n, VECTOR_DIM), dtype=np.float32)
+    docs, hashes = _tokenize(texts)
+    if not len(docs):
+        return vectors
+    terms = (hashes % np.uint64(HASH_BUCKETS)).astype(np.int64)
+
+    # Уникальные пары (сообщение, термин) и частота термина в сообщении
+    pairs, tf = np.unique(docs * HASH_BUCKETS + terms, return_counts=True)
+    pair_docs, pair_terms = pairs // HASH_BUCKETS, pairs % HASH_BUCKETS
+    df = np.bincount(pair_terms, minlength=HASH_BUCKETS)
+    idf = np.log((1.0 + n) / (1.0 + df[pair_terms])) + 1.0
+    weights = ((1.0 + np.log(tf)) * idf).astype(np.float32)
+
+    # Хэширование признаков: измерение и знак - из перемешанного номера корзины термина
+    mixed = pair_terms * 0x9E3779B1
+    dims = (mixed >> 7) % VECTOR_DIM
+    signs = np.where((mixed >> 3) & 1, 1.0, -1.0).astype(np.float32)
+    np.add.at(vectors, (pair_docs, dims), signs * weights)
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def _spherical_kmeans(vectors, k: int):
+    """
+    Сферический k-means (косинусная близость) с инициализацией k-means++ на подвыборке.
+    Возвращает (метки, близость к центроиду своего кластера) для всех векторов.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(RANDOM_SEED)
+    n = vectors.shape[0]
+    sample = vectors if n <= KMEANS_SAMPLE else vectors[rng.choice(n, KMEANS_SAMPLE, replace=False)]
+    m = sample.shape[0]
+
+    centroids = np.empty((k, vectors.shape[1]), dtype=np.float32)
+    centroids[0] = sample[rng.integers(m)]
+    distance = np.clip(1.0 - sample @ centroids[0], 0.0, None)
+    for c in range(1, k):
+        total = distance.sum()
+        index = rng.choice(m, p=distance / total) if total > 0 else rng.integers(m)
+        centroids[c] = sample[index]
+        np.minimum(distance, np.clip(1.0 - sample @ centroids[c], 0.0, None), out=distance)
+
+    for _ in range(KMEANS_ITERATIONS):
+        labels = (sample @ centroids.T).argmax(axis=1)
+        membership = np.zeros((k, m), dtype=np.float32)
+        membership[labels, np.arange(m)] = 1.0
+        sums = membership @ sample
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Пустой кластер сохраняет прежний центроид
+        centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids).astype(np.float32)
+
+    similarity = vectors @ centroids.T
+    labels = similarity.argmax(axis=1)
+    return labels, similarity[np.arange(n), labels]
+
+
+def select_representative(texts: Sequence[str], max_chars: int, contents: Optional[Sequence[str]] = None) -> List[int]:
+    """
+    Выбирает сообщения, лучше всего представляющие всю историю, так чтобы сумма len(text) + 1
+    не превышала max_chars. Возвращает индексы выбранных сообщений в исходном (хронологическом) порядке.
+    texts - блоки в том виде, в каком уходят модели (по ним считается бюджет); contents - только текст
+    сообщений для TF-IDF и поиска повторов (по умолчанию texts). Время и имя автора из блока
+    "[HH:MM] username: text" не должны становиться термами: иначе они перевешивают тему, а одинаковые
+    сообщения разных людей не распознаются как повторы.
+    """
+    import numpy as np
+
+    if contents is None:
+        contents = texts
+    elif len(contents) != len(texts):
+        raise ValueError("contents и texts должны быть одной длины")
+
+    n = len(texts)
+    sizes = np.fromiter((len(text) + 1 for text in texts), dtype=np.int64, count=n)
+    if int(sizes.sum()) <= max_chars:
+        return list(range(n))
+    if not n:
+        return []
+
+    vectors = _tfidf_vectors(contents)
+    has_terms = vectors.any(axis=1)
+    # Точные повторы текста ("+1", одинаковые стикеры-подписи, в т.ч. от разных людей) - только первое вхождение
+    _, first_index = np.unique(np.fromiter(map(hash, contents), dtype=np.int64, count=n), return_index=True)
+    candidate = np.zeros(n, dtype=bool)
+    candidate[first_index] = True
+    candidate &= has_terms & (sizes <= max_chars)
+    candidates = np.flatnonzero(candidate)
+    if not len(candidates):
+        return []
+
+    expected_picks = max(1, max_chars // max(1, int(np.median(sizes[candidates]))))
+    k = int(min(MAX_CLUSTERS, len(candidates), max(1, expected_picks // MESSAGES_PER_CLUSTER)))
+    labels, centrality = _spherical_kmeans(vectors[candidates], k)
+
+    # Ранг сообщения внутри своего кластера по убыванию центральности
+    order = np.lexsort((-centrality, labels))
+    cluster_sizes = np.bincount(labels, minlength=k)
+    starts = np.concatenate(([0], np.cumsum(cluster_sizes)[:-1]))
+    ranks = np.empty(len(candidates), dtype=np.float64)
+    ranks[order] = np.arange(len(candidates)) - starts[labels[order]]
+    # Кластеры получают места пропорционально размеру: k-е сообщение кластера доли s идет с приоритетом (k+1)/s
+    priority = (ranks + 1.0) / cluster_sizes[labels]
+    picked = candidates[np.argsort(priority, kind="stable")]
+
+    # Жадно набираем бюджет: сообщения, которые не влезают, пропускаются
+    chosen: List[int] = []
+    used = 0
+    smallest = int(sizes[candidates].min())
+    for index in picked.tolist():
+        size = int(sizes[index])
+        if used + size <= max_chars:
+            chosen.append(index)
+            used += size
+            if max_chars - used < smallest:
+                break
+    logging.debug("Экстрактивный отбор: %s из %s сообщений (%s кластеров, %s/%s символов).",
+                  len(chosen), n, k, used, max_chars)
+    chosen.sort()
+    return chosen
+
+# --- END OF FILE bot/utils/extractive.py ---
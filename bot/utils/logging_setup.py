@@ -0,0 +1,139 @@
+# --- START OF FILE bot/utils/logging_setup.py ---
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional
+
+# Стандартные атрибуты LogRecord - всё остальное считаем структурированными полями (extra=...)
+_RESERVED_ATTRS = frozenset(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - [%(name)s:%(lineno)d] - %(message)s"
+TEXT_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# Аргументы этих типов не меняются после вызова логгера - их можно форматировать в другом потоке
+_IMMUTABLE_TYPES = (str, bytes, int, float, complex, bool, type(None), datetime)
+
+
+def _is_immutable(value) -> bool:
+    if isinstance(value, (tuple, frozenset)):
+        return all(_is_immutable(item) for item in value)
+    return isinstance(value, _IMMUTABLE_TYPES)
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись лога в одну строку JSON (вызывается в потоке QueueListener)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            payload["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler без форматирования в вызывающем потоке.
+    Стандартный prepare() подставляет аргументы в сообщение прямо на event loop;
+    здесь запись с неизменяемыми аргументами кладется в очередь как есть, а getMessage()
+    вызывается уже в потоке слушателя. Изменяемые аргументы (список, dict, объект) к тому
+    времени могут поменяться, поэтому такое сообщение собирается сразу, как в QueueHandler.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if isinstance(record.msg, str) and _is_immutable(tuple(args.values()) if isinstance(args, dict) else args or ()):
+            return record
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает только каждую N-ю запись высокочастотных событий.
+    Выборка применяется к логгерам из sampled_loggers и к записям с extra={"sampled": True}.
+    WARNING и выше не отбрасываются никогда.
+    """
+
+    def __init__(self, sample_rate: float, sampled_loggers: Iterable[str] = ()):
+        super().__init__()
+        self._every = max(1, round(1 / sample_rate)) if sample_rate > 0 else 0
+        self._sampled_loggers = tuple(sampled_loggers)
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self._every == 1:
+            return True
+        if not (getattr(record, "sampled", False) or record.name.startswith(self._sampled_loggers)):
+            return True
+        if self._every == 0:
+            return False
+        with self._lock:
+            count = self._counters.get(record.name, 0)
+            self._counters[record.name] = count + 1
+        return count % self._every == 0
+
+
+def setup_logging(level: str = "INFO", fmt: str = "json", sample_rate: float = 1.0,
+                  sampled_loggers: Iterable[str] = (), stream=None) -> logging.handlers.QueueListener:
+    """
+    Настраивает неблокирующий логгинг: все записи через QueueHandler попадают в очередь,
+    а форматирование и запись в поток выполняет отдельный поток QueueListener.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if fmt == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(TEXT_FORMAT, datefmt=TEXT_DATEFMT))
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rate, sampled_loggers))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает поток слушателя."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+# --- END OF FILE bot/utils/logging_setup.py ---
@@ -0,0 +1,95 @@
+# --- START OF FILE bot/utils/metrics.py ---
+
+import threading
+from typing import Dict, Tuple
+
+# Простой in-process реестр метрик (счетчики, gauge, сводки длительностей).
+# Отдается в текстовом формате Prometheus через HTTP-маршрут /metrics в main.py.
+
+LabelsKey = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[LabelsKey, float]] = {}
+_gauges: Dict[str, Dict[LabelsKey, float]] = {}
+# Для сводок храним [count, sum, max]
+_summaries: Dict[str, Dict[LabelsKey, list]] = {}
+
+
+def _labels_key(labels: Dict[str, object]) -> LabelsKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Увеличивает счетчик."""
+    key = _labels_key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Устанавливает текущее значение gauge."""
+    key = _labels_key(labels)
+    with _lock:
+        _gauges.setdefault(name, {})[key] = value
+
+
+def observe(name: str, value: float, **labels):
+    """Добавляет наблюдение (например, длительность) в сводку: count, sum, max."""
+    key = _labels_key(labels)
+    with _lock:
+        series = _summaries.setdefault(name, {})
+        stat = series.get(key)
+        if stat is None:
+            series[key] = [1, value, value]
+        else:
+            stat[0] += 1
+            stat[1] += value
+            if value > stat[2]: stat[2] = value
+
+
+def snapshot() -> Dict[str, Dict[LabelsKey, object]]:
+    """Возвращает копию всех метрик (для админ-команд и отладки)."""
+    with _lock:
+        result: Dict[str, Dict[LabelsKey, object]] = {}
+        for name, series in _counters.items(): result[name] = dict(series)
+        for name, series in _gauges.items(): result[name] = dict(series)
+        for name, series in _summaries.items():
+            result[name] = {k: {"count": v[0], "sum": v[1], "max": v[2]} for k, v in series.items()}
+        return result
+
+
+def _escape_label(value) -> str:
+    """Экранирует значение метки по формату экспозиции Prometheus: \\, \" и перевод строки."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: LabelsKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    inner = ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs)
+    return "{" + inner + "}"
+
+
+def render_prometheus() -> str:
+    """Сериализует метрики в текстовый формат Prometheus."""
+    lines = []
+    with _lock:
+        for name, series in sorted(_counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            for key, value in series.items():
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        for name, series in sorted(_gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in series.items():
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        for name, series in sorted(_summaries.items()):
+            lines.append(f"# TYPE {name} summary")
+            for key, (count, total, maximum) in series.items():
+                lines.append(f"{name}_count{_format_labels(key)} {count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{name}_max{_format_labels(key)} {maximum}")
+    return "\n".join(lines) + "\n"
+
+# --- END OF FILE bot/utils/metrics.py ---
@@ -0,0 +1,61 @@
+# --- START OF FILE bot/utils/profiler.py ---
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Optional
+
+# Сэмплирующий профилировщик для продакшена: фоновый поток периодически снимает стек
+# потока event loop и агрегирует его в "folded stacks" (формат flamegraph.pl / speedscope).
+
+_profile_lock = threading.Lock()
+
+
+def _folded_stack(frame: Optional[FrameType]) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    parts.reverse() # Корень стека - первым
+    return ";".join(parts)
+
+
+def _sample(thread_id: int, duration: float, interval: float) -> Counter:
+    samples: Counter = Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            samples[_folded_stack(frame)] += 1
+        del frame
+        time.sleep(interval)
+    return samples
+
+
+def is_running() -> bool:
+    return _profile_lock.locked()
+
+
+async def profile(duration: float, interval: float = 0.005) -> str:
+    """
+    Профилирует поток текущего event loop в течение duration секунд и возвращает
+    результат в формате folded stacks ("frame1;frame2;frame3 count" на строку).
+    Одновременно может работать только один сеанс профилирования.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("Профилировщик уже запущен")
+    try:
+        thread_id = threading.get_ident()
+        logging.info("Запуск профилировщика на %.0f с (интервал %.1f мс)", duration, interval * 1000)
+        samples = await asyncio.to_thread(_sample, thread_id, duration, interval)
+        logging.info("Профилировщик завершен: %s сэмплов, %s уникальных стеков", sum(samples.values()), len(samples))
+        return "\n".join(f"{stack} {count}" for stack, count in samples.most_common()) + "\n"
+    finally:
+        _profile_lock.release()
+
+# --- END OF FILE bot/utils/profiler.py ---
@@ -10,17 +10,68 @@ load_dotenv()
 # --- Загрузка переменных из окружения ---
 logging.info("Загрузка конфигурации из переменных окружения...")
 
+def _get_int_env(name: str, default: int) -> int:
+    """Читает целочисленную переменную окружения (с дефолтом и проверкой формата)."""
+    value_str = os.getenv(name, str(default))
+    try:
+        return int(value_str)
+    except ValueError:
+        logging.critical("Некорректное значение %s: '%s'. Должно быть число.", name, value_str)
+        raise ValueError(f"Некорректное значение {name}: '{value_str}'. Должно быть число.")
+
+def _get_float_env(name: str, default: float) -> float:
+    """Читает вещественную переменную окружения (с дефолтом и проверкой формата)."""
+    value_str = os.getenv(name, str(default))
+    try:
+        return float(value_str)
+    except ValueError:
+        logging.critical("Некорректное значение %s: '%s'. Должно быть число.", name, value_str)
+        raise ValueError(f"Некорректное значение {name}: '{value_str}'. Должно быть число.")
+
+def _get_bool_env(name: str, default: bool) -> bool:
+    """Читает булеву переменную окружения ('1', 'true', 'yes', 'on' - истина)."""
+    value_str = os.getenv(name)
+    if value_str is None or value_str.strip() == "":
+        return default
+    return value_str.strip().lower() in ("1", "true", "yes", "on")
+
 # Обязательные переменные
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     logging.critical("Не установлена переменная окружения BOT_TOKEN")
     raise ValueError("Не установлена переменная окружения BOT_TOKEN")
 
+# Бэкенд хранилища: postgres (по умолчанию), sqlite (встроенный, WAL) или memory (для тестов)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres").lower()
+if STORAGE_BACKEND not in ("postgres", "sqlite", "memory"):
+    logging.critical("Некорректное значение STORAGE_BACKEND: '%s'. Допустимо: postgres, sqlite, memory.", STORAGE_BACKEND)
+    raise ValueError(f"Некорректное значение STORAGE_BACKEND: '{STORAGE_BACKEND}'.")
+
+# DATABASE_URL обязателен только для PostgreSQL
 DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
+if STORAGE_BACKEND == "postgres" and not DATABASE_URL:
     logging.critical("Не установлена переменная окружения DATABASE_URL")
     raise ValueError("Не установлена переменная окружения DATABASE_URL")
 
+# Необязательный DSN реплики для аналитических чтений (сводки, /pdf, /export, /stats); пусто - основная БД
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL") or None
+# Пулы соединений PostgreSQL: запись (прием сообщений) и аналитическое чтение - раздельно,
+# чтобы тяжелые выборки не занимали соединения, нужные приему. Таймауты - в секундах.
+DB_WRITE_POOL_MIN = _get_int_env("DB_WRITE_POOL_MIN", 1)
+DB_WRITE_POOL_MAX = _get_int_env("DB_WRITE_POOL_MAX", 5)
+DB_WRITE_COMMAND_TIMEOUT = _get_float_env("DB_WRITE_COMMAND_TIMEOUT", 10.0)
+DB_WRITE_ACQUIRE_TIMEOUT = _get_float_env("DB_WRITE_ACQUIRE_TIMEOUT", 5.0)
+# Пул чтения по умолчанию не держит соединений в простое (min 0) - не замедляет холодный старт
+DB_READ_POOL_MIN = _get_int_env("DB_READ_POOL_MIN", 0)
+DB_READ_POOL_MAX = _get_int_env("DB_READ_POOL_MAX", 5)
+DB_READ_COMMAND_TIMEOUT = _get_float_env("DB_READ_COMMAND_TIMEOUT", 120.0)
+DB_READ_ACQUIRE_TIMEOUT = _get_float_env("DB_READ_ACQUIRE_TIMEOUT", 30.0)
+# COPY выгрузки идет дольше обычного запроса: свой таймаут вместо command_timeout пула
+DB_EXPORT_TIMEOUT = _get_float_env("DB_EXPORT_TIMEOUT", 3600.0)
+
+# Путь к файлу базы SQLite (для STORAGE_BACKEND=sqlite)
+SQLITE_PATH = os.getenv("SQLITE_PATH", "bot.sqlite3")
+
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 if not OPENROUTER_API_KEY:
     logging.critical("Не установлена переменная окружения OPENROUTER_API_KEY")
@@ -35,7 +86,7 @@ else:
     try:
         ADMIN_CHAT_ID = int(ADMIN_CHAT_ID_STR)
     except ValueError:
-        logging.critical(f"Некорректное значение ADMIN_CHAT_ID: '{ADMIN_CHAT_ID_STR}'. Должно быть число.")
+        logging.critical("Некорректное значение ADMIN_CHAT_ID: '%s'. Должно быть число.", ADMIN_CHAT_ID_STR)
         raise ValueError(f"Некорректное значение ADMIN_CHAT_ID: '{ADMIN_CHAT_ID_STR}'. Должно быть число.")
 
 # Переменные для вебхука
@@ -43,7 +94,7 @@ else:
 WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "")
 WEBHOOK_PATH = os.getenv("WEBHOOK_PATH")
 if not WEBHOOK_PATH or not WEBHOOK_PATH.startswith("/"):
-     logging.critical(f"Не установлена или некорректна переменная окружения WEBHOOK_PATH: '{WEBHOOK_PATH}'. Должна начинаться с '/'.")
+     logging.critical("Не установлена или некорректна переменная окружения WEBHOOK_PATH: '%s'. Должна начинаться с '/'.", WEBHOOK_PATH)
      raise ValueError("Не установлена или некорректна переменная окружения WEBHOOK_PATH.")
 
 # Порт
@@ -51,9 +102,117 @@ PORT_STR = os.getenv("PORT", "8000") # По умолчанию 8000
 try:
     PORT = int(PORT_STR)
 except ValueError:
-     logging.critical(f"Некорректное значение PORT: '{PORT_STR}'. Должно быть число.")
+     logging.critical("Некорректное значение PORT: '%s'. Должно быть число.", PORT_STR)
      raise ValueError(f"Некорректное значение PORT: '{PORT_STR}'. Должно быть число.")
 
+# --- Дедупликация входящих сообщений ---
+# Размер in-process LRU недавно сохраненных (chat_id, message_id) - повторные доставки не идут в БД
+DEDUP_CACHE_SIZE = _get_int_env("DEDUP_CACHE_SIZE", 10000)
+
+# --- Локальный спул сообщений (db/spool.py) ---
+# Если запись в БД не удалась или дольше порога, сообщение дописывается в локальный журнал
+# и переносится в БД фоновой досылкой после восстановления. Каталог должен быть на постоянном диске.
+SPOOL_ENABLED = _get_bool_env("SPOOL_ENABLED", True)
+SPOOL_DIR = os.getenv("SPOOL_DIR", "spool")
+# Порог задержки записи в БД (секунды), после которого сообщение уходит в спул (0 - без порога)
+SPOOL_LATENCY_THRESHOLD = _get_float_env("SPOOL_LATENCY_THRESHOLD", 2.0)
+# Предельный размер спула (МБ): сверх него сообщения не сохраняются
+SPOOL_MAX_MB = _get_int_env("SPOOL_MAX_MB", 1024)
+# Окно группового fsync (мс) и интервал попыток досылки (секунды)
+SPOOL_FSYNC_INTERVAL_MS = _get_int_env("SPOOL_FSYNC_INTERVAL_MS", 50)
+SPOOL_REPLAY_SECONDS = _get_float_env("SPOOL_REPLAY_SECONDS", 5.0)
+
+# --- Учет активности чатов (db/activity.py) ---
+# Интервал (секунды) записи накопленной активности в chats: одно обновление на чат за интервал
+CHAT_ACTIVITY_FLUSH_SECONDS = _get_float_env("CHAT_ACTIVITY_FLUSH_SECONDS", 10.0)
+
+# --- Настройки чатов по умолчанию (каждый чат может переопределить их командой /settings) ---
+# Час (UTC) ежедневной сводки, минимум сообщений за сутки для сводки, язык ответа модели
+DEFAULT_SUMMARY_HOUR = _get_int_env("DEFAULT_SUMMARY_HOUR", 21)
+if not 0 <= DEFAULT_SUMMARY_HOUR <= 23:
+    logging.critical("Некорректное значение DEFAULT_SUMMARY_HOUR: %s. Должно быть от 0 до 23.", DEFAULT_SUMMARY_HOUR)
+    raise ValueError(f"Некорректное значение DEFAULT_SUMMARY_HOUR: {DEFAULT_SUMMARY_HOUR}.")
+DEFAULT_MIN_MESSAGES = _get_int_env("DEFAULT_MIN_MESSAGES", 5)
+DEFAULT_SUMMARY_LANGUAGE = os.getenv("DEFAULT_SUMMARY_LANGUAGE", "ru").lower()
+
+# --- Дайджесты (недельные/месячные сводки из сохраненных ежедневных) ---
+# Автоматическая рассылка по расписанию (вручную доступны всегда: /summary week, /summary month)
+DIGEST_WEEKLY_ENABLED = _get_bool_env("DIGEST_WEEKLY_ENABLED", False)
+DIGEST_MONTHLY_ENABLED = _get_bool_env("DIGEST_MONTHLY_ENABLED", False)
+
+# --- Экстрактивный отбор сообщений для сводки ---
+# Если история не влезает в контекст модели, отправлять самые представительные сообщения дня
+# (TF-IDF + кластеризация по темам) вместо самых свежих
+SUMMARY_EXTRACTIVE_SELECTION = _get_bool_env("SUMMARY_EXTRACTIVE_SELECTION", True)
+# Сколько символов истории (от новых к старым) читается из БД кандидатами для отбора.
+# Без отбора читается ровно столько, сколько влезает в контекст модели. Больше бюджет - шире
+# выбор по всему дню, но дольше чтение и кластеризация; по умолчанию ~8 контекстов модели (15000).
+# Сообщения старше бюджета в отбор не попадают
+SUMMARY_FETCH_MAX_CHARS = _get_int_env("SUMMARY_FETCH_MAX_CHARS", 120000)
+
+# --- Сессия Bot API ---
+# Адрес собственного сервера telegram-bot-api (или локальной заглушки), пусто - api.telegram.org.
+# Перед переходом с облачного API бот должен один раз вызвать logOut
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").strip() or None
+# Сервер запущен с --local: файлы до 2000 МБ, getFile отдает локальный путь
+TELEGRAM_API_LOCAL = _get_bool_env("TELEGRAM_API_LOCAL", False)
+# Максимум одновременных соединений, таймаут запроса и keep-alive простаивающих соединений (секунды, 0 - без keep-alive)
+TELEGRAM_POOL_LIMIT = _get_int_env("TELEGRAM_POOL_LIMIT", 100)
+TELEGRAM_REQUEST_TIMEOUT = _get_float_env("TELEGRAM_REQUEST_TIMEOUT", 60.0)
+TELEGRAM_KEEPALIVE_SECONDS = _get_float_env("TELEGRAM_KEEPALIVE_SECONDS", 60.0)
+
+# --- Выгрузка истории (/export и python -m db.export) ---
+# Каталог для временных файлов выгрузки (пусто - системный временный каталог)
+EXPORT_DIR = os.getenv("EXPORT_DIR") or None
+# Уровень сжатия gzip (1 - быстрее, 9 - меньше файл)
+EXPORT_GZIP_LEVEL = _get_int_env("EXPORT_GZIP_LEVEL", 6)
+# Лимит размера файла, отправляемого в Telegram (МБ): облачный Bot API принимает до 50 МБ, локальный - до 2000 МБ
+EXPORT_MAX_UPLOAD_MB = _get_int_env("EXPORT_MAX_UPLOAD_MB", 2000 if TELEGRAM_API_LOCAL else 50)
+
+# --- Логирование ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+if LOG_LEVEL not in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"):
+    logging.critical("Некорректное значение LOG_LEVEL: '%s'.", LOG_LEVEL)
+    raise ValueError(f"Некорректное значение LOG_LEVEL: '{LOG_LEVEL}'.")
+# Формат вывода: json (структурированный) или text
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+if LOG_FORMAT not in ("json", "text"):
+    logging.critical("Некорректное значение LOG_FORMAT: '%s'. Допустимо: json, text.", LOG_FORMAT)
+    raise ValueError(f"Некорректное значение LOG_FORMAT: '{LOG_FORMAT}'.")
+# Доля сохраняемых высокочастотных записей (1.0 = все, 0.1 = каждая десятая)
+LOG_SAMPLE_RATE = _get_float_env("LOG_SAMPLE_RATE", 0.1)
+# Логгеры высокочастотных событий, к которым применяется выборка (через запятую)
+LOG_SAMPLED_LOGGERS = [name.strip() for name in os.getenv("LOG_SAMPLED_LOGGERS", "aiogram.event,aiohttp.access").split(",") if name.strip()]
+
+# --- Замер времени обработки обновлений и профилирование ---
+# Обновления дольше этого порога (мс) логируются как медленные
+SLOW_UPDATE_THRESHOLD_MS = _get_int_env("SLOW_UPDATE_THRESHOLD_MS", 1000)
+# Максимальная длительность сеанса /profile (секунды) и интервал сэмплирования (мс)
+PROFILER_MAX_SECONDS = _get_int_env("PROFILER_MAX_SECONDS", 60)
+PROFILER_INTERVAL_MS = _get_int_env("PROFILER_INTERVAL_MS", 5)
+
+# --- Режим быстрого холодного старта (scale-to-zero хостинг) ---
+# Вебхук не удаляется при остановке (иначе Telegram не разбудит сервис),
+# планировщик сводок запускается в фоне уже после того, как сервер начал принимать обновления.
+FAST_COLD_START = _get_bool_env("FAST_COLD_START", False)
+
+# --- Планировщик запросов к LLM (OpenRouter) ---
+# Максимум одновременных запросов к модели
+LLM_MAX_IN_FLIGHT = _get_int_env("LLM_MAX_IN_FLIGHT", 2)
+# Бюджет токенов в минуту (0 = без ограничения)
+LLM_TOKENS_PER_MINUTE = _get_int_env("LLM_TOKENS_PER_MINUTE", 60000)
+# Максимальная длина очереди ожидающих запросов
+LLM_MAX_QUEUE = _get_int_env("LLM_MAX_QUEUE", 200)
+# Максимальное время ожидания в очереди (секунды) для ручных и фоновых запросов
+LLM_QUEUE_TIMEOUT_INTERACTIVE = _get_int_env("LLM_QUEUE_TIMEOUT_INTERACTIVE", 120)
+LLM_QUEUE_TIMEOUT_BATCH = _get_int_env("LLM_QUEUE_TIMEOUT_BATCH", 3600)
+# Учет использования LLM (таблица llm_usage): записи сохраняются пачками раз в N секунд или по накоплении пачки
+LLM_USAGE_BATCH_SIZE = _get_int_env("LLM_USAGE_BATCH_SIZE", 50)
+LLM_USAGE_FLUSH_SECONDS = _get_float_env("LLM_USAGE_FLUSH_SECONDS", 10.0)
+
+# Токен доступа к /metrics (заголовок "Authorization: Bearer <токен>"). Не задан - эндпоинт отключен
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") or None
+
 # Опциональный секрет вебхука
 # WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
 
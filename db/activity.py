@@ -0,0 +1,98 @@
+# --- START OF FILE db/activity.py ---
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from bot.utils import metrics
+
+# Запись активности чата в БД: (chat_id, время последнего сообщения, число сообщений за этот день UTC)
+FlushActivity = Callable[[int, datetime, int], Awaitable[None]]
+
+
+class ChatActivityRecorder:
+    """
+    Учет активности чатов (chats.last_message_at и дневные счетчики) без UPSERT на каждое сообщение.
+    record() только накапливает в памяти время последнего сообщения и счетчик по (чат, день UTC);
+    фоновая задача раз в flush_interval секунд пишет одно обновление на ключ. Для активной группы
+    это одна запись строки chats за интервал вместо блокировки строки и мертвого кортежа на каждое
+    сообщение. Если БД недоступна, накопленное ждет следующей попытки.
+    """
+
+    def __init__(self, flush: FlushActivity, flush_interval: float = 10.0):
+        self.flush_fn = flush
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple[int, int], List] = {} # (chat_id, день) -> [последнее время, число]
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    def record(self, chat_id: int, at: datetime, count: int = 1):
+        """Учитывает count сообщений чата со временем at (aware UTC)."""
+        entry = self._pending.get((chat_id, at.toordinal()))
+        if entry is None:
+            self._pending[(chat_id, at.toordinal())] = [at, count]
+        else:
+            entry[0] = max(entry[0], at)
+            entry[1] += count
+        metrics.set_gauge("chat_activity_pending", len(self._pending))
+
+    def discard(self, chat_id: int):
+        """Отбрасывает накопленную активность чата (бота удалили из чата)."""
+        for key in [key for key in self._pending if key[0] == chat_id]:
+            del self._pending[key]
+        metrics.set_gauge("chat_activity_pending", len(self._pending))
+
+    async def flush(self) -> int:
+        """Записывает накопленную активность. Возвращает число записанных ключей."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            # По возрастанию дня: счетчики в БД сдвигаются по дням только вперед
+            batch = sorted(self._pending.items(), key=lambda item: (item[0][1], item[0][0]))
+            self._pending = {}
+            written = 0
+            try:
+                for (chat_id, _), (at, count) in batch:
+                    await self.flush_fn(chat_id, at, count)
+                    written += 1
+            except Exception as e:
+                # Возвращаем незаписанное (включая ключ с ошибкой) - повторим при следующем сбросе
+                for key, (at, count) in batch[written:]:
+                    entry = self._pending.setdefault(key, [at, 0])
+                    entry[0] = max(entry[0], at)
+                    entry[1] += count
+                metrics.inc("chat_activity_flush_failures_total")
+                logging.warning("Не удалось записать активность чатов (%s), отложено ключей: %s.",
+                                e, len(batch) - written)
+            metrics.set_gauge("chat_activity_pending", len(self._pending))
+            return written
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.exception("❌ Ошибка фоновой записи активности чатов: %s", e)
+
+    def start(self):
+        """Запускает фоновую запись (вызывается при старте приложения)."""
+        if self._task and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновую задачу и записывает остаток (до закрытия хранилища)."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+# --- END OF FILE db/activity.py ---
@@ -0,0 +1,219 @@
+# --- START OF FILE db/base.py ---
+
+import csv
+import io
+import json
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Iterable, List, Dict, NamedTuple, Optional, Tuple
+
+# Колонки выгрузки истории (/export, db/export.py) - одинаковые для всех бэкендов
+EXPORT_COLUMNS = ("timestamp", "username", "text", "telegram_message_id")
+ExportWriter = Callable[[bytes], Awaitable[None]]
+
+# История для сводки: блок "[HH:MM] username: text" плюс перевод строки занимает
+# len(username) + len(text) + SUMMARY_BLOCK_OVERHEAD символов; text обрезается до SUMMARY_MAX_MESSAGE_CHARS,
+# пустой текст заменяется на SUMMARY_EMPTY_TEXT (и считается его длиной)
+SUMMARY_BLOCK_OVERHEAD = 11
+SUMMARY_MAX_MESSAGE_CHARS = 1000
+SUMMARY_EMPTY_TEXT = "[пусто]"
+# (timestamp, username, text) - строка get_recent_messages
+RecentMessage = Tuple[datetime, str, str]
+
+
+class MessageRecord(NamedTuple):
+    """Сообщение для пакетной вставки (досылка из локального спула). Порядок полей совпадает с колонками messages."""
+    chat_id: int
+    username: str
+    text: str
+    timestamp: datetime
+    telegram_message_id: Optional[int]
+
+
+class LLMUsageRecord(NamedTuple):
+    """Один запрос к LLM (таблица llm_usage). Порядок полей совпадает с колонками таблицы."""
+    created_at: datetime
+    chat_id: int
+    model: str
+    purpose: str
+    outcome: str
+    prompt_tokens: Optional[int]
+    completion_tokens: Optional[int]
+    total_tokens: Optional[int]
+    cost: Optional[float]
+    latency_ms: Optional[int]
+    source_chars: int
+    sent_chars: int
+
+
+def to_utc(ts: datetime) -> datetime:
+    """Приводит datetime к aware UTC (naive считаем UTC)."""
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc)
+    if ts.tzinfo != timezone.utc:
+        return ts.astimezone(timezone.utc)
+    return ts
+
+
+def format_export_rows(rows: Iterable[Tuple], fmt: str, header: bool = False) -> bytes:
+    """
+    Форматирует строки (timestamp: datetime, username, text, telegram_message_id) в CSV или JSONL.
+    Используется бэкендами без собственной потоковой выгрузки (SQLite, in-memory).
+    """
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        if header:
+            writer.writerow(EXPORT_COLUMNS)
+        for ts, username, text, telegram_message_id in rows:
+            writer.writerow((ts.isoformat(timespec="microseconds"), username, text, "" if telegram_message_id is None else telegram_message_id))
+        return buf.getvalue().encode("utf-8")
+    lines = [
+        json.dumps({"timestamp": ts.isoformat(timespec="microseconds"), "username": username, "text": text,
+                    "telegram_message_id": telegram_message_id}, ensure_ascii=False, separators=(",", ":"))
+        for ts, username, text, telegram_message_id in rows
+    ]
+    return ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+
+
+class StorageBackend(ABC):
+    """
+    Интерфейс хранилища бота. Реализации: PostgreSQL (db/postgres.py),
+    встроенный SQLite (db/sqlite.py) и in-memory (db/memory.py).
+    Методы бэкенда НЕ перехватывают ошибки - логирование и обработку делает фасад db/db.py.
+    """
+
+    name: str = "abstract"
+
+    @abstractmethod
+    async def init(self):
+        """Открывает соединения и приводит схему к актуальной версии."""
+
+    @abstractmethod
+    async def close(self):
+        """Закрывает соединения."""
+
+    @abstractmethod
+    async def ping(self):
+        """Минимальный запрос на запись-соединении (проверка доступности БД). Ошибка пробрасывается."""
+
+    @abstractmethod
+    async def save_message(self, chat_id: int, username: str, text: str, timestamp: datetime,
+                           telegram_message_id: Optional[int] = None) -> bool:
+        """
+        Сохраняет сообщение (timestamp - aware UTC). Вставка идемпотентна по (chat_id, telegram_message_id):
+        возвращает False, если такое сообщение уже сохранено.
+        """
+
+    @abstractmethod
+    async def save_messages(self, messages: List[MessageRecord]) -> List[MessageRecord]:
+        """
+        Пакетно сохраняет сообщения (timestamp - aware UTC) одной операцией. Уже сохраненные
+        (по chat_id, telegram_message_id) пропускаются. Возвращает фактически вставленные.
+        """
+
+    @abstractmethod
+    async def update_message_text(self, chat_id: int, telegram_message_id: int, text: str, edited_at: datetime) -> bool:
+        """Обновляет текст ранее сохраненного сообщения. Возвращает False, если сообщение не найдено."""
+
+    @abstractmethod
+    async def register_chat(self, chat_id: int) -> bool:
+        """Регистрирует чат (или снова активирует). Возвращает True, если чат добавлен впервые или был неактивен."""
+
+    @abstractmethod
+    async def deactivate_chat(self, chat_id: int) -> bool:
+        """Помечает чат неактивным (бота удалили из чата). Возвращает False, если чат не найден или уже неактивен."""
+
+    @abstractmethod
+    async def record_chat_activity(self, chat_id: int, at: datetime, count: int = 1):
+        """
+        Учитывает count новых сообщений чата со временем at (aware UTC) - одним upsert, регистрируя
+        неизвестный чат. Флаг active не меняется: неактивный чат (бота удалили) снова активирует только
+        register_chat. Хранятся время последнего сообщения и счетчики за два последних дня UTC
+        (текущий и предыдущий день активности).
+        """
+
+    @abstractmethod
+    async def get_registered_chats(self) -> List[int]:
+        """Возвращает ID всех активных зарегистрированных чатов."""
+
+    @abstractmethod
+    async def get_active_chats(self, since: datetime) -> List[Tuple[int, int]]:
+        """
+        Одним запросом возвращает активные чаты с сообщениями после since: [(chat_id, recent_count)].
+        recent_count - оценка сверху числа сообщений с since по дневным счетчикам
+        (точная граница, если since не раньше начала вчерашнего дня UTC).
+        """
+
+    @abstractmethod
+    async def get_messages_for_summary(self, chat_id: int, since: datetime) -> List[Dict]:
+        """Возвращает сообщения чата начиная с since (aware UTC) по возрастанию времени."""
+
+    @abstractmethod
+    async def get_recent_messages(self, chat_id: int, since: datetime,
+                                  max_chars: int) -> Tuple[List[RecentMessage], bool]:
+        """
+        Самые свежие сообщения чата начиная с since, умещающиеся в бюджет max_chars (размер блока - см.
+        SUMMARY_BLOCK_OVERHEAD, text уже обрезан до SUMMARY_MAX_MESSAGE_CHARS). Читает от новых к старым
+        и прекращает чтение на бюджете. Возвращает (строки по возрастанию времени, complete), где
+        complete=False - часть более старых сообщений не уместилась.
+        """
+
+    @abstractmethod
+    async def export_messages(self, chat_id: int, since: datetime, until: datetime, fmt: str,
+                              write: ExportWriter) -> int:
+        """
+        Потоково выгружает сообщения чата за [since, until) в формате csv (с заголовком) или jsonl,
+        передавая данные порциями в write. Память не зависит от размера диапазона. Возвращает число строк.
+        """
+
+    @abstractmethod
+    async def save_summary(self, chat_id: int, period: str, window_start: datetime, window_end: datetime,
+                           model: str, text: str):
+        """Сохраняет сгенерированную сводку (period: day, week или month)."""
+
+    @abstractmethod
+    async def get_summaries(self, chat_id: int, period: str, since: datetime, until: datetime) -> List[Dict]:
+        """
+        Возвращает сводки чата заданного периода, окно которых закончилось в (since, until],
+        по возрастанию window_start. Ключи: period, window_start, window_end, model, text.
+        """
+
+    @abstractmethod
+    async def save_llm_usage(self, records: List[LLMUsageRecord]):
+        """Сохраняет пачку записей об использовании LLM (created_at - aware UTC)."""
+
+    @abstractmethod
+    async def get_llm_usage_stats(self, since: datetime, group_by: str) -> List[Dict]:
+        """
+        Агрегаты использования LLM с since, сгруппированные по chat (ключ - chat_id) или day
+        (ключ - дата UTC 'YYYY-MM-DD'). Ключи: key, calls, failures, prompt_tokens,
+        completion_tokens, total_tokens, cost, avg_latency_ms, source_chars, sent_chars.
+        Для chat - по убыванию total_tokens, для day - по возрастанию даты.
+        """
+
+    @abstractmethod
+    async def get_setting(self, key: str) -> Optional[str]:
+        """Возвращает значение настройки или None."""
+
+    @abstractmethod
+    async def set_setting(self, key: str, value: str):
+        """Устанавливает или обновляет значение настройки."""
+
+    @abstractmethod
+    async def delete_setting(self, key: str):
+        """Удаляет настройку (если есть)."""
+
+    @abstractmethod
+    async def get_settings_by_prefix(self, prefix: str) -> Dict[str, str]:
+        """Возвращает все настройки, ключ которых начинается с prefix."""
+
+    async def listen_settings(self, callback: Callable[[Optional[str]], None]) -> bool:
+        """
+        Подписывает callback на изменения настроек, сделанные другими инстансами (callback(key);
+        callback(None) - изменения могли быть пропущены, нужно перечитать все). Возвращает False,
+        если бэкенд не поддерживает уведомления (однонодовые SQLite и in-memory - там это не нужно).
+        """
+        return False
+
+# --- END OF FILE db/base.py ---
@@ -0,0 +1,220 @@
+# --- START OF FILE db/chat_settings.py ---
+
+import asyncio
+import logging
+from typing import Callable, Dict, NamedTuple, Optional, Set
+
+from config.config import DEFAULT_SUMMARY_HOUR, DEFAULT_MIN_MESSAGES, DEFAULT_SUMMARY_LANGUAGE
+from db import db
+from bot.utils import metrics
+
+# Настройки чатов хранятся в общей таблице settings под ключами chat:<chat_id>:<поле>.
+# Все значения держатся в памяти процесса: кэш прогревается при старте, чтение (get_chat_settings)
+# никогда не ходит в БД. Изменения пишутся в БД и сразу применяются локально; другие инстансы
+# узнают о них через PostgreSQL LISTEN/NOTIFY и перечитывают измененный ключ.
+
+KEY_PREFIX = "chat:"
+
+# Языки ответа модели: код -> название в предложном падеже для промпта ("на русском языке")
+LANGUAGES = {
+    "ru": "русском",
+    "en": "английском",
+    "uk": "украинском",
+    "de": "немецком",
+    "es": "испанском",
+}
+MAX_PROMPT_LENGTH = 4000
+
+
+class ChatSettings(NamedTuple):
+    """Настройки чата. prompt/model = None - стандартный промпт и модель по умолчанию."""
+    prompt: Optional[str] = None
+    language: str = DEFAULT_SUMMARY_LANGUAGE
+    summary_hour: int = DEFAULT_SUMMARY_HOUR # Час (UTC) ежедневной сводки
+    min_messages: int = DEFAULT_MIN_MESSAGES # Минимум сообщений за сутки для сводки
+    model: Optional[str] = None
+
+
+DEFAULTS = ChatSettings()
+
+
+def _parse_text(value: str) -> str:
+    value = value.strip()
+    if not value:
+        raise ValueError("значение не может быть пустым")
+    return value
+
+
+def _parse_prompt(value: str) -> str:
+    value = _parse_text(value)
+    if len(value) > MAX_PROMPT_LENGTH:
+        raise ValueError(f"промпт длиннее {MAX_PROMPT_LENGTH} символов")
+    return value
+
+
+def _parse_language(value: str) -> str:
+    value = value.strip().lower()
+    if value not in LANGUAGES:
+        raise ValueError(f"допустимые языки: {', '.join(LANGUAGES)}")
+    return value
+
+
+def _int_parser(low: int, high: int) -> Callable[[str], int]:
+    def parse(value: str) -> int:
+        try:
+            number = int(value)
+        except ValueError:
+            raise ValueError("ожидается целое число") from None
+        if not low <= number <= high:
+            raise ValueError(f"значение должно быть от {low} до {high}")
+        return number
+    return parse
+
+
+# Поле -> функция разбора строкового значения из БД/команды (ValueError при некорректном значении)
+FIELD_PARSERS: Dict[str, Callable[[str], object]] = {
+    "prompt": _parse_prompt,
+    "language": _parse_language,
+    "summary_hour": _int_parser(0, 23),
+    "min_messages": _int_parser(1, 100000),
+    "model": _parse_text,
+}
+
+# Пауза между попытками перечитать все настройки после ошибки БД (секунды)
+RELOAD_RETRY_SECONDS = 30
+
+_cache: Dict[int, ChatSettings] = {}
+_reloads: Set[asyncio.Task] = set()
+_retry_task: Optional[asyncio.Task] = None
+_LOAD_FAILED = object() # get_setting вернул ошибку БД (а не отсутствие ключа)
+
+
+def _setting_key(chat_id: int, field: str) -> str:
+    return f"{KEY_PREFIX}{chat_id}:{field}"
+
+
+def _parse_key(key: str):
+    """chat:<chat_id>:<поле> -> (chat_id, поле) или None для посторонних ключей."""
+    if not key.startswith(KEY_PREFIX):
+        return None
+    chat_part, _, field = key[len(KEY_PREFIX):].partition(":")
+    try:
+        chat_id = int(chat_part)
+    except ValueError:
+        return None
+    return (chat_id, field) if field in FIELD_PARSERS else None
+
+
+def _apply(chat_id: int, field: str, raw: Optional[str]):
+    """Применяет значение поля к кэшу (raw=None - сброс к значению по умолчанию)."""
+    current = _cache.get(chat_id, DEFAULTS)
+    if raw is None:
+        value = getattr(DEFAULTS, field)
+    else:
+        try:
+            value = FIELD_PARSERS[field](raw)
+        except ValueError as e:
+            logging.warning("Некорректное значение настройки %s чата %s (%s), используется значение по умолчанию.",
+                            field, chat_id, e)
+            value = getattr(DEFAULTS, field)
+    updated = current._replace(**{field: value})
+    if updated == DEFAULTS:
+        _cache.pop(chat_id, None)
+    else:
+        _cache[chat_id] = updated
+
+
+def get_chat_settings(chat_id: int) -> ChatSettings:
+    """Настройки чата из кэша (без обращения к БД)."""
+    return _cache.get(chat_id, DEFAULTS)
+
+
+async def reload_all() -> bool:
+    """Перечитывает все настройки чатов из БД. При ошибке кэш не меняется."""
+    rows = await db.get_settings_by_prefix(KEY_PREFIX)
+    if rows is None:
+        return False
+    _cache.clear()
+    for key, raw in rows.items():
+        parsed = _parse_key(key)
+        if parsed:
+            _apply(parsed[0], parsed[1], raw)
+    metrics.set_gauge("chat_settings_cached", len(_cache))
+    logging.info("Кэш настроек чатов загружен: %s чатов с нестандартными настройками.", len(_cache))
+    return True
+
+
+async def _retry_reload_all():
+    """Повторяет reload_all() до успеха; до тех пор в кэше остаются прежние значения."""
+    global _retry_task
+    try:
+        while True:
+            logging.warning("Не удалось перечитать настройки чатов, повтор через %s с.", RELOAD_RETRY_SECONDS)
+            await asyncio.sleep(RELOAD_RETRY_SECONDS)
+            if await reload_all():
+                break
+    finally:
+        _retry_task = None
+
+
+def _schedule_reload_all():
+    global _retry_task
+    if _retry_task is None or _retry_task.done():
+        _retry_task = asyncio.get_running_loop().create_task(_retry_reload_all())
+
+
+async def _reload_key(key: Optional[str]):
+    if key is None:
+        if not await reload_all():
+            _schedule_reload_all()
+        return
+    parsed = _parse_key(key)
+    if not parsed:
+        return
+    # Значение не передается в уведомлении (лимит NOTIFY ~8 КБ, промпт может быть длинным) - перечитываем
+    raw = await db.get_setting(key, on_error=_LOAD_FAILED)
+    if raw is _LOAD_FAILED:
+        # Не сбрасываем настройку к значению по умолчанию из-за сбоя БД: кэш остается, полное перечитывание - позже
+        _schedule_reload_all()
+        return
+    _apply(parsed[0], parsed[1], raw)
+    metrics.set_gauge("chat_settings_cached", len(_cache))
+    logging.debug("Настройка %s обновлена по уведомлению.", key)
+
+
+def _on_change(key: Optional[str]):
+    """Callback LISTEN/NOTIFY (вызывается синхронно из asyncpg) - перечитывание планируется задачей."""
+    metrics.inc("chat_settings_invalidations_total")
+    task = asyncio.get_running_loop().create_task(_reload_key(key))
+    _reloads.add(task)
+    task.add_done_callback(_reloads.discard)
+
+
+async def init():
+    """Прогревает кэш и подписывается на изменения из других инстансов (вызывается при старте)."""
+    if not await reload_all():
+        _schedule_reload_all()
+    if await db.listen_settings(_on_change):
+        logging.info("Изменения настроек чатов распространяются через LISTEN/NOTIFY.")
+
+
+async def set_chat_setting(chat_id: int, field: str, raw: Optional[str]) -> ChatSettings:
+    """
+    Проверяет и сохраняет поле настроек чата (raw=None - сброс к значению по умолчанию),
+    сразу обновляя локальный кэш. ValueError - некорректное поле/значение, ConnectionError - ошибка БД.
+    """
+    if field not in FIELD_PARSERS:
+        raise ValueError(f"неизвестная настройка '{field}', доступны: {', '.join(FIELD_PARSERS)}")
+    key = _setting_key(chat_id, field)
+    if raw is None:
+        saved = await db.delete_setting(key)
+    else:
+        value = FIELD_PARSERS[field](raw)
+        saved = await db.set_setting(key, str(value))
+    if not saved:
+        raise ConnectionError(f"не удалось сохранить настройку '{field}'")
+    _apply(chat_id, field, None if raw is None else str(value))
+    metrics.set_gauge("chat_settings_cached", len(_cache))
+    return get_chat_settings(chat_id)
+
+# --- END OF FILE db/chat_settings.py ---
@@ -1,257 +1,376 @@
 # --- START OF FILE db.py ---
 
-import asyncpg
+import asyncio
 import logging
-from datetime import datetime, timezone
-from typing import List, Dict, Optional # Используем typing для подсказок
+from datetime import datetime
+from typing import Callable, List, Dict, Optional, Tuple # Используем typing для подсказок
 
-# Импортируем URL из конфигурации
-from config.config import DATABASE_URL
+# Импортируем настройки хранилища из конфигурации
+from config.config import (
+    STORAGE_BACKEND, DATABASE_URL, DATABASE_READ_URL, SQLITE_PATH, DEDUP_CACHE_SIZE,
+    DB_WRITE_POOL_MIN, DB_WRITE_POOL_MAX, DB_WRITE_COMMAND_TIMEOUT, DB_WRITE_ACQUIRE_TIMEOUT,
+    DB_READ_POOL_MIN, DB_READ_POOL_MAX, DB_READ_COMMAND_TIMEOUT, DB_READ_ACQUIRE_TIMEOUT,
+    DB_EXPORT_TIMEOUT,
+    SPOOL_ENABLED, SPOOL_DIR, SPOOL_LATENCY_THRESHOLD, SPOOL_MAX_MB, SPOOL_FSYNC_INTERVAL_MS, SPOOL_REPLAY_SECONDS,
+    CHAT_ACTIVITY_FLUSH_SECONDS,
+)
+from db.base import StorageBackend, LLMUsageRecord, MessageRecord, RecentMessage, to_utc
+from db.spool import MessageSpool
+from db.activity import ChatActivityRecorder
+from bot.utils import metrics
+from bot.utils.dedup import RecentlySeen
+
+# Текущий бэкенд хранилища (выбирается по STORAGE_BACKEND в init_pool)
+storage: Optional[StorageBackend] = None
+
+# Недавно сохраненные (chat_id, telegram_message_id): повторные доставки Telegram пропускаются без запроса к БД
+_recent_messages = RecentlySeen(DEDUP_CACHE_SIZE)
+
+
+async def _flush_activity(chat_id: int, at: datetime, count: int):
+    await _get_storage().record_chat_activity(chat_id, at, count)
+
+# Активность чатов копится в памяти и пишется в БД раз в CHAT_ACTIVITY_FLUSH_SECONDS (запускается в main.py)
+chat_activity = ChatActivityRecorder(_flush_activity, flush_interval=CHAT_ACTIVITY_FLUSH_SECONDS)
+
+
+async def _save_spooled(messages: List[MessageRecord]) -> int:
+    inserted = await _get_storage().save_messages(messages)
+    # Активность чатов - только по фактически вставленным: сообщение, чья вставка все же прошла
+    # до таймаута, или сегмент, повторно досылаемый после сбоя, не учитываются дважды
+    for message in inserted:
+        chat_activity.record(message.chat_id, message.timestamp)
+    return len(inserted)
+
+
+async def _apply_spooled_edit(message: MessageRecord, edited_at: datetime) -> int:
+    """Применяет правку из спула; если исходного сообщения в БД нет - сохраняет правленый текст как новое."""
+    if await _get_storage().update_message_text(message.chat_id, message.telegram_message_id, message.text, edited_at):
+        return 0
+    return await _save_spooled([message])
+
+# Локальный спул для сообщений, которые не удалось быстро сохранить в БД (запускается в main.py)
+spool: Optional[MessageSpool] = MessageSpool(
+    SPOOL_DIR, _save_spooled, _apply_spooled_edit, probe=lambda: _get_storage().ping(), max_bytes=SPOOL_MAX_MB * 1024 * 1024,
+    fsync_interval=SPOOL_FSYNC_INTERVAL_MS / 1000, replay_interval=SPOOL_REPLAY_SECONDS,
+) if SPOOL_ENABLED else None
+
+
+def create_storage(backend_name: str) -> StorageBackend:
+    """Создает бэкенд хранилища по имени: postgres, sqlite или memory."""
+    if backend_name == "postgres":
+        from db.postgres import PostgresStorage, PoolSettings # asyncpg нужен только для PostgreSQL
+        return PostgresStorage(
+            DATABASE_URL, read_dsn=DATABASE_READ_URL,
+            write_pool=PoolSettings(DB_WRITE_POOL_MIN, DB_WRITE_POOL_MAX, DB_WRITE_COMMAND_TIMEOUT, DB_WRITE_ACQUIRE_TIMEOUT),
+            read_pool=PoolSettings(DB_READ_POOL_MIN, DB_READ_POOL_MAX, DB_READ_COMMAND_TIMEOUT, DB_READ_ACQUIRE_TIMEOUT),
+            export_timeout=DB_EXPORT_TIMEOUT,
+        )
+    if backend_name == "sqlite":
+        from db.sqlite import SQLiteStorage
+        return SQLiteStorage(SQLITE_PATH)
+    if backend_name == "memory":
+        from db.memory import InMemoryStorage
+        return InMemoryStorage()
+    raise ValueError(f"Неизвестный бэкенд хранилища: '{backend_name}'")
 
-# Определяем тип пула для подсказок
-PoolType = Optional[asyncpg.Pool]
-pool: PoolType = None
 
 async def init_pool():
-    """Инициализирует пул соединений с БД и создает таблицы/индексы, если их нет."""
-    global pool
-    if pool:
-        logging.warning("Пул БД уже инициализирован.")
+    """Создает выбранный бэкенд хранилища, открывает соединения и применяет миграции схемы."""
+    global storage
+    if storage:
+        logging.warning("Хранилище уже инициализировано.")
         return
     try:
-        # Логируем хост БД без учетных данных для безопасности
-        db_host_info = DATABASE_URL.split('@')[-1] if '@' in DATABASE_URL else DATABASE_URL
-        logging.info(f"Подключение к БД: {db_host_info}")
-        # Создаем пул соединений
-        pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=10, command_timeout=60)
-        if not pool:
-             logging.critical("Не удалось создать пул соединений с БД (pool is None).")
-             raise ConnectionError("Failed to create database pool")
-        logging.info("Пул соединений с БД успешно инициализирован.")
-
-        # Получаем соединение для проверки/создания таблиц
-        async with pool.acquire() as conn:
-            logging.info("Проверка и создание таблиц...")
-            # Таблица сообщений
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    message_internal_id SERIAL PRIMARY KEY, -- Внутренний ID сообщения
-                    chat_id      BIGINT       NOT NULL,
-                    username     TEXT         NOT NULL,
-                    text         TEXT         NOT NULL,
-                    "timestamp"  TIMESTAMPTZ  NOT NULL     -- Используем кавычки, т.к. timestamp - ключевое слово
-                );
-            """)
-            # Таблица настроек
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS settings (
-                    key   TEXT PRIMARY KEY,
-                    value TEXT NOT NULL
-                );
-            """)
-            # Таблица зарегистрированных чатов
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS chats (
-                    chat_id BIGINT PRIMARY KEY
-                );
-            """)
-            logging.info("Таблицы проверены/созданы.")
-
-            # Создание индексов для ускорения выборок
-            logging.info("Проверка и создание индексов...")
-            # Индекс для выборки сообщений по чату и времени (важен для сводок)
-            await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_messages_chat_id_timestamp ON messages (chat_id, "timestamp" DESC);
-            """)
-            # Индекс для выборки по времени (может быть полезен)
-            await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages ("timestamp" DESC);
-            """)
-            logging.info("Индексы проверены/созданы.")
-
+        backend = create_storage(STORAGE_BACKEND)
+        await backend.init()
+        storage = backend
+        logging.info("Хранилище '%s' успешно инициализировано.", backend.name)
     except Exception as e:
-        logging.exception(f"❌ Критическая ошибка при инициализации БД: {e}")
-        pool = None # Сбрасываем пул при ошибке
+        logging.exception("❌ Критическая ошибка при инициализации БД: %s", e)
+        storage = None # Сбрасываем хранилище при ошибке
         raise # Передаем исключение выше, чтобы остановить запуск приложения
 
 async def close_pool():
-    """Закрывает пул соединений с БД."""
-    global pool
-    if pool:
-        logging.info("Закрытие пула соединений с БД...")
+    """Закрывает соединения хранилища."""
+    global storage
+    if storage:
         try:
-            await pool.close()
-            logging.info("🛑 Пул соединений с БД успешно закрыт.")
+            await storage.close()
         except Exception as e:
-            logging.exception(f"❌ Ошибка при закрытии пула БД: {e}")
+            logging.exception("❌ Ошибка при закрытии хранилища: %s", e)
         finally:
-            pool = None # Гарантированно сбрасываем пул
+            storage = None # Гарантированно сбрасываем хранилище
     else:
-        logging.warning("Попытка закрыть неинициализированный или уже закрытый пул БД.")
+        logging.warning("Попытка закрыть неинициализированное или уже закрытое хранилище.")
 
 
-async def _get_connection() -> asyncpg.Connection:
-    """Вспомогательная функция для получения соединения из пула с проверкой."""
-    if not pool:
-        logging.error("Пул БД не инициализирован! Невозможно получить соединение.")
-        raise ConnectionError("Database pool is not initialized or already closed")
-    try:
-        # Получаем соединение с таймаутом
-        conn = await pool.acquire(timeout=10)
-        if not conn:
-             raise ConnectionError("Failed to acquire connection from pool (timeout or pool closed)")
-        return conn
-    except Exception as e:
-        logging.exception("Не удалось получить соединение из пула БД.")
-        raise ConnectionError("Failed to acquire connection from pool") from e
+def _get_storage() -> StorageBackend:
+    if not storage:
+        logging.error("Хранилище не инициализировано! Невозможно выполнить запрос.")
+        raise ConnectionError("Storage is not initialized or already closed")
+    return storage
+
+
+def is_recently_saved(chat_id: int, telegram_message_id: int) -> bool:
+    """Проверяет по in-process LRU, было ли сообщение уже сохранено (повторная доставка)."""
+    if (chat_id, telegram_message_id) in _recent_messages:
+        metrics.inc("ingest_duplicates_total", source="lru")
+        return True
+    return False
+
+
+async def save_message(chat_id: int, username: str, text: str, timestamp: datetime,
+                       telegram_message_id: Optional[int] = None):
+    """Сохраняет сообщение (время приводится к aware UTC). Повторы по telegram_message_id игнорируются."""
+    if telegram_message_id is not None and is_recently_saved(chat_id, telegram_message_id):
+        logging.debug("Сообщение %s чата %s уже сохранено (LRU), пропускаем.", telegram_message_id, chat_id)
+        return
+    # Убеждаемся, что время aware и в UTC (это остается важным!)
+    await _save_record(MessageRecord(chat_id, username, text, to_utc(timestamp), telegram_message_id))
+
+
+async def _save_record(message: MessageRecord):
+    """Сохраняет сообщение (без проверки LRU): в БД или, если спул включен, при необходимости в спул."""
+    chat_id, _, _, timestamp, telegram_message_id = message
+    if spool is None:
+        try:
+            inserted = await _get_storage().save_message(*message)
+        except Exception as e:
+            logging.exception("❌ Ошибка при сохранении сообщения в чате %s: %s", chat_id, e)
+            return
+        if inserted:
+            chat_activity.record(chat_id, timestamp)
+    else:
+        inserted = await _save_message_or_spool(message)
+        if inserted is None:
+            return
+    if telegram_message_id is not None:
+        _recent_messages.add((chat_id, telegram_message_id))
+    if not inserted:
+        metrics.inc("ingest_duplicates_total", source="db")
+        logging.debug("Сообщение %s чата %s уже было в БД, дубликат пропущен.", telegram_message_id, chat_id)
+
 
-async def _release_connection(conn: asyncpg.Connection):
-    """Вспомогательная функция для безопасного возвращения соединения в пул."""
-    if pool and conn and not conn.is_closed():
+async def _save_message_or_spool(message: MessageRecord) -> Optional[bool]:
+    """
+    Сохраняет сообщение в БД, а при ошибке, превышении SPOOL_LATENCY_THRESHOLD или пока спул
+    в режиме деградации - в локальный спул (досылается позже). None - сообщение потеряно.
+    """
+    reason = "degraded"
+    if not spool.degraded:
         try:
-            await pool.release(conn, timeout=5)
+            save = _get_storage().save_message(*message)
+            if SPOOL_LATENCY_THRESHOLD > 0:
+                save = asyncio.wait_for(save, SPOOL_LATENCY_THRESHOLD)
+            inserted = await save
+            if inserted:
+                # Только в памяти: запись в БД - фоновым сбросом, обработчик ее не ждет
+                chat_activity.record(message.chat_id, message.timestamp)
+            return inserted
+        except asyncio.TimeoutError:
+            reason = "slow"
+            logging.warning("Запись сообщения чата %s дольше %s с, сообщение отправлено в спул.",
+                            message.chat_id, SPOOL_LATENCY_THRESHOLD)
         except Exception as e:
-            logging.exception(f"Ошибка при возврате соединения в пул: {e}")
-            try:
-                await conn.close()
-            except Exception as close_exc:
-                 logging.exception(f"Ошибка при принудительном закрытии соединения: {close_exc}")
-    elif not pool:
-         logging.warning("Попытка вернуть соединение при неинициализированном пуле.")
-
-
-# ----> ИСПРАВЛЕННАЯ ВЕРСИЯ save_message <----
-async def save_message(chat_id: int, username: str, text: str, timestamp: datetime):
-    """Сохраняет сообщение, передавая объект aware datetime в БД с явным кастом типа."""
-    conn: Optional[asyncpg.Connection] = None
+            reason = "error"
+            logging.warning("Ошибка при сохранении сообщения в чате %s (%s), сообщение отправлено в спул.",
+                            message.chat_id, e)
+        # Следующие сообщения сразу идут в спул, пока досылка не подтвердит, что БД снова доступна
+        spool.degraded = True
     try:
-        conn = await _get_connection()
-        # 1. Убеждаемся, что время aware и в UTC (это остается важным!)
-        if timestamp.tzinfo is None:
-            timestamp = timestamp.replace(tzinfo=timezone.utc)
-        elif timestamp.tzinfo != timezone.utc:
-            timestamp = timestamp.astimezone(timezone.utc)
-
-        # 2. Передаем объект datetime в запрос, НО добавляем каст ::TIMESTAMPTZ в SQL
-        await conn.execute(
-            """
-            INSERT INTO messages(chat_id, username, text, "timestamp")
-            -- Добавляем ::TIMESTAMPTZ к параметру $4, чтобы помочь PostgreSQL
-            VALUES($1, $2, $3, $4::TIMESTAMPTZ)
-            """,
-            chat_id, username, text, timestamp # Передаем ОБЪЕКТ datetime
-        )
-    except asyncpg.exceptions.DataError as de:
-         # Ловим ошибку данных, если проблема с типами осталась
-         logging.exception(f"❌ Ошибка данных asyncpg при сохранении сообщения в чате {chat_id}: {de}. Аргумент $4: {timestamp} (tz={timestamp.tzinfo}), тип: {type(timestamp)}")
+        await spool.append(message, reason)
+    except Exception as e:
+        logging.exception("❌ Не удалось записать сообщение чата %s в спул, сообщение потеряно: %s", message.chat_id, e)
+        return None
+    return True
+
+
+async def update_message_text(chat_id: int, telegram_message_id: int, text: str, edited_at: datetime) -> Optional[bool]:
+    """Обновляет текст отредактированного сообщения. False - сообщение не найдено, None - ошибка БД."""
+    try:
+        return await _get_storage().update_message_text(chat_id, telegram_message_id, text, to_utc(edited_at))
+    except Exception as e:
+        logging.exception("❌ Ошибка при обновлении сообщения %s в чате %s: %s", telegram_message_id, chat_id, e)
+        return None
+
+
+async def save_message_edit(chat_id: int, username: str, text: str, timestamp: datetime,
+                            telegram_message_id: int, edited_at: datetime):
+    """
+    Сохраняет правку сообщения: обновляет текст в БД, а если исходного сообщения там нет - сохраняет
+    правленый текст как новое. При ошибке БД, в режиме деградации или пока в спуле есть недосланные
+    записи (исходное сообщение может ждать там) правка пишется в спул и применяется при досылке.
+    """
+    message = MessageRecord(chat_id, username, text, to_utc(timestamp), telegram_message_id)
+    edited_at = to_utc(edited_at)
+    if spool is None or not (spool.degraded or spool.pending):
+        updated = await update_message_text(chat_id, telegram_message_id, text, edited_at)
+        if updated:
+            logging.debug("Сообщение %s чата %s обновлено после редактирования.", telegram_message_id, chat_id)
+            return
+        if updated is False:
+            # Исходного сообщения нет (например, бот был добавлен позже) - сохраняем как новое, минуя LRU
+            await _save_record(message)
+            return
+        if spool is None:
+            logging.error("❌ Правка сообщения %s чата %s не сохранена: БД недоступна.", telegram_message_id, chat_id)
+            return
+        spool.degraded = True
+    try:
+        await spool.append(message, "edit", edited_at=edited_at)
     except Exception as e:
-        # Ловим другие ошибки
-        logging.exception(f"❌ Ошибка при сохранении сообщения в чате {chat_id}: {e}")
-    finally:
-        if conn: await _release_connection(conn)
+        logging.exception("❌ Не удалось записать правку сообщения %s чата %s в спул, правка потеряна: %s",
+                          telegram_message_id, chat_id, e)
 
 
 async def register_chat(chat_id: int):
-    """Регистрирует чат для последующей обработки."""
-    conn: Optional[asyncpg.Connection] = None
+    """Регистрирует чат для последующей обработки (или снова активирует, если бот вернулся в чат)."""
     try:
-        conn = await _get_connection()
-        result = await conn.execute(
-            "INSERT INTO chats(chat_id) VALUES($1) ON CONFLICT(chat_id) DO NOTHING",
-            chat_id
-        )
-        # Проверяем результат команды INSERT
-        if result == "INSERT 0 1":
-            logging.info(f"Чат {chat_id} успешно зарегистрирован.")
+        if await _get_storage().register_chat(chat_id):
+            logging.info("Чат %s успешно зарегистрирован.", chat_id)
     except Exception as e:
-        logging.exception(f"❌ Ошибка при регистрации чата {chat_id}: {e}")
-    finally:
-        if conn: await _release_connection(conn)
+        logging.exception("❌ Ошибка при регистрации чата %s: %s", chat_id, e)
+
+
+async def deactivate_chat(chat_id: int):
+    """Помечает чат неактивным (бота удалили из чата): он больше не попадает в рассылки и /chats."""
+    chat_activity.discard(chat_id)
+    try:
+        if await _get_storage().deactivate_chat(chat_id):
+            logging.info("Чат %s помечен неактивным.", chat_id)
+    except Exception as e:
+        logging.exception("❌ Ошибка при деактивации чата %s: %s", chat_id, e)
 
 
 async def get_registered_chats() -> List[int]:
-    """Получает список ID всех зарегистрированных чатов."""
-    conn: Optional[asyncpg.Connection] = None
-    chats = []
+    """Получает список ID всех активных зарегистрированных чатов."""
+    try:
+        return await _get_storage().get_registered_chats()
+    except Exception as e:
+        logging.exception("❌ Ошибка при получении списка зарегистрированных чатов: %s", e)
+        return []
+
+
+async def get_active_chats(since: datetime) -> List[Tuple[int, int]]:
+    """Активные чаты с сообщениями после since (aware UTC): [(chat_id, оценка сверху числа сообщений)]."""
     try:
-        conn = await _get_connection()
-        rows = await conn.fetch("SELECT chat_id FROM chats")
-        chats = [r["chat_id"] for r in rows]
+        # Сначала дописываем накопленную в памяти активность, чтобы выборка ее учитывала
+        await chat_activity.flush()
+        return await _get_storage().get_active_chats(to_utc(since))
     except Exception as e:
-        logging.exception(f"❌ Ошибка при получении списка зарегистрированных чатов: {e}")
-    finally:
-        if conn: await _release_connection(conn)
-    return chats
+        logging.exception("❌ Ошибка при получении активных чатов: %s", e)
+        return []
 
 
 async def get_messages_for_summary(chat_id: int, since: datetime) -> List[Dict]:
     """Получает сообщения для саммари из указанного чата с указанного времени (aware UTC)."""
-    conn: Optional[asyncpg.Connection] = None
-    messages = []
+    if since.tzinfo is None:
+        logging.warning("Получено naive datetime (%s) в get_messages_for_summary, преобразуем в UTC.", since)
+    since = to_utc(since)
     try:
-        conn = await _get_connection()
-        # Убеждаемся, что `since` - aware UTC перед передачей в запрос
-        if since.tzinfo is None:
-            logging.warning(f"Получено naive datetime ({since}) в get_messages_for_summary, преобразуем в UTC.")
-            since = since.replace(tzinfo=timezone.utc)
-        elif since.tzinfo != timezone.utc:
-            logging.warning(f"Получено non-UTC aware datetime ({since.tzinfo}) в get_messages_for_summary, преобразуем в UTC.")
-            since = since.astimezone(timezone.utc)
-
-        # Явно приводим тип параметра $2 к TIMESTAMPTZ для PostgreSQL
-        rows = await conn.fetch(
-            """
-            SELECT username, text, "timestamp"
-            FROM messages
-            WHERE chat_id = $1 AND "timestamp" >= $2::TIMESTAMPTZ
-            ORDER BY "timestamp" ASC
-            """,
-            chat_id, since # Передаем подготовленный aware UTC datetime
-        )
-        messages = [
-            {"username": r["username"], "text": r["text"], "timestamp": r["timestamp"]}
-            for r in rows
-        ]
-    except asyncpg.exceptions.DataError as de:
-         logging.exception(f"❌ Ошибка данных asyncpg при получении сообщений для сводки чата {chat_id} с {since}: {de}. Аргумент $2: {since} (tz={since.tzinfo})")
-         logging.error(f"Тип аргумента 'since': {type(since)}")
+        return await _get_storage().get_messages_for_summary(chat_id, since)
     except Exception as e:
-        logging.exception(f"❌ Ошибка при получении сообщений для сводки чата {chat_id} с {since}: {e}")
-    finally:
-        if conn: await _release_connection(conn)
-    return messages
+        logging.exception("❌ Ошибка при получении сообщений для сводки чата %s с %s: %s", chat_id, since, e)
+        return []
 
 
-async def get_setting(key: str) -> Optional[str]:
-    """Получает значение настройки по ключу."""
-    conn: Optional[asyncpg.Connection] = None
-    value = None
+async def get_recent_messages(chat_id: int, since: datetime, max_chars: int) -> Tuple[List[RecentMessage], bool]:
+    """
+    Самые свежие сообщения чата с since (aware UTC), умещающиеся в бюджет max_chars символов истории:
+    ([(timestamp, username, text), ...] по возрастанию времени, complete). При ошибке - ([], True).
+    """
     try:
-        conn = await _get_connection()
-        value = await conn.fetchval("SELECT value FROM settings WHERE key = $1", key)
+        return await _get_storage().get_recent_messages(chat_id, to_utc(since), max_chars)
     except Exception as e:
-        logging.exception(f"❌ Ошибка при получении настройки '{key}': {e}")
-    finally:
-        if conn: await _release_connection(conn)
-    return value
+        logging.exception("❌ Ошибка при получении последних сообщений чата %s с %s: %s", chat_id, since, e)
+        return [], True
 
 
-async def set_setting(key: str, value: str):
-    """Устанавливает или обновляет значение настройки."""
-    conn: Optional[asyncpg.Connection] = None
+async def save_summary(chat_id: int, period: str, window_start: datetime, window_end: datetime,
+                       model: str, text: str):
+    """Сохраняет сгенерированную сводку/дайджест (period: day, week, month)."""
     try:
-        conn = await _get_connection()
-        await conn.execute(
-            """
-            INSERT INTO settings(key, value)
-            VALUES($1, $2)
-            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
-            """,
-            key, value
-        )
+        await _get_storage().save_summary(chat_id, period, to_utc(window_start), to_utc(window_end), model, text)
+    except Exception as e:
+        logging.exception("❌ Ошибка при сохранении сводки (%s) для чата %s: %s", period, chat_id, e)
+
+
+async def get_summaries(chat_id: int, period: str, since: datetime, until: datetime) -> List[Dict]:
+    """Получает сохраненные сводки чата заданного периода, окно которых закончилось в (since, until]."""
+    try:
+        return await _get_storage().get_summaries(chat_id, period, to_utc(since), to_utc(until))
+    except Exception as e:
+        logging.exception("❌ Ошибка при получении сводок (%s) для чата %s: %s", period, chat_id, e)
+        return []
+
+
+async def save_llm_usage(records: List[LLMUsageRecord]) -> bool:
+    """Сохраняет пачку записей об использовании LLM. Возвращает False при ошибке (вызывающий может повторить)."""
+    try:
+        await _get_storage().save_llm_usage(records)
+        return True
+    except Exception as e:
+        logging.exception("❌ Ошибка при сохранении %s записей об использовании LLM: %s", len(records), e)
+        return False
+
+
+async def get_llm_usage_stats(since: datetime, group_by: str) -> List[Dict]:
+    """Получает агрегаты использования LLM с since по чатам (group_by='chat') или дням (group_by='day')."""
+    try:
+        return await _get_storage().get_llm_usage_stats(to_utc(since), group_by)
+    except Exception as e:
+        logging.exception("❌ Ошибка при получении статистики использования LLM: %s", e)
+        return []
+
+
+async def get_setting(key: str, on_error=None) -> Optional[str]:
+    """
+    Получает значение настройки по ключу (None - ключа нет). При ошибке БД возвращает on_error:
+    вызывающий, которому важно отличить отсутствие ключа от сбоя, передает свой маркер.
+    """
+    try:
+        return await _get_storage().get_setting(key)
+    except Exception as e:
+        logging.exception("❌ Ошибка при получении настройки '%s': %s", key, e)
+        return on_error
+
+
+async def set_setting(key: str, value: str) -> bool:
+    """Устанавливает или обновляет значение настройки. Возвращает False при ошибке."""
+    try:
+        await _get_storage().set_setting(key, value)
+        return True
+    except Exception as e:
+        logging.exception("❌ Ошибка при установке настройки '%s': %s", key, e)
+        return False
+
+
+async def delete_setting(key: str) -> bool:
+    """Удаляет настройку. Возвращает False при ошибке."""
+    try:
+        await _get_storage().delete_setting(key)
+        return True
+    except Exception as e:
+        logging.exception("❌ Ошибка при удалении настройки '%s': %s", key, e)
+        return False
+
+
+async def get_settings_by_prefix(prefix: str) -> Optional[Dict[str, str]]:
+    """Получает все настройки с ключом, начинающимся с prefix. None - при ошибке."""
+    try:
+        return await _get_storage().get_settings_by_prefix(prefix)
+    except Exception as e:
+        logging.exception("❌ Ошибка при получении настроек '%s*': %s", prefix, e)
+        return None
+
+
+async def listen_settings(callback: Callable[[Optional[str]], None]) -> bool:
+    """Подписывает callback на изменения настроек из других инстансов (если бэкенд умеет)."""
+    try:
+        return await _get_storage().listen_settings(callback)
     except Exception as e:
-        logging.exception(f"❌ Ошибка при установке настройки '{key}': {e}")
-    finally:
-        if conn: await _release_connection(conn)
+        logging.exception("❌ Ошибка при подписке на изменения настроек: %s", e)
+        return False
 
 # --- END OF FILE db.py ---
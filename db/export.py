@@ -0,0 +1,99 @@
+# --- START OF FILE db/export.py ---
+
+"""
+Потоковая выгрузка истории чата в CSV/JSONL со сжатием gzip.
+
+Строки идут из хранилища порциями (для PostgreSQL - напрямую из COPY ... TO STDOUT),
+сжимаются на лету и пишутся во временный файл на диске, поэтому память не зависит
+от размера диапазона. Используется админ-командой /export и как CLI для резервных копий:
+
+    python -m db.export -1001234567890 --from 2024-01-01 --to 2024-12-31 --format jsonl -o backup.jsonl.gz
+"""
+
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from config.config import EXPORT_DIR, EXPORT_GZIP_LEVEL
+from db.base import to_utc
+from db import db
+
+EXPORT_FORMATS = ("csv", "jsonl")
+
+
+def parse_export_date(value: str, end: bool = False) -> datetime:
+    """
+    Разбирает дату (YYYY-MM-DD) или дату-время в ISO формате (naive считаем UTC).
+    Для конца диапазона голая дата включается целиком (граница - начало следующего дня).
+    """
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return to_utc(parsed)
+
+
+async def export_to_file(chat_id: int, since: datetime, until: datetime, fmt: str = "csv",
+                         path: Optional[str] = None) -> Tuple[str, int]:
+    """
+    Выгружает сообщения чата за [since, until) в gzip-файл. Без path создается временный файл
+    в EXPORT_DIR (удалить его - забота вызывающего). Возвращает (путь, число строк).
+    Ошибки хранилища пробрасываются; недописанный файл при этом удаляется.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: '{fmt}'")
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix=f"export_{chat_id}_", suffix=f".{fmt}.gz", dir=EXPORT_DIR)
+        raw = os.fdopen(fd, "wb")
+    else:
+        raw = open(path, "wb")
+    try:
+        with raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=EXPORT_GZIP_LEVEL) as gz:
+            async def write(chunk: bytes):
+                # Сжатие и запись на диск - в потоке, чтобы не блокировать event loop на больших выгрузках
+                await asyncio.to_thread(gz.write, chunk)
+
+            rows = await db._get_storage().export_messages(chat_id, to_utc(since), to_utc(until), fmt, write)
+    except BaseException:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    logging.info("Выгрузка чата %s (%s, %s строк) записана в %s (%s байт).",
+                 chat_id, fmt, rows, path, os.path.getsize(path))
+    return path, rows
+
+
+async def _main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Выгрузка истории чата в CSV/JSONL (gzip).")
+    parser.add_argument("chat_id", type=int)
+    parser.add_argument("--from", dest="since", help="начало диапазона (YYYY-MM-DD или ISO), по умолчанию - сутки назад")
+    parser.add_argument("--to", dest="until", help="конец диапазона (дата включительно), по умолчанию - сейчас")
+    parser.add_argument("--format", dest="fmt", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("-o", "--output", help="файл результата (по умолчанию export_<chat_id>_<from>.<format>.gz)")
+    args = parser.parse_args(argv)
+
+    until = parse_export_date(args.until, end=True) if args.until else datetime.now(timezone.utc)
+    since = parse_export_date(args.since) if args.since else until - timedelta(days=1)
+    output = args.output or f"export_{args.chat_id}_{since.strftime('%Y%m%d')}.{args.fmt}.gz"
+
+    await db.init_pool()
+    try:
+        path, rows = await export_to_file(args.chat_id, since, until, args.fmt, path=output)
+    finally:
+        await db.close_pool()
+    print(f"{rows} rows -> {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    sys.exit(asyncio.run(_main()))
+
+# --- END OF FILE db/export.py ---
@@ -0,0 +1,227 @@
+# --- START OF FILE db/memory.py ---
+
+import bisect
+import logging
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple
+
+from db.base import (
+    StorageBackend, ExportWriter, LLMUsageRecord, MessageRecord, RecentMessage,
+    SUMMARY_BLOCK_OVERHEAD, SUMMARY_MAX_MESSAGE_CHARS, SUMMARY_EMPTY_TEXT, format_export_rows,
+)
+
+# Размер порции строк при потоковой выгрузке
+EXPORT_BATCH_SIZE = 2000
+
+
+class InMemoryStorage(StorageBackend):
+    """
+    Хранилище в памяти процесса - для тестов и бенчмарков. Данные теряются при перезапуске.
+    Сообщения каждого чата хранятся отсортированными по времени, поэтому выборка
+    за период - это бинарный поиск и срез.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self._initialized = False
+        # chat_id -> ([timestamp...], [[username, text, timestamp, telegram_message_id]...]) - параллельные списки для bisect
+        self._messages: Dict[int, Tuple[List[datetime], List[list]]] = {}
+        # (chat_id, telegram_message_id) -> строка сообщения (тот же list, что и в _messages) - для дедупликации и правок
+        self._by_telegram_id: Dict[Tuple[int, int], list] = {}
+        # chat_id -> [active, last_message_at, activity_day (ordinal дня UTC), day_count, prev_day_count];
+        # dict сохраняет порядок регистрации
+        self._chats: Dict[int, list] = {}
+        self._settings: Dict[str, str] = {}
+        self._summaries: Dict[Tuple[int, str], List[Dict]] = {}
+        self._llm_usage: List[LLMUsageRecord] = []
+
+    async def init(self):
+        if self._initialized:
+            logging.warning("In-memory хранилище уже инициализировано.")
+            return
+        self._initialized = True
+        logging.info("Используется in-memory хранилище (данные не сохраняются между перезапусками).")
+
+    async def close(self):
+        self._initialized = False
+
+    async def ping(self):
+        self._check()
+
+    def _check(self):
+        if not self._initialized:
+            raise ConnectionError("In-memory storage is not initialized or already closed")
+
+    async def save_message(self, chat_id: int, username: str, text: str, timestamp: datetime,
+                           telegram_message_id: Optional[int] = None) -> bool:
+        self._check()
+        if telegram_message_id is not None and (chat_id, telegram_message_id) in self._by_telegram_id:
+            return False
+        timestamps, rows = self._messages.setdefault(chat_id, ([], []))
+        row = [username, text, timestamp, telegram_message_id]
+        # Сообщения почти всегда приходят по порядку - тогда это просто append
+        index = bisect.bisect_right(timestamps, timestamp)
+        timestamps.insert(index, timestamp)
+        rows.insert(index, row)
+        if telegram_message_id is not None:
+            self._by_telegram_id[(chat_id, telegram_message_id)] = row
+        return True
+
+    async def save_messages(self, messages: List[MessageRecord]) -> List[MessageRecord]:
+        return [message for message in messages if await self.save_message(*message)]
+
+    async def update_message_text(self, chat_id: int, telegram_message_id: int, text: str, edited_at: datetime) -> bool:
+        self._check()
+        row = self._by_telegram_id.get((chat_id, telegram_message_id))
+        if row is None:
+            return False
+        row[1] = text
+        return True
+
+    async def register_chat(self, chat_id: int) -> bool:
+        self._check()
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            self._chats[chat_id] = [True, None, None, 0, 0]
+            return True
+        if chat[0]:
+            return False
+        chat[0] = True
+        return True
+
+    async def deactivate_chat(self, chat_id: int) -> bool:
+        self._check()
+        chat = self._chats.get(chat_id)
+        if chat is None or not chat[0]:
+            return False
+        chat[0] = False
+        return True
+
+    async def record_chat_activity(self, chat_id: int, at: datetime, count: int = 1):
+        self._check()
+        chat = self._chats.setdefault(chat_id, [True, None, None, 0, 0])
+        day = at.date().toordinal()
+        chat[1] = at if chat[1] is None else max(chat[1], at)
+        current = chat[2]
+        if current is None or day > current:
+            chat[4] = chat[3] if current == day - 1 else 0
+            chat[2], chat[3] = day, count
+        elif day == current:
+            chat[3] += count
+        elif day == current - 1:
+            chat[4] += count
+
+    async def get_registered_chats(self) -> List[int]:
+        self._check()
+        return [chat_id for chat_id, chat in self._chats.items() if chat[0]]
+
+    async def get_active_chats(self, since: datetime) -> List[Tuple[int, int]]:
+        self._check()
+        since_day = since.date().toordinal()
+        return [
+            (chat_id, (day_count if day >= since_day else 0) + (prev_day_count if day - 1 >= since_day else 0))
+            for chat_id, (active, last_message_at, day, day_count, prev_day_count) in self._chats.items()
+            if active and last_message_at is not None and last_message_at >= since
+        ]
+
+    async def get_messages_for_summary(self, chat_id: int, since: datetime) -> List[Dict]:
+        self._check()
+        timestamps, rows = self._messages.get(chat_id, ([], []))
+        start = bisect.bisect_left(timestamps, since)
+        return [{"username": u, "text": t, "timestamp": ts} for u, t, ts, _ in rows[start:]]
+
+    async def get_recent_messages(self, chat_id: int, since: datetime,
+                                  max_chars: int) -> Tuple[List[RecentMessage], bool]:
+        self._check()
+        timestamps, rows = self._messages.get(chat_id, ([], []))
+        start = bisect.bisect_left(timestamps, since)
+        kept: List[RecentMessage] = []
+        used = 0
+        for index in range(len(rows) - 1, start - 1, -1):
+            username, text, ts, _ = rows[index]
+            text = text[:SUMMARY_MAX_MESSAGE_CHARS]
+            used += len(username) + len(text or SUMMARY_EMPTY_TEXT) + SUMMARY_BLOCK_OVERHEAD
+            if used > max_chars:
+                kept.reverse()
+                return kept, False
+            kept.append((ts, username, text))
+        kept.reverse()
+        return kept, True
+
+    async def export_messages(self, chat_id: int, since: datetime, until: datetime, fmt: str,
+                              write: ExportWriter) -> int:
+        self._check()
+        timestamps, rows = self._messages.get(chat_id, ([], []))
+        start, end = bisect.bisect_left(timestamps, since), bisect.bisect_left(timestamps, until)
+        if fmt == "csv":
+            await write(format_export_rows([], fmt, header=True))
+        for offset in range(start, end, EXPORT_BATCH_SIZE):
+            batch = rows[offset:min(offset + EXPORT_BATCH_SIZE, end)]
+            await write(format_export_rows([(ts, u, t, mid) for u, t, ts, mid in batch], fmt))
+        return end - start
+
+    async def save_summary(self, chat_id: int, period: str, window_start: datetime, window_end: datetime,
+                           model: str, text: str):
+        self._check()
+        self._summaries.setdefault((chat_id, period), []).append(
+            {"period": period, "window_start": window_start, "window_end": window_end, "model": model, "text": text}
+        )
+
+    async def get_summaries(self, chat_id: int, period: str, since: datetime, until: datetime) -> List[Dict]:
+        self._check()
+        rows = [
+            dict(s) for s in self._summaries.get((chat_id, period), [])
+            if since < s["window_end"] <= until
+        ]
+        return sorted(rows, key=lambda s: s["window_start"])
+
+    async def save_llm_usage(self, records: List[LLMUsageRecord]):
+        self._check()
+        self._llm_usage.extend(records)
+
+    async def get_llm_usage_stats(self, since: datetime, group_by: str) -> List[Dict]:
+        self._check()
+        groups: Dict[object, Dict] = {}
+        latencies: Dict[object, List[int]] = {}
+        for r in self._llm_usage:
+            if r.created_at < since:
+                continue
+            key = r.chat_id if group_by == "chat" else r.created_at.strftime('%Y-%m-%d')
+            g = groups.setdefault(key, {
+                "key": key, "calls": 0, "failures": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "total_tokens": 0, "cost": 0.0, "avg_latency_ms": 0, "source_chars": 0, "sent_chars": 0,
+            })
+            g["calls"] += 1
+            g["failures"] += r.outcome != "ok"
+            g["prompt_tokens"] += r.prompt_tokens or 0
+            g["completion_tokens"] += r.completion_tokens or 0
+            g["total_tokens"] += r.total_tokens or 0
+            g["cost"] += r.cost or 0.0
+            g["source_chars"] += r.source_chars
+            g["sent_chars"] += r.sent_chars
+            if r.latency_ms is not None:
+                latencies.setdefault(key, []).append(r.latency_ms)
+        for key, values in latencies.items():
+            groups[key]["avg_latency_ms"] = sum(values) / len(values)
+        if group_by == "chat":
+            return sorted(groups.values(), key=lambda g: g["total_tokens"], reverse=True)
+        return sorted(groups.values(), key=lambda g: g["key"])
+
+    async def get_setting(self, key: str) -> Optional[str]:
+        self._check()
+        return self._settings.get(key)
+
+    async def set_setting(self, key: str, value: str):
+        self._check()
+        self._settings[key] = value
+
+    async def delete_setting(self, key: str):
+        self._check()
+        self._settings.pop(key, None)
+
+    async def get_settings_by_prefix(self, prefix: str) -> Dict[str, str]:
+        self._check()
+        return {k: v for k, v in self._settings.items() if k.startswith(prefix)}
+
+# --- END OF FILE db/memory.py ---
@@ -0,0 +1,160 @@
+# --- START OF FILE db/migrations.py ---
+
+import logging
+from typing import List, Tuple
+
+import asyncpg
+
+# Версионированные миграции схемы. Новые изменения схемы добавляются ТОЛЬКО в конец списка
+# с увеличением номера версии; уже примененные миграции не редактируются.
+# Формат: (версия, описание, [SQL-выражения])
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "initial schema", [
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            message_internal_id SERIAL PRIMARY KEY, -- Внутренний ID сообщения
+            chat_id      BIGINT       NOT NULL,
+            username     TEXT         NOT NULL,
+            text         TEXT         NOT NULL,
+            "timestamp"  TIMESTAMPTZ  NOT NULL     -- Используем кавычки, т.к. timestamp - ключевое слово
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS settings (
+            key   TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id BIGINT PRIMARY KEY
+        );
+        """,
+        # Индекс для выборки сообщений по чату и времени (важен для сводок)
+        """CREATE INDEX IF NOT EXISTS idx_messages_chat_id_timestamp ON messages (chat_id, "timestamp" DESC);""",
+        # Индекс для выборки по времени (может быть полезен)
+        """CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages ("timestamp" DESC);""",
+    ]),
+    (2, "stored summaries and digests", [
+        """
+        CREATE TABLE IF NOT EXISTS summaries (
+            summary_id   SERIAL       PRIMARY KEY,
+            chat_id      BIGINT       NOT NULL,
+            period       TEXT         NOT NULL,   -- day, week, month
+            window_start TIMESTAMPTZ  NOT NULL,
+            window_end   TIMESTAMPTZ  NOT NULL,
+            model        TEXT         NOT NULL,
+            text         TEXT         NOT NULL,
+            created_at   TIMESTAMPTZ  NOT NULL DEFAULT now()
+        );
+        """,
+        """CREATE INDEX IF NOT EXISTS idx_summaries_chat_period_window ON summaries (chat_id, period, window_start);""",
+    ]),
+    (3, "idempotent ingestion by telegram message_id", [
+        """ALTER TABLE messages ADD COLUMN IF NOT EXISTS telegram_message_id BIGINT;""",
+        """ALTER TABLE messages ADD COLUMN IF NOT EXISTS edited_at TIMESTAMPTZ;""",
+        # Старые строки без telegram_message_id (NULL) уникальности не нарушают
+        """CREATE UNIQUE INDEX IF NOT EXISTS uq_messages_chat_telegram_message_id ON messages (chat_id, telegram_message_id);""",
+    ]),
+    (4, "llm usage accounting", [
+        """
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            usage_id          BIGSERIAL    PRIMARY KEY,
+            created_at        TIMESTAMPTZ  NOT NULL,
+            chat_id           BIGINT       NOT NULL,
+            model             TEXT         NOT NULL,
+            purpose           TEXT         NOT NULL,   -- summary, digest
+            outcome           TEXT         NOT NULL,   -- ok, empty, rejected, timeout, http_429, error...
+            prompt_tokens     INTEGER,
+            completion_tokens INTEGER,
+            total_tokens      INTEGER,
+            cost              DOUBLE PRECISION,        -- в кредитах OpenRouter (если вернулась в usage)
+            latency_ms        INTEGER,
+            source_chars      INTEGER      NOT NULL,   -- длина истории до обрезки/отбора
+            sent_chars        INTEGER      NOT NULL    -- длина фактически отправленной истории
+        );
+        """,
+        """CREATE INDEX IF NOT EXISTS idx_llm_usage_created_at ON llm_usage (created_at);""",
+        """CREATE INDEX IF NOT EXISTS idx_llm_usage_chat_created_at ON llm_usage (chat_id, created_at);""",
+    ]),
+    (5, "chat activity index", [
+        """ALTER TABLE chats ADD COLUMN IF NOT EXISTS active BOOLEAN NOT NULL DEFAULT TRUE;""",
+        """ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMPTZ;""",
+        # Счетчики сообщений за день activity_day (UTC) и за предыдущий день
+        """ALTER TABLE chats ADD COLUMN IF NOT EXISTS activity_day DATE;""",
+        """ALTER TABLE chats ADD COLUMN IF NOT EXISTS day_count INTEGER NOT NULL DEFAULT 0;""",
+        """ALTER TABLE chats ADD COLUMN IF NOT EXISTS prev_day_count INTEGER NOT NULL DEFAULT 0;""",
+        # Заполнение по существующим сообщениям: по чату - поиск по индексу (chat_id, "timestamp")
+        """
+        UPDATE chats c SET last_message_at = (
+            SELECT max(m."timestamp") FROM messages m WHERE m.chat_id = c.chat_id
+        );
+        """,
+        """UPDATE chats SET activity_day = (last_message_at AT TIME ZONE 'UTC')::date WHERE last_message_at IS NOT NULL;""",
+        """
+        UPDATE chats c SET
+            day_count = (
+                SELECT count(*) FROM messages m WHERE m.chat_id = c.chat_id
+                  AND m."timestamp" >= c.activity_day::timestamp AT TIME ZONE 'UTC'
+                  AND m."timestamp" < (c.activity_day + 1)::timestamp AT TIME ZONE 'UTC'
+            ),
+            prev_day_count = (
+                SELECT count(*) FROM messages m WHERE m.chat_id = c.chat_id
+                  AND m."timestamp" >= (c.activity_day - 1)::timestamp AT TIME ZONE 'UTC'
+                  AND m."timestamp" < c.activity_day::timestamp AT TIME ZONE 'UTC'
+            )
+        WHERE c.activity_day IS NOT NULL;
+        """,
+        # Ночная рассылка выбирает только активные чаты с недавними сообщениями
+        """CREATE INDEX IF NOT EXISTS idx_chats_active_last_message_at ON chats (last_message_at) WHERE active;""",
+    ]),
+]
+
+# Произвольный ключ advisory-lock, чтобы два инстанса не применяли миграции одновременно
+MIGRATIONS_LOCK_ID = 727_001
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def _current_version(conn: asyncpg.Connection) -> int:
+    """Возвращает текущую версию схемы (0, если таблицы версий еще нет)."""
+    exists = await conn.fetchval("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not exists:
+        return 0
+    return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+
+
+async def run_migrations(conn: asyncpg.Connection):
+    """Применяет недостающие миграции. Если схема актуальна - обходится одним запросом без DDL."""
+    version = await _current_version(conn)
+    if version >= LATEST_VERSION:
+        logging.info("Схема БД актуальна (версия %s), миграции пропущены.", version)
+        return
+
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_ID)
+    try:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version     INTEGER PRIMARY KEY,
+                description TEXT        NOT NULL,
+                applied_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+        """)
+        # Перечитываем версию под блокировкой: другой инстанс мог уже применить миграции
+        version = await _current_version(conn)
+        for migration_version, description, statements in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            logging.info("Применение миграции %s: %s...", migration_version, description)
+            async with conn.transaction():
+                for statement in statements:
+                    await conn.execute(statement)
+                await conn.execute(
+                    "INSERT INTO schema_migrations(version, description) VALUES($1, $2)",
+                    migration_version, description
+                )
+            logging.info("Миграция %s применена.", migration_version)
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_ID)
+
+# --- END OF FILE db/migrations.py ---
@@ -0,0 +1,466 @@
+# --- START OF FILE db/postgres.py ---
+
+import asyncio
+import asyncpg
+import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Callable, List, Dict, NamedTuple, Optional, Tuple
+
+from db.base import (
+    StorageBackend, ExportWriter, LLMUsageRecord, MessageRecord, RecentMessage,
+    SUMMARY_BLOCK_OVERHEAD, SUMMARY_MAX_MESSAGE_CHARS, SUMMARY_EMPTY_TEXT,
+)
+from db.migrations import run_migrations
+from bot.utils import metrics
+
+
+# Сколько строк курсор get_recent_messages забирает за один запрос к серверу
+RECENT_MESSAGES_PREFETCH = 200
+
+# Канал LISTEN/NOTIFY об изменении настроек (payload - ключ настройки)
+SETTINGS_CHANNEL = "settings_changed"
+# Пауза перед переподключением слушателя уведомлений (удваивается до максимума)
+LISTENER_RETRY_SECONDS = 1
+LISTENER_RETRY_MAX_SECONDS = 60
+
+
+class PoolSettings(NamedTuple):
+    """Параметры одного пула соединений."""
+    min_size: int = 1
+    max_size: int = 10
+    command_timeout: float = 60
+    acquire_timeout: float = 10
+
+
+def _host_info(dsn: str) -> str:
+    # Хост БД без учетных данных - для логов
+    return dsn.split('@')[-1] if '@' in dsn else dsn
+
+
+class PostgresStorage(StorageBackend):
+    """
+    Хранилище на PostgreSQL (asyncpg). Схема ведется версионированными миграциями (db/migrations.py).
+    Два пула: пул записи (сохранение сообщений, настройки, короткие запросы) и пул аналитического
+    чтения (выборки для сводок, /pdf, /export, /chats, /stats). Тяжелые чтения не занимают соединения,
+    нужные приему сообщений. Пул чтения может смотреть на реплику (read_dsn).
+    """
+
+    name = "postgres"
+
+    def __init__(self, dsn: str, read_dsn: Optional[str] = None,
+                 write_pool: PoolSettings = PoolSettings(), read_pool: PoolSettings = PoolSettings(),
+                 export_timeout: float = 3600.0):
+        self.dsn = dsn
+        self.read_dsn = read_dsn or dsn
+        self.write_settings = write_pool
+        self.read_settings = read_pool
+        self.export_timeout = export_timeout
+        self.pool: Optional[asyncpg.Pool] = None      # запись
+        self.read_pool: Optional[asyncpg.Pool] = None # аналитическое чтение
+        self._settings_listener: Optional[asyncio.Task] = None
+
+    async def _create_pool(self, dsn: str, settings: PoolSettings, role: str) -> asyncpg.Pool:
+        logging.info("Подключение к БД (%s): %s", role, _host_info(dsn))
+        pool = await asyncpg.create_pool(dsn, min_size=settings.min_size, max_size=settings.max_size,
+                                         command_timeout=settings.command_timeout)
+        if not pool:
+            logging.critical("Не удалось создать пул соединений с БД (%s, pool is None).", role)
+            raise ConnectionError(f"Failed to create database pool ({role})")
+        return pool
+
+    async def init(self):
+        if self.pool:
+            logging.warning("Пул БД уже инициализирован.")
+            return
+        # Пулы создаются параллельно - не удлиняем холодный старт
+        results = await asyncio.gather(
+            self._create_pool(self.dsn, self.write_settings, "write"),
+            self._create_pool(self.read_dsn, self.read_settings, "read"),
+            return_exceptions=True,
+        )
+        pools = [r for r in results if isinstance(r, asyncpg.Pool)]
+        errors = [r for r in results if isinstance(r, BaseException)]
+        try:
+            if errors:
+                raise errors[0]
+            write_pool, read_pool = results
+            # Применяем версионированные миграции (пропускаются, если схема актуальна) - только на основной БД
+            async with write_pool.acquire() as conn:
+                await run_migrations(conn)
+        except BaseException:
+            await asyncio.gather(*(p.close() for p in pools), return_exceptions=True)
+            raise
+        self.pool, self.read_pool = write_pool, read_pool
+        logging.info("Пулы соединений с БД успешно инициализированы (запись: до %s, чтение: до %s%s).",
+                     self.write_settings.max_size, self.read_settings.max_size,
+                     ", реплика" if self.read_dsn != self.dsn else "")
+
+    async def close(self):
+        if not self.pool:
+            logging.warning("Попытка закрыть неинициализированный или уже закрытый пул БД.")
+            return
+        logging.info("Закрытие пулов соединений с БД...")
+        if self._settings_listener:
+            self._settings_listener.cancel()
+            await asyncio.gather(self._settings_listener, return_exceptions=True)
+            self._settings_listener = None
+        try:
+            await asyncio.gather(self.pool.close(), self.read_pool.close())
+            logging.info("🛑 Пулы соединений с БД успешно закрыты.")
+        finally:
+            self.pool = None # Гарантированно сбрасываем пулы
+            self.read_pool = None
+
+    # --- Работа с соединениями ---
+    def _pool_for(self, read: bool):
+        return (self.read_pool, self.read_settings, "read") if read else (self.pool, self.write_settings, "write")
+
+    async def _get_connection(self, read: bool = False) -> asyncpg.Connection:
+        """Получает соединение из пула записи или чтения с проверкой и таймаутом."""
+        pool, settings, role = self._pool_for(read)
+        if not pool:
+            logging.error("Пул БД не инициализирован! Невозможно получить соединение.")
+            raise ConnectionError("Database pool is not initialized or already closed")
+        try:
+            conn = await pool.acquire(timeout=settings.acquire_timeout)
+            if not conn:
+                raise ConnectionError("Failed to acquire connection from pool (timeout or pool closed)")
+            return conn
+        except Exception as e:
+            metrics.inc("db_pool_acquire_failures_total", pool=role)
+            logging.exception("Не удалось получить соединение из пула БД (%s).", role)
+            raise ConnectionError(f"Failed to acquire connection from pool ({role})") from e
+
+    async def _release_connection(self, conn: asyncpg.Connection, read: bool = False):
+        """Безопасно возвращает соединение в пул."""
+        pool, _, _ = self._pool_for(read)
+        if pool and conn and not conn.is_closed():
+            try:
+                await pool.release(conn, timeout=5)
+            except Exception as e:
+                logging.exception("Ошибка при возврате соединения в пул: %s", e)
+                try:
+                    await conn.close()
+                except Exception as close_exc:
+                    logging.exception("Ошибка при принудительном закрытии соединения: %s", close_exc)
+        elif not pool:
+            logging.warning("Попытка вернуть соединение при неинициализированном пуле.")
+
+    @asynccontextmanager
+    async def _connection(self, read: bool = False):
+        """Соединение из пула записи (по умолчанию) или аналитического чтения (read=True)."""
+        started = time.monotonic()
+        conn = await self._get_connection(read)
+        metrics.observe("db_pool_acquire_seconds", time.monotonic() - started, pool="read" if read else "write")
+        try:
+            yield conn
+        finally:
+            await self._release_connection(conn, read)
+
+    # --- Операции ---
+    async def ping(self):
+        async with self._connection() as conn:
+            await conn.fetchval("SELECT 1")
+
+    async def save_message(self, chat_id: int, username: str, text: str, timestamp: datetime,
+                           telegram_message_id: Optional[int] = None) -> bool:
+        async with self._connection() as conn:
+            # Каст ::TIMESTAMPTZ к параметру $4, чтобы помочь PostgreSQL с aware datetime
+            result = await conn.execute(
+                """
+                INSERT INTO messages(chat_id, username, text, "timestamp", telegram_message_id)
+                VALUES($1, $2, $3, $4::TIMESTAMPTZ, $5)
+                ON CONFLICT (chat_id, telegram_message_id) DO NOTHING
+                """,
+                chat_id, username, text, timestamp, telegram_message_id
+            )
+        return result == "INSERT 0 1"
+
+    async def save_messages(self, messages: List[MessageRecord]) -> List[MessageRecord]:
+        if not messages:
+            return []
+        async with self._connection() as conn:
+            # Вся пачка - одним запросом: колонки передаются массивами и разворачиваются unnest.
+            # RETURNING отдает только вставленные строки (пропущенные ON CONFLICT не возвращаются)
+            rows = await conn.fetch(
+                """
+                INSERT INTO messages(chat_id, username, text, "timestamp", telegram_message_id)
+                SELECT * FROM unnest($1::BIGINT[], $2::TEXT[], $3::TEXT[], $4::TIMESTAMPTZ[], $5::BIGINT[])
+                ON CONFLICT (chat_id, telegram_message_id) DO NOTHING
+                RETURNING chat_id, username, text, "timestamp", telegram_message_id
+                """,
+                *(list(column) for column in zip(*messages))
+            )
+        return [MessageRecord(*row) for row in rows]
+
+    async def update_message_text(self, chat_id: int, telegram_message_id: int, text: str, edited_at: datetime) -> bool:
+        async with self._connection() as conn:
+            result = await conn.execute(
+                """
+                UPDATE messages SET text = $3, edited_at = $4::TIMESTAMPTZ
+                WHERE chat_id = $1 AND telegram_message_id = $2
+                """,
+                chat_id, telegram_message_id, text, edited_at
+            )
+        return result != "UPDATE 0"
+
+    async def register_chat(self, chat_id: int) -> bool:
+        async with self._connection() as conn:
+            # Уже активный чат не обновляется (статус "INSERT 0 0")
+            result = await conn.execute(
+                "INSERT INTO chats(chat_id) VALUES($1) ON CONFLICT(chat_id) DO UPDATE SET active = TRUE WHERE NOT chats.active",
+                chat_id
+            )
+        return result == "INSERT 0 1"
+
+    async def deactivate_chat(self, chat_id: int) -> bool:
+        async with self._connection() as conn:
+            result = await conn.execute("UPDATE chats SET active = FALSE WHERE chat_id = $1 AND active", chat_id)
+        return result != "UPDATE 0"
+
+    async def record_chat_activity(self, chat_id: int, at: datetime, count: int = 1):
+        async with self._connection() as conn:
+            # В SET справа - значения строки до обновления. Сообщение следующего дня сдвигает
+            # счетчики (day_count -> prev_day_count), предыдущего дня - добавляется в prev_day_count
+            await conn.execute(
+                """
+                INSERT INTO chats AS c (chat_id, last_message_at, activity_day, day_count)
+                VALUES($1, $2::TIMESTAMPTZ, ($2::TIMESTAMPTZ AT TIME ZONE 'UTC')::date, $3)
+                ON CONFLICT (chat_id) DO UPDATE SET
+                    last_message_at = GREATEST(c.last_message_at, EXCLUDED.last_message_at),
+                    prev_day_count = CASE
+                        WHEN c.activity_day IS NULL OR EXCLUDED.activity_day > c.activity_day + 1 THEN 0
+                        WHEN EXCLUDED.activity_day = c.activity_day + 1 THEN c.day_count
+                        WHEN EXCLUDED.activity_day = c.activity_day - 1 THEN c.prev_day_count + EXCLUDED.day_count
+                        ELSE c.prev_day_count END,
+                    day_count = CASE
+                        WHEN c.activity_day IS NULL OR EXCLUDED.activity_day > c.activity_day THEN EXCLUDED.day_count
+                        WHEN EXCLUDED.activity_day = c.activity_day THEN c.day_count + EXCLUDED.day_count
+                        ELSE c.day_count END,
+                    activity_day = GREATEST(c.activity_day, EXCLUDED.activity_day)
+                """,
+                chat_id, at, count
+            )
+
+    async def get_registered_chats(self) -> List[int]:
+        async with self._connection(read=True) as conn:
+            rows = await conn.fetch("SELECT chat_id FROM chats WHERE active")
+        return [r["chat_id"] for r in rows]
+
+    async def get_active_chats(self, since: datetime) -> List[Tuple[int, int]]:
+        async with self._connection(read=True) as conn:
+            # Частичный индекс idx_chats_active_last_message_at: читаются только чаты с недавними сообщениями
+            rows = await conn.fetch(
+                """
+                SELECT chat_id,
+                       CASE WHEN activity_day >= $2 THEN day_count ELSE 0 END
+                       + CASE WHEN activity_day - 1 >= $2 THEN prev_day_count ELSE 0 END AS recent_count
+                FROM chats
+                WHERE active AND last_message_at >= $1::TIMESTAMPTZ
+                """,
+                since, since.date()
+            )
+        return [(r["chat_id"], r["recent_count"]) for r in rows]
+
+    async def get_messages_for_summary(self, chat_id: int, since: datetime) -> List[Dict]:
+        async with self._connection(read=True) as conn:
+            # Явно приводим тип параметра $2 к TIMESTAMPTZ для PostgreSQL
+            rows = await conn.fetch(
+                """
+                SELECT username, text, "timestamp"
+                FROM messages
+                WHERE chat_id = $1 AND "timestamp" >= $2::TIMESTAMPTZ
+                ORDER BY "timestamp" ASC
+                """,
+                chat_id, since
+            )
+        return [
+            {"username": r["username"], "text": r["text"], "timestamp": r["timestamp"]}
+            for r in rows
+        ]
+
+    async def get_recent_messages(self, chat_id: int, since: datetime,
+                                  max_chars: int) -> Tuple[List[RecentMessage], bool]:
+        rows: List[RecentMessage] = []
+        used, complete = 0, True
+        async with self._connection(read=True) as conn:
+            # Курсор от новых к старым (индекс chat_id, "timestamp" DESC): сервер читает и отдает
+            # строки порциями, и мы перестаем забирать их, как только исчерпан бюджет.
+            # Обрезка текста и размер блока считаются в SQL - длинные тексты не передаются целиком
+            async with conn.transaction():
+                cursor = conn.cursor(
+                    """
+                    SELECT "timestamp", username, left(text, $3) AS text,
+                           length(username) + coalesce(nullif(least(length(text), $3), 0), $5) + $4 AS size
+                    FROM messages
+                    WHERE chat_id = $1 AND "timestamp" >= $2::TIMESTAMPTZ
+                    ORDER BY "timestamp" DESC
+                    """,
+                    chat_id, since, SUMMARY_MAX_MESSAGE_CHARS, SUMMARY_BLOCK_OVERHEAD, len(SUMMARY_EMPTY_TEXT),
+                    prefetch=RECENT_MESSAGES_PREFETCH
+                )
+                async for r in cursor:
+                    used += r["size"]
+                    if used > max_chars:
+                        complete = False
+                        break
+                    rows.append((r["timestamp"], r["username"], r["text"]))
+        rows.reverse()
+        return rows, complete
+
+    async def export_messages(self, chat_id: int, since: datetime, until: datetime, fmt: str,
+                              write: ExportWriter) -> int:
+        select = """
+            SELECT to_char("timestamp" AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS.US"+00:00"') AS "timestamp",
+                   username, text, telegram_message_id
+            FROM messages
+            WHERE chat_id = $1 AND "timestamp" >= $2::TIMESTAMPTZ AND "timestamp" < $3::TIMESTAMPTZ
+            ORDER BY "timestamp" ASC
+        """
+        if fmt == "csv":
+            query, options = select, {"format": "csv", "header": True}
+        else:
+            # Одна JSON-колонка в CSV-режиме с управляющими символами в роли кавычки/разделителя:
+            # row_to_json экранирует их сам, поэтому строки выходят без какого-либо квотирования
+            query = f"SELECT row_to_json(t) FROM ({select}) t"
+            options = {"format": "csv", "quote": "\x01", "delimiter": "\x02"}
+        async with self._connection(read=True) as conn:
+            # Явный timeout: при None asyncpg берет command_timeout пула чтения и обрывает большую выгрузку
+            status = await conn.copy_from_query(query, chat_id, since, until, output=write,
+                                                timeout=self.export_timeout, **options)
+        # status вида "COPY 123"
+        return int(status.split()[-1]) if status else 0
+
+    async def save_summary(self, chat_id: int, period: str, window_start: datetime, window_end: datetime,
+                           model: str, text: str):
+        async with self._connection() as conn:
+            await conn.execute(
+                """
+                INSERT INTO summaries(chat_id, period, window_start, window_end, model, text)
+                VALUES($1, $2, $3::TIMESTAMPTZ, $4::TIMESTAMPTZ, $5, $6)
+                """,
+                chat_id, period, window_start, window_end, model, text
+            )
+
+    async def get_summaries(self, chat_id: int, period: str, since: datetime, until: datetime) -> List[Dict]:
+        async with self._connection(read=True) as conn:
+            rows = await conn.fetch(
+                """
+                SELECT period, window_start, window_end, model, text
+                FROM summaries
+                WHERE chat_id = $1 AND period = $2
+                  AND window_end > $3::TIMESTAMPTZ AND window_end <= $4::TIMESTAMPTZ
+                ORDER BY window_start ASC
+                """,
+                chat_id, period, since, until
+            )
+        return [dict(r) for r in rows]
+
+    async def save_llm_usage(self, records: List[LLMUsageRecord]):
+        async with self._connection() as conn:
+            # COPY - одна операция на всю пачку
+            await conn.copy_records_to_table("llm_usage", records=records, columns=list(LLMUsageRecord._fields))
+
+    async def get_llm_usage_stats(self, since: datetime, group_by: str) -> List[Dict]:
+        key, order = {
+            "chat": ("chat_id", "total_tokens DESC"),
+            "day": ("to_char(created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD')", "key ASC"),
+        }[group_by]
+        async with self._connection(read=True) as conn:
+            rows = await conn.fetch(
+                f"""
+                SELECT {key} AS key,
+                       count(*) AS calls,
+                       count(*) FILTER (WHERE outcome <> 'ok') AS failures,
+                       COALESCE(sum(prompt_tokens), 0) AS prompt_tokens,
+                       COALESCE(sum(completion_tokens), 0) AS completion_tokens,
+                       COALESCE(sum(total_tokens), 0) AS total_tokens,
+                       COALESCE(sum(cost), 0) AS cost,
+                       COALESCE(avg(latency_ms), 0)::DOUBLE PRECISION AS avg_latency_ms,
+                       sum(source_chars) AS source_chars,
+                       sum(sent_chars) AS sent_chars
+                FROM llm_usage
+                WHERE created_at >= $1::TIMESTAMPTZ
+                GROUP BY 1
+                ORDER BY {order}
+                """,
+                since
+            )
+        return [dict(r) for r in rows]
+
+    async def get_setting(self, key: str) -> Optional[str]:
+        async with self._connection() as conn:
+            return await conn.fetchval("SELECT value FROM settings WHERE key = $1", key)
+
+    async def set_setting(self, key: str, value: str):
+        async with self._connection() as conn:
+            # Запись и уведомление других инстансов - одним запросом (NOTIFY уходит при коммите)
+            await conn.execute(
+                """
+                WITH upserted AS (
+                    INSERT INTO settings(key, value)
+                    VALUES($1, $2)
+                    ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+                    RETURNING key
+                )
+                SELECT pg_notify($3, key) FROM upserted
+                """,
+                key, value, SETTINGS_CHANNEL
+            )
+
+    async def delete_setting(self, key: str):
+        async with self._connection() as conn:
+            await conn.execute(
+                """
+                WITH deleted AS (DELETE FROM settings WHERE key = $1 RETURNING key)
+                SELECT pg_notify($2, key) FROM deleted
+                """,
+                key, SETTINGS_CHANNEL
+            )
+
+    async def get_settings_by_prefix(self, prefix: str) -> Dict[str, str]:
+        async with self._connection() as conn:
+            rows = await conn.fetch("SELECT key, value FROM settings WHERE left(key, length($1)) = $1", prefix)
+        return {r["key"]: r["value"] for r in rows}
+
+    # --- Уведомления об изменении настроек (LISTEN/NOTIFY) ---
+    async def listen_settings(self, callback: Callable[[Optional[str]], None]) -> bool:
+        if self._settings_listener is None:
+            self._settings_listener = asyncio.create_task(self._listen_settings(callback))
+        return True
+
+    async def _listen_settings(self, callback: Callable[[Optional[str]], None]):
+        """
+        Держит отдельное (не из пула) соединение с LISTEN на основной БД. После обрыва переподключается
+        и вызывает callback(None): уведомления за время разрыва потеряны, кэш нужно перечитать.
+        """
+        retry = LISTENER_RETRY_SECONDS
+        reconnecting = False
+        while True:
+            conn: Optional[asyncpg.Connection] = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _conn: lost.set())
+                await conn.add_listener(SETTINGS_CHANNEL, lambda _conn, _pid, _channel, payload: callback(payload))
+                logging.info("Подписка на изменения настроек (LISTEN %s) активна.", SETTINGS_CHANNEL)
+                if reconnecting:
+                    callback(None)
+                retry = LISTENER_RETRY_SECONDS
+                await lost.wait()
+                logging.warning("Соединение LISTEN %s потеряно, переподключение...", SETTINGS_CHANNEL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning("Не удалось подписаться на изменения настроек (%s), повтор через %s с.", e, retry)
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            metrics.inc("db_settings_listener_reconnects_total")
+            reconnecting = True
+            await asyncio.sleep(retry)
+            retry = min(retry * 2, LISTENER_RETRY_MAX_SECONDS)
+
+# --- END OF FILE db/postgres.py ---
@@ -0,0 +1,376 @@
+# --- START OF FILE db/spool.py ---
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from db.base import MessageRecord
+from bot.utils import metrics
+
+# Локальный журнал (спул) сообщений на случай, когда БД недоступна или отвечает слишком медленно.
+# Формат - сегменты JSONL (<номер>.jsonl) в SPOOL_DIR: запись только дописыванием, fsync пачками
+# (все записи, пришедшие за fsync_interval, подтверждаются одним fsync). Фоновый досыльщик
+# закрывает текущий сегмент и переносит закрытые сегменты в messages пакетными вставками;
+# полностью перенесенный сегмент удаляется. Повторная досылка безопасна: вставка идемпотентна
+# по (chat_id, telegram_message_id). Правки сообщений (запись с edited_at) применяются в порядке
+# записи - после вставки исходного сообщения, если оно тоже ждало в спуле. Запись, которую БД
+# отвергает не из-за недоступности (нарушение ограничения, недопустимые данные), уходит в
+# карантин (quarantine.jsonl в SPOOL_DIR), чтобы не держать досылку и режим деградации вечно.
+
+SEGMENT_SUFFIX = ".jsonl"
+QUARANTINE_FILE = "quarantine.jsonl"
+
+SaveBatch = Callable[[List[MessageRecord]], Awaitable[int]]
+ApplyEdit = Callable[[MessageRecord, datetime], Awaitable[int]]
+Probe = Callable[[], Awaitable[None]]
+
+
+def _encode(message: MessageRecord, edited_at: Optional[datetime] = None, error: Optional[str] = None) -> bytes:
+    data = {
+        "chat_id": message.chat_id,
+        "username": message.username,
+        "text": message.text,
+        "timestamp": message.timestamp.isoformat(),
+        "telegram_message_id": message.telegram_message_id,
+        "spooled_at": time.time(),
+    }
+    if edited_at is not None:
+        data["edited_at"] = edited_at.isoformat()
+    if error is not None:
+        data["error"] = error # только в карантине
+    return (json.dumps(data, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def _decode(line: bytes) -> Tuple[MessageRecord, float, Optional[datetime]]:
+    data = json.loads(line)
+    message = MessageRecord(data["chat_id"], data["username"], data["text"],
+                            datetime.fromisoformat(data["timestamp"]), data["telegram_message_id"])
+    edited_at = datetime.fromisoformat(data["edited_at"]) if data.get("edited_at") else None
+    return message, data["spooled_at"], edited_at
+
+
+def is_transient_error(e: BaseException) -> bool:
+    """Ошибка недоступности БД (сеть, таймаут, перегрузка): запись стоит повторить позже."""
+    if isinstance(e, (ConnectionError, OSError, asyncio.TimeoutError)):
+        return True
+    if isinstance(e, sqlite3.OperationalError): # database is locked, disk I/O error
+        return True
+    if type(e).__module__.startswith("asyncpg"):
+        import asyncpg # asyncpg нужен только для PostgreSQL
+        if isinstance(e, asyncpg.DataError): # подкласс InterfaceError, но это ошибка данных
+            return False
+        return isinstance(e, (asyncpg.PostgresConnectionError, asyncpg.InterfaceError,
+                              asyncpg.InsufficientResourcesError, asyncpg.OperatorInterventionError))
+    return False
+
+
+class MessageSpool:
+    """
+    Спул сообщений, не сохраненных в БД. append() возвращается после fsync записи; пока спул
+    в режиме деградации (последняя запись в БД не удалась), фасад пишет сразу в спул, не тратя
+    время на заведомо недоступную БД. Деградацию снимает успешный проход досыльщика вместе с
+    проверочным запросом probe: проход без сегментов к БД не обращается.
+    Постоянные ошибки (см. is_transient_error) не прерывают досылку: пачка повторяется
+    по одной записи, отвергнутые записи переносятся в карантин.
+    """
+
+    def __init__(self, directory: str, save: SaveBatch, apply_edit: Optional[ApplyEdit] = None,
+                 probe: Optional[Probe] = None, segment_bytes: int = 4 * 1024 * 1024,
+                 max_bytes: int = 1024 * 1024 * 1024, fsync_interval: float = 0.05,
+                 replay_interval: float = 5.0, replay_batch: int = 500):
+        self.directory = directory
+        self.save = save
+        self.apply_edit = apply_edit
+        self.probe = probe
+        self.segment_bytes = max(1, segment_bytes)
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self.replay_interval = replay_interval
+        self.replay_batch = max(1, replay_batch)
+        self.degraded = False
+        self._lock: Optional[asyncio.Lock] = None
+        self._file = None                   # текущий (дописываемый) сегмент
+        self._segment_path: Optional[str] = None
+        self._segment_size = 0
+        self._next_segment: Optional[int] = None
+        self._sync_waiter: Optional[asyncio.Future] = None
+        self._sync_task: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+        self._bytes = 0
+        self._records = 0
+        self._oldest: Optional[float] = None # время записи самого старого недосланного сообщения
+
+    # --- Сегменты (файловые операции выполняются в потоке) ---
+    def _segments(self) -> List[str]:
+        """Пути сегментов по возрастанию номера."""
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(SEGMENT_SUFFIX) and n[:-len(SEGMENT_SUFFIX)].isdigit()]
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, n) for n in sorted(names, key=lambda n: int(n[:-len(SEGMENT_SUFFIX)]))]
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self._file, self._segment_path, self._segment_size = None, None, 0
+
+    def _open_segment(self):
+        """Закрывает текущий сегмент (с fsync) и начинает новый."""
+        self._close_segment()
+        if self._next_segment is None:
+            os.makedirs(self.directory, exist_ok=True)
+            segments = self._segments()
+            self._next_segment = int(os.path.basename(segments[-1])[:-len(SEGMENT_SUFFIX)]) + 1 if segments else 1
+        self._segment_path = os.path.join(self.directory, f"{self._next_segment:012d}{SEGMENT_SUFFIX}")
+        self._next_segment += 1
+        self._file = open(self._segment_path, "ab")
+
+    def _close_and_list(self) -> List[str]:
+        """Закрывает текущий сегмент и возвращает все сегменты - они больше не дописываются."""
+        self._close_segment()
+        return self._segments()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _read_segment(self, path: str) -> Tuple[List[Tuple[MessageRecord, Optional[datetime]]], int, int]:
+        """
+        Читает сегмент целиком (размер ограничен segment_bytes).
+        Возвращает ([(сообщение, edited_at или None)], число строк, размер файла).
+        """
+        messages: List[Tuple[MessageRecord, Optional[datetime]]] = []
+        with open(path, "rb") as f:
+            data = f.read()
+        lines = data.splitlines()
+        for line in lines:
+            try:
+                message, _, edited_at = _decode(line)
+                messages.append((message, edited_at))
+            except (ValueError, KeyError, TypeError) as e:
+                # Недописанная строка (сбой посреди записи) или поврежденные данные
+                metrics.inc("spool_corrupt_lines_total")
+                logging.warning("Пропущена поврежденная строка спула в %s: %s", path, e)
+        return messages, len(lines), len(data)
+
+    def _quarantine(self, records: List[Tuple[MessageRecord, Optional[datetime], str]]):
+        """Дописывает отвергнутые БД записи (с текстом ошибки) в файл карантина."""
+        with open(os.path.join(self.directory, QUARANTINE_FILE), "ab") as f:
+            for message, edited_at, error in records:
+                f.write(_encode(message, edited_at, error))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _scan(self) -> Tuple[int, int, Optional[float]]:
+        """Размер, число записей и время самой старой записи во всех сегментах на диске."""
+        total_bytes, records, oldest = 0, 0, None
+        for path in self._segments():
+            with open(path, "rb") as f:
+                data = f.read()
+            lines = data.splitlines()
+            total_bytes += len(data)
+            records += len(lines)
+            if oldest is None:
+                for line in lines:
+                    try:
+                        oldest = _decode(line)[1]
+                        break
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        return total_bytes, records, oldest
+
+    def _update_gauges(self):
+        metrics.set_gauge("spool_bytes", self._bytes)
+        metrics.set_gauge("spool_records", self._records)
+        metrics.set_gauge("spool_replay_lag_seconds", time.time() - self._oldest if self._oldest is not None else 0)
+
+    @property
+    def pending(self) -> int:
+        """Число записей, ожидающих досылки."""
+        return self._records
+
+    # --- Запись ---
+    async def append(self, message: MessageRecord, reason: str, edited_at: Optional[datetime] = None):
+        """
+        Дописывает сообщение (или его правку, если задан edited_at) в спул и ждет fsync.
+        reason - причина (error, slow, degraded) для метрик. Исключения (переполнение спула,
+        ошибки диска) пробрасываются.
+        """
+        line = _encode(message, edited_at)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._bytes + len(line) > self.max_bytes:
+                metrics.inc("spool_rejected_total")
+                raise OSError(f"Spool is full ({self._bytes} bytes)")
+            if self._file is None or self._segment_size + len(line) > self.segment_bytes:
+                await asyncio.to_thread(self._open_segment)
+            self._file.write(line)
+            self._segment_size += len(line)
+            self._bytes += len(line)
+            self._records += 1
+            if self._oldest is None:
+                self._oldest = time.time()
+            if self._sync_waiter is None:
+                self._sync_waiter = asyncio.get_running_loop().create_future()
+                self._sync_task = asyncio.create_task(self._sync_later())
+            waiter = self._sync_waiter
+        metrics.inc("spool_appends_total", reason=reason)
+        self._update_gauges()
+        await asyncio.shield(waiter)
+
+    async def _sync_later(self):
+        """Групповой fsync: одна синхронизация на все записи, пришедшие за fsync_interval."""
+        await asyncio.sleep(self.fsync_interval)
+        async with self._lock:
+            waiter, self._sync_waiter, self._sync_task = self._sync_waiter, None, None
+            try:
+                if self._file is not None:
+                    await asyncio.to_thread(self._sync)
+            except Exception as e:
+                waiter.set_exception(e)
+            else:
+                waiter.set_result(None)
+
+    # --- Досылка ---
+    async def _save_batch(self, batch: List[MessageRecord],
+                          rejected: List[Tuple[MessageRecord, Optional[datetime], str]]) -> int:
+        """
+        Вставляет пачку; при постоянной ошибке повторяет по одной записи, отвергнутые
+        добавляет в rejected. Ошибки недоступности БД пробрасываются.
+        """
+        try:
+            return await self.save(batch)
+        except Exception as e:
+            if is_transient_error(e):
+                raise
+            if len(batch) == 1:
+                rejected.append((batch[0], None, repr(e)))
+                return 0
+        inserted = 0
+        for message in batch:
+            try:
+                inserted += await self.save([message])
+            except Exception as e:
+                if is_transient_error(e):
+                    raise
+                rejected.append((message, None, repr(e)))
+        return inserted
+
+    async def _apply_edit(self, message: MessageRecord, edited_at: datetime,
+                          rejected: List[Tuple[MessageRecord, Optional[datetime], str]]) -> int:
+        try:
+            return await self.apply_edit(message, edited_at)
+        except Exception as e:
+            if is_transient_error(e):
+                raise
+            rejected.append((message, edited_at, repr(e)))
+            return 0
+
+    async def replay(self) -> int:
+        """
+        Закрывает текущий сегмент и переносит все сегменты в БД пачками по replay_batch.
+        Ошибка недоступности БД прерывает проход (исключение пробрасывается), сегмент остается
+        на диске; отвергнутые БД записи сегмента перед его удалением пишутся в карантин.
+        Возвращает число вставленных сообщений.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Под блокировкой: новые записи пойдут уже в следующий сегмент с большим номером
+            segments = await asyncio.to_thread(self._close_and_list)
+        inserted = 0
+        for path in segments:
+            messages, lines, size = await asyncio.to_thread(self._read_segment, path)
+            started = time.monotonic()
+            # Карантин пишется только вместе с удалением сегмента: прерванный проход не дублирует записи
+            rejected: List[Tuple[MessageRecord, Optional[datetime], str]] = []
+            batch: List[MessageRecord] = []
+            for message, edited_at in messages:
+                if edited_at is None:
+                    batch.append(message)
+                    if len(batch) >= self.replay_batch:
+                        inserted += await self._save_batch(batch, rejected)
+                        batch = []
+                    continue
+                # Правка: сначала вставляем накопленное (там может быть исходное сообщение)
+                if batch:
+                    inserted += await self._save_batch(batch, rejected)
+                    batch = []
+                if self.apply_edit is not None:
+                    inserted += await self._apply_edit(message, edited_at, rejected)
+            if batch:
+                inserted += await self._save_batch(batch, rejected)
+            if rejected:
+                await asyncio.to_thread(self._quarantine, rejected)
+                metrics.inc("spool_quarantined_total", len(rejected))
+                for message, _, error in rejected:
+                    logging.error("Спул: БД отвергла сообщение %s чата %s (%s), запись перенесена в %s.",
+                                  message.telegram_message_id, message.chat_id, error,
+                                  os.path.join(self.directory, QUARANTINE_FILE))
+            await asyncio.to_thread(os.remove, path)
+            metrics.inc("spool_replayed_total", len(messages) - len(rejected))
+            self._bytes = max(0, self._bytes - size)
+            self._records = max(0, self._records - lines)
+            logging.info("Спул: сегмент %s перенесен в БД (%s сообщений, %.0f мс).",
+                         os.path.basename(path), len(messages) - len(rejected), (time.monotonic() - started) * 1000)
+        if self._records == 0:
+            self._oldest = None
+        else:
+            _, _, self._oldest = await asyncio.to_thread(self._scan)
+        self._update_gauges()
+        return inserted
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.replay_interval)
+            if not self._records and not self.degraded:
+                continue
+            try:
+                inserted = await self.replay()
+                if self.degraded and self.probe is not None:
+                    await self.probe()
+            except Exception as e:
+                self.degraded = True
+                metrics.inc("spool_replay_failures_total")
+                logging.warning("Спул: БД все еще недоступна (%s), в спуле %s сообщений.", e, self._records)
+                self._update_gauges()
+                continue
+            if self.degraded:
+                logging.info("Спул: запись в БД восстановлена, досылка завершена (вставлено %s).", inserted)
+            self.degraded = False
+
+    async def start(self):
+        """Подсчитывает оставшиеся с прошлого запуска сегменты и запускает фоновую досылку."""
+        if self._task and not self._task.done():
+            return
+        if not os.path.isabs(self.directory):
+            # Относительный путь - внутри каталога приложения, который на хостинге обычно не переживает деплой
+            logging.warning("Спул: каталог '%s' задан относительным путем; укажите в SPOOL_DIR путь на "
+                            "постоянном диске, иначе недосланные сообщения теряются при перезапуске.", self.directory)
+        self._bytes, self._records, self._oldest = await asyncio.to_thread(self._scan)
+        if self._records:
+            logging.warning("Спул: найдено %s недосланных сообщений (%s байт), будут перенесены в БД.",
+                            self._records, self._bytes)
+        self._update_gauges()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает досылку и закрывает текущий сегмент (недосланное остается на диске до следующего запуска)."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._sync_task:
+            await asyncio.gather(self._sync_task, return_exceptions=True)
+        if self._file is not None:
+            await asyncio.to_thread(self._close_segment)
+
+# --- END OF FILE db/spool.py ---
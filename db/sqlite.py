@@ -0,0 +1,445 @@
+# --- START OF FILE db/sqlite.py ---
+
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, List, Dict, Optional, Tuple
+
+from db.base import (
+    StorageBackend, ExportWriter, LLMUsageRecord, MessageRecord, RecentMessage,
+    SUMMARY_BLOCK_OVERHEAD, SUMMARY_MAX_MESSAGE_CHARS, SUMMARY_EMPTY_TEXT, format_export_rows,
+)
+
+# Размер порции строк при потоковой выгрузке
+EXPORT_BATCH_SIZE = 2000
+
+# Миграции схемы SQLite (версия хранится в PRAGMA user_version). Время хранится как REAL (Unix epoch, UTC).
+# Формат такой же, как в db/migrations.py: (версия, описание, [SQL-выражения])
+SQLITE_MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "initial schema", [
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            message_internal_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id      INTEGER NOT NULL,
+            username     TEXT    NOT NULL,
+            text         TEXT    NOT NULL,
+            "timestamp"  REAL    NOT NULL
+        )
+        """,
+        "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS chats (chat_id INTEGER PRIMARY KEY)",
+        'CREATE INDEX IF NOT EXISTS idx_messages_chat_id_timestamp ON messages (chat_id, "timestamp")',
+    ]),
+    (2, "stored summaries and digests", [
+        """
+        CREATE TABLE IF NOT EXISTS summaries (
+            summary_id   INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id      INTEGER NOT NULL,
+            period       TEXT    NOT NULL,
+            window_start REAL    NOT NULL,
+            window_end   REAL    NOT NULL,
+            model        TEXT    NOT NULL,
+            text         TEXT    NOT NULL,
+            created_at   REAL    NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_summaries_chat_period_window ON summaries (chat_id, period, window_start)",
+    ]),
+    (3, "idempotent ingestion by telegram message_id", [
+        "ALTER TABLE messages ADD COLUMN telegram_message_id INTEGER",
+        "ALTER TABLE messages ADD COLUMN edited_at REAL",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_messages_chat_telegram_message_id ON messages (chat_id, telegram_message_id)",
+    ]),
+    (4, "llm usage accounting", [
+        """
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            usage_id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at        REAL    NOT NULL,
+            chat_id           INTEGER NOT NULL,
+            model             TEXT    NOT NULL,
+            purpose           TEXT    NOT NULL,
+            outcome           TEXT    NOT NULL,
+            prompt_tokens     INTEGER,
+            completion_tokens INTEGER,
+            total_tokens      INTEGER,
+            cost              REAL,
+            latency_ms        INTEGER,
+            source_chars      INTEGER NOT NULL,
+            sent_chars        INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_llm_usage_created_at ON llm_usage (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_llm_usage_chat_created_at ON llm_usage (chat_id, created_at)",
+    ]),
+    # activity_day - номер дня UTC (Unix epoch / 86400)
+    (5, "chat activity index", [
+        "ALTER TABLE chats ADD COLUMN active INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE chats ADD COLUMN last_message_at REAL",
+        "ALTER TABLE chats ADD COLUMN activity_day INTEGER",
+        "ALTER TABLE chats ADD COLUMN day_count INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE chats ADD COLUMN prev_day_count INTEGER NOT NULL DEFAULT 0",
+        'UPDATE chats SET last_message_at = (SELECT max("timestamp") FROM messages m WHERE m.chat_id = chats.chat_id)',
+        "UPDATE chats SET activity_day = CAST(last_message_at / 86400 AS INTEGER) WHERE last_message_at IS NOT NULL",
+        """
+        UPDATE chats SET
+            day_count = (SELECT count(*) FROM messages m WHERE m.chat_id = chats.chat_id
+                         AND m."timestamp" >= activity_day * 86400 AND m."timestamp" < (activity_day + 1) * 86400),
+            prev_day_count = (SELECT count(*) FROM messages m WHERE m.chat_id = chats.chat_id
+                              AND m."timestamp" >= (activity_day - 1) * 86400 AND m."timestamp" < activity_day * 86400)
+        WHERE activity_day IS NOT NULL
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_chats_active_last_message_at ON chats (last_message_at) WHERE active = 1",
+    ]),
+]
+
+
+def _from_epoch(value: float) -> datetime:
+    return datetime.fromtimestamp(value, tz=timezone.utc)
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Встроенное хранилище на SQLite в режиме WAL - для тестов, бенчмарков и небольших
+    однонодовых развертываний. Все обращения к соединению выполняются в одном
+    выделенном потоке, поэтому event loop не блокируется, а блокировки не нужны.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def _run(self, fn: Callable[..., Any], *args) -> Any:
+        if self._executor is None or self._conn is None:
+            raise ConnectionError("SQLite storage is not initialized or already closed")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # --- Жизненный цикл ---
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for migration_version, description, statements in SQLITE_MIGRATIONS:
+            if migration_version <= version:
+                continue
+            logging.info("SQLite: применение миграции %s: %s...", migration_version, description)
+            conn.execute("BEGIN")
+            try:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {int(migration_version)}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self._conn = conn
+
+    async def init(self):
+        if self._conn is not None:
+            logging.warning("SQLite-хранилище уже инициализировано.")
+            return
+        logging.info("Открытие SQLite-хранилища: %s", self.path)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._open)
+        except Exception:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            raise
+
+    async def close(self):
+        if self._conn is None:
+            logging.warning("Попытка закрыть неинициализированное или уже закрытое SQLite-хранилище.")
+            return
+        try:
+            await self._run(self._conn.close)
+            logging.info("🛑 SQLite-хранилище закрыто.")
+        finally:
+            self._conn = None
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    # --- Операции (выполняются в потоке SQLite) ---
+    def _ping(self):
+        self._conn.execute("SELECT 1").fetchone()
+
+    def _save_message(self, chat_id: int, username: str, text: str, ts: float, telegram_message_id: Optional[int]) -> bool:
+        cursor = self._conn.execute(
+            'INSERT INTO messages(chat_id, username, text, "timestamp", telegram_message_id) VALUES(?, ?, ?, ?, ?) '
+            'ON CONFLICT(chat_id, telegram_message_id) DO NOTHING',
+            (chat_id, username, text, ts, telegram_message_id)
+        )
+        return cursor.rowcount == 1
+
+    def _save_messages(self, rows: List[tuple]) -> List[int]:
+        """Вставляет строки одной транзакцией. Возвращает индексы фактически вставленных."""
+        inserted: List[int] = []
+        self._conn.execute("BEGIN")
+        try:
+            for index, row in enumerate(rows):
+                cursor = self._conn.execute(
+                    'INSERT INTO messages(chat_id, username, text, "timestamp", telegram_message_id) VALUES(?, ?, ?, ?, ?) '
+                    'ON CONFLICT(chat_id, telegram_message_id) DO NOTHING',
+                    row
+                )
+                if cursor.rowcount == 1:
+                    inserted.append(index)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return inserted
+
+    def _update_message_text(self, chat_id: int, telegram_message_id: int, text: str, edited_at: float) -> bool:
+        cursor = self._conn.execute(
+            "UPDATE messages SET text = ?, edited_at = ? WHERE chat_id = ? AND telegram_message_id = ?",
+            (text, edited_at, chat_id, telegram_message_id)
+        )
+        return cursor.rowcount > 0
+
+    def _register_chat(self, chat_id: int) -> bool:
+        cursor = self._conn.execute(
+            "INSERT INTO chats(chat_id) VALUES(?) ON CONFLICT(chat_id) DO UPDATE SET active = 1 WHERE active = 0",
+            (chat_id,)
+        )
+        return cursor.rowcount == 1
+
+    def _deactivate_chat(self, chat_id: int) -> bool:
+        return self._conn.execute("UPDATE chats SET active = 0 WHERE chat_id = ? AND active", (chat_id,)).rowcount > 0
+
+    def _record_chat_activity(self, chat_id: int, at: float, count: int):
+        # Те же правила сдвига дневных счетчиков, что и в PostgreSQL (db/postgres.py)
+        self._conn.execute(
+            """
+            INSERT INTO chats(chat_id, last_message_at, activity_day, day_count) VALUES(?, ?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET
+                last_message_at = max(COALESCE(last_message_at, excluded.last_message_at), excluded.last_message_at),
+                prev_day_count = CASE
+                    WHEN activity_day IS NULL OR excluded.activity_day > activity_day + 1 THEN 0
+                    WHEN excluded.activity_day = activity_day + 1 THEN day_count
+                    WHEN excluded.activity_day = activity_day - 1 THEN prev_day_count + excluded.day_count
+                    ELSE prev_day_count END,
+                day_count = CASE
+                    WHEN activity_day IS NULL OR excluded.activity_day > activity_day THEN excluded.day_count
+                    WHEN excluded.activity_day = activity_day THEN day_count + excluded.day_count
+                    ELSE day_count END,
+                activity_day = max(COALESCE(activity_day, excluded.activity_day), excluded.activity_day)
+            """,
+            (chat_id, at, int(at // 86400), count)
+        )
+
+    def _get_registered_chats(self) -> List[int]:
+        return [row[0] for row in self._conn.execute("SELECT chat_id FROM chats WHERE active = 1")]
+
+    def _get_active_chats(self, since: float) -> List[Tuple[int, int]]:
+        since_day = int(since // 86400)
+        rows = self._conn.execute(
+            """
+            SELECT chat_id,
+                   CASE WHEN activity_day >= ? THEN day_count ELSE 0 END
+                   + CASE WHEN activity_day - 1 >= ? THEN prev_day_count ELSE 0 END
+            FROM chats
+            WHERE active = 1 AND last_message_at >= ?
+            """,
+            (since_day, since_day, since)
+        )
+        return rows.fetchall()
+
+    def _get_messages_for_summary(self, chat_id: int, since: float) -> List[Dict]:
+        rows = self._conn.execute(
+            'SELECT username, text, "timestamp" FROM messages '
+            'WHERE chat_id = ? AND "timestamp" >= ? ORDER BY "timestamp" ASC, message_internal_id ASC',
+            (chat_id, since)
+        )
+        return [{"username": u, "text": t, "timestamp": _from_epoch(ts)} for u, t, ts in rows]
+
+    def _get_recent_messages(self, chat_id: int, since: float, max_chars: int) -> Tuple[List[RecentMessage], bool]:
+        cursor = self._conn.execute(
+            'SELECT "timestamp", username, substr(text, 1, ?) FROM messages '
+            'WHERE chat_id = ? AND "timestamp" >= ? ORDER BY "timestamp" DESC, message_internal_id DESC',
+            (SUMMARY_MAX_MESSAGE_CHARS, chat_id, since)
+        )
+        kept, used, complete = [], 0, True
+        try:
+            # Строки читаются от новых к старым по мере итерации - на бюджете чтение прекращается
+            for row in cursor:
+                used += len(row[1]) + len(row[2] or SUMMARY_EMPTY_TEXT) + SUMMARY_BLOCK_OVERHEAD
+                if used > max_chars:
+                    complete = False
+                    break
+                kept.append(row)
+        finally:
+            cursor.close()
+        # Время переводится в datetime только для попавших в бюджет строк
+        return [(_from_epoch(ts), u, t) for ts, u, t in reversed(kept)], complete
+
+    def _open_export_cursor(self, chat_id: int, since: float, until: float) -> sqlite3.Cursor:
+        return self._conn.execute(
+            'SELECT "timestamp", username, text, telegram_message_id FROM messages '
+            'WHERE chat_id = ? AND "timestamp" >= ? AND "timestamp" < ? ORDER BY "timestamp" ASC, message_internal_id ASC',
+            (chat_id, since, until)
+        )
+
+    def _export_chunk(self, cursor: sqlite3.Cursor, fmt: str, header: bool) -> Tuple[bytes, int]:
+        rows = [(_from_epoch(ts), u, t, mid) for ts, u, t, mid in cursor.fetchmany(EXPORT_BATCH_SIZE)]
+        return format_export_rows(rows, fmt, header=header), len(rows)
+
+    def _save_summary(self, chat_id: int, period: str, window_start: float, window_end: float, model: str, text: str):
+        self._conn.execute(
+            "INSERT INTO summaries(chat_id, period, window_start, window_end, model, text) VALUES(?, ?, ?, ?, ?, ?)",
+            (chat_id, period, window_start, window_end, model, text)
+        )
+
+    def _get_summaries(self, chat_id: int, period: str, since: float, until: float) -> List[Dict]:
+        rows = self._conn.execute(
+            "SELECT period, window_start, window_end, model, text FROM summaries "
+            "WHERE chat_id = ? AND period = ? AND window_end > ? AND window_end <= ? ORDER BY window_start ASC",
+            (chat_id, period, since, until)
+        )
+        return [
+            {"period": p, "window_start": _from_epoch(ws), "window_end": _from_epoch(we), "model": m, "text": t}
+            for p, ws, we, m, t in rows
+        ]
+
+    def _save_llm_usage(self, rows: List[tuple]):
+        columns = ", ".join(LLMUsageRecord._fields)
+        placeholders = ", ".join("?" * len(LLMUsageRecord._fields))
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany(f"INSERT INTO llm_usage({columns}) VALUES({placeholders})", rows)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _get_llm_usage_stats(self, since: float, group_by: str) -> List[Dict]:
+        key, order = {
+            "chat": ("chat_id", "total_tokens DESC"),
+            "day": ("date(created_at, 'unixepoch')", "key ASC"),
+        }[group_by]
+        cursor = self._conn.execute(
+            f"""
+            SELECT {key} AS key,
+                   count(*) AS calls,
+                   sum(outcome <> 'ok') AS failures,
+                   COALESCE(sum(prompt_tokens), 0) AS prompt_tokens,
+                   COALESCE(sum(completion_tokens), 0) AS completion_tokens,
+                   COALESCE(sum(total_tokens), 0) AS total_tokens,
+                   COALESCE(sum(cost), 0) AS cost,
+                   COALESCE(avg(latency_ms), 0) AS avg_latency_ms,
+                   sum(source_chars) AS source_chars,
+                   sum(sent_chars) AS sent_chars
+            FROM llm_usage
+            WHERE created_at >= ?
+            GROUP BY 1
+            ORDER BY {order}
+            """,
+            (since,)
+        )
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def _get_setting(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_setting(self, key: str, value: str):
+        self._conn.execute(
+            "INSERT INTO settings(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+
+    def _delete_setting(self, key: str):
+        self._conn.execute("DELETE FROM settings WHERE key = ?", (key,))
+
+    def _get_settings_by_prefix(self, prefix: str) -> Dict[str, str]:
+        rows = self._conn.execute("SELECT key, value FROM settings WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+        return dict(rows.fetchall())
+
+    # --- Асинхронный интерфейс ---
+    async def ping(self):
+        await self._run(self._ping)
+
+    async def save_message(self, chat_id: int, username: str, text: str, timestamp: datetime,
+                           telegram_message_id: Optional[int] = None) -> bool:
+        return await self._run(self._save_message, chat_id, username, text, timestamp.timestamp(), telegram_message_id)
+
+    async def save_messages(self, messages: List[MessageRecord]) -> List[MessageRecord]:
+        rows = [message._replace(timestamp=message.timestamp.timestamp()) for message in messages]
+        return [messages[index] for index in await self._run(self._save_messages, rows)]
+
+    async def update_message_text(self, chat_id: int, telegram_message_id: int, text: str, edited_at: datetime) -> bool:
+        return await self._run(self._update_message_text, chat_id, telegram_message_id, text, edited_at.timestamp())
+
+    async def register_chat(self, chat_id: int) -> bool:
+        return await self._run(self._register_chat, chat_id)
+
+    async def deactivate_chat(self, chat_id: int) -> bool:
+        return await self._run(self._deactivate_chat, chat_id)
+
+    async def record_chat_activity(self, chat_id: int, at: datetime, count: int = 1):
+        await self._run(self._record_chat_activity, chat_id, at.timestamp(), count)
+
+    async def get_registered_chats(self) -> List[int]:
+        return await self._run(self._get_registered_chats)
+
+    async def get_active_chats(self, since: datetime) -> List[Tuple[int, int]]:
+        return await self._run(self._get_active_chats, since.timestamp())
+
+    async def get_messages_for_summary(self, chat_id: int, since: datetime) -> List[Dict]:
+        return await self._run(self._get_messages_for_summary, chat_id, since.timestamp())
+
+    async def get_recent_messages(self, chat_id: int, since: datetime,
+                                  max_chars: int) -> Tuple[List[RecentMessage], bool]:
+        return await self._run(self._get_recent_messages, chat_id, since.timestamp(), max_chars)
+
+    async def export_messages(self, chat_id: int, since: datetime, until: datetime, fmt: str,
+                              write: ExportWriter) -> int:
+        cursor = await self._run(self._open_export_cursor, chat_id, since.timestamp(), until.timestamp())
+        total, header = 0, fmt == "csv"
+        try:
+            while True:
+                # Форматирование тоже в потоке SQLite - event loop только передает готовые байты
+                chunk, count = await self._run(self._export_chunk, cursor, fmt, header)
+                header = False
+                if chunk:
+                    await write(chunk)
+                total += count
+                if count < EXPORT_BATCH_SIZE:
+                    return total
+        finally:
+            await self._run(cursor.close)
+
+    async def save_summary(self, chat_id: int, period: str, window_start: datetime, window_end: datetime,
+                           model: str, text: str):
+        await self._run(self._save_summary, chat_id, period, window_start.timestamp(), window_end.timestamp(), model, text)
+
+    async def get_summaries(self, chat_id: int, period: str, since: datetime, until: datetime) -> List[Dict]:
+        return await self._run(self._get_summaries, chat_id, period, since.timestamp(), until.timestamp())
+
+    async def save_llm_usage(self, records: List[LLMUsageRecord]):
+        rows = [record._replace(created_at=record.created_at.timestamp()) for record in records]
+        await self._run(self._save_llm_usage, rows)
+
+    async def get_llm_usage_stats(self, since: datetime, group_by: str) -> List[Dict]:
+        return await self._run(self._get_llm_usage_stats, since.timestamp(), group_by)
+
+    async def get_setting(self, key: str) -> Optional[str]:
+        return await self._run(self._get_setting, key)
+
+    async def set_setting(self, key: str, value: str):
+        await self._run(self._set_setting, key, value)
+
+    async def delete_setting(self, key: str):
+        await self._run(self._delete_setting, key)
+
+    async def get_settings_by_prefix(self, prefix: str) -> Dict[str, str]:
+        return await self._run(self._get_settings_by_prefix, prefix)
+
+# --- END OF FILE db/sqlite.py ---
@@ -1,14 +1,17 @@
 # --- START OF FILE main.py ---
 
+import time
+_PROCESS_STARTED = time.perf_counter() # Засекаем как можно раньше - для замера холодного старта
+
 import os
+import asyncio
 import logging
 import sys # Для sys.exit
+import hmac
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
-# Импорты aiogram и typing (оставляем как есть)
-# from typing import Callable, Dict, Any, Awaitable # Не нужно без middleware
-# from aiogram import BaseMiddleware # Не нужно без middleware
-# from aiogram.types import Update # Не нужно без middleware
+# Импорты aiogram
 from aiogram import Bot, Dispatcher, F
 from aiogram.types import Message # Оставляем, т.к. может использоваться где-то еще
 
@@ -18,50 +21,67 @@ from aiohttp import web
 
 # Импортируем роутеры и функцию настройки планировщика
 from bot.handlers import user_handlers, chat_handlers, admin_handlers
+from api_clients.openrouter import llm_usage
+from api_clients.telegram_session import create_bot_session
+from bot.utils import metrics
+from bot.utils.logging_setup import setup_logging
+from bot.middleware.timing_middleware import UpdateTimingMiddleware, HandlerNameMiddleware
 # from bot.middleware.auth_middleware import AuthMiddleware # Оставляем AuthMiddleware закомментированным
 
 # Импортируем функции для работы с БД и конфигурацию
 try:
-    from db.db import init_pool, close_pool
-    from config.config import BOT_TOKEN, WEBHOOK_HOST, WEBHOOK_PATH, PORT, ADMIN_CHAT_ID
+    from db.db import init_pool, close_pool, spool, chat_activity
+    from db import chat_settings
+    from config.config import (
+        BOT_TOKEN, WEBHOOK_HOST, WEBHOOK_PATH, PORT, ADMIN_CHAT_ID, FAST_COLD_START,
+        LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE, LOG_SAMPLED_LOGGERS, SLOW_UPDATE_THRESHOLD_MS,
+        TELEGRAM_API_URL, TELEGRAM_API_LOCAL, TELEGRAM_POOL_LIMIT, TELEGRAM_REQUEST_TIMEOUT, TELEGRAM_KEEPALIVE_SECONDS,
+        METRICS_TOKEN,
+    )
 except (ImportError, ValueError) as e:
      # Ловим ошибки импорта или ValueErrors из config.py на самом раннем этапе
      logging.basicConfig(level=logging.CRITICAL, format="%(asctime)s - %(levelname)s - %(message)s")
-     logging.critical(f"Критическая ошибка при загрузке конфигурации или зависимостей: {e}")
+     logging.critical("Критическая ошибка при загрузке конфигурации или зависимостей: %s", e)
      sys.exit(f"Критическая ошибка конфигурации: {e}")
 
 # Загружаем переменные окружения из .env файла (на случай локального запуска)
 load_dotenv()
 
 # --- Настройка логирования ---
-# Оставляем DEBUG для детального вывода во время тестов
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - [%(name)s:%(lineno)d] - %(message)s",
-    datefmt='%Y-%m-%d %H:%M:%S',
-    stream=sys.stdout,
-    force=True
-)
-# Уменьшаем "болтливость" библиотек, но оставляем DEBUG для диспетчера
+# Неблокирующий конвейер: QueueHandler на event loop, форматирование и запись - в отдельном потоке
+setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, sample_rate=LOG_SAMPLE_RATE, sampled_loggers=LOG_SAMPLED_LOGGERS)
+# Уменьшаем "болтливость" библиотек
 logging.getLogger("aiogram.client.session").setLevel(logging.INFO)
 logging.getLogger("aiogram.webhook.aiohttp_server").setLevel(logging.INFO)
-logging.getLogger("aiogram.dispatcher").setLevel(logging.DEBUG) # Оставляем DEBUG для диспетчера
 logging.getLogger("aiohttp.access").setLevel(logging.INFO)
 logging.getLogger("apscheduler").setLevel(logging.INFO)
 logging.getLogger("asyncpg").setLevel(logging.INFO)
 
 # Логгер для нашего приложения
 logger = logging.getLogger(__name__)
+logger.info("⏱ Импорт модулей завершен за %.1f мс.", (time.perf_counter() - _PROCESS_STARTED) * 1000)
+
+# Задержка фонового запуска планировщика сводок в режиме FAST_COLD_START (секунды)
+SCHEDULER_DEFER_SECONDS = 5
 
 
-# --- Middleware для логирования (остается удаленным/закомментированным) ---
-# class UpdateTypeLoggerMiddleware...
-# dp.update.middleware(...)
+@contextmanager
+def _startup_phase(name: str):
+    """Логирует длительность фазы запуска."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        logger.info("⏱ Фаза запуска '%s': %.1f мс.", name, (time.perf_counter() - started) * 1000)
+
 
 # --- Инициализация Bot и Dispatcher ---
 try:
+    # Сессия с настраиваемым пулом соединений, таймаутами и адресом Bot API (в т.ч. локальный сервер)
+    session = create_bot_session(TELEGRAM_API_URL, is_local=TELEGRAM_API_LOCAL, limit=TELEGRAM_POOL_LIMIT,
+                                 timeout=TELEGRAM_REQUEST_TIMEOUT, keepalive_timeout=TELEGRAM_KEEPALIVE_SECONDS)
     # Используем DefaultBotProperties для parse_mode
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+    bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
     dp = Dispatcher()
     logger.info("Bot и Dispatcher инициализированы.")
 except Exception as e:
@@ -70,7 +90,11 @@ except Exception as e:
 
 # --- Подключение Middleware ---
 # dp.message.middleware(AuthMiddleware()) # AuthMiddleware остается закомментированным
-# dp.update.middleware(UpdateTypeLoggerMiddleware()) # Логгирующий middleware остается закомментированным
+# Замер wall/CPU-времени каждого обновления; внутренние middleware сообщают ему имя хэндлера
+dp.update.outer_middleware(UpdateTimingMiddleware(slow_threshold_ms=SLOW_UPDATE_THRESHOLD_MS))
+for event_name, observer in dp.observers.items():
+    if event_name not in ("update", "error"):
+        observer.middleware(HandlerNameMiddleware())
 
 # --- Подключение роутеров ---
 # ----> РАСКОММЕНТИРОВАНЫ ВСЕ РОУТЕРЫ <----
@@ -85,34 +109,74 @@ async def health_check(request: web.Request) -> web.Response:
     logger.debug("Получен запрос на health_check (/)")
     return web.Response(text="OK")
 
+async def metrics_handler(request: web.Request) -> web.Response:
+    """Отдает внутренние метрики (очередь LLM и т.п.) в формате Prometheus. Доступ - только с METRICS_TOKEN."""
+    auth = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        raise web.HTTPUnauthorized()
+    return web.Response(text=metrics.render_prometheus(), content_type="text/plain")
+
+async def _deferred_scheduler_setup(current_bot: Bot):
+    """Запускает планировщик сводок уже после старта сервера (режим FAST_COLD_START)."""
+    await asyncio.sleep(SCHEDULER_DEFER_SECONDS)
+    with _startup_phase("scheduler (deferred)"):
+        try: admin_handlers.setup_scheduler(current_bot)
+        except Exception as e: logger.error("⚠️ Не удалось настроить или запустить планировщик: %s", e)
+
+async def _ensure_webhook(current_bot: Bot, webhook_url: str):
+    """Устанавливает вебхук, только если текущие настройки в Telegram отличаются."""
+    used_update_types = dp.resolve_used_update_types()
+    logger.info("Типы обновлений, используемые диспетчером: %s", used_update_types)
+    try:
+        webhook_info = await current_bot.get_webhook_info()
+        if webhook_info.url == webhook_url and set(webhook_info.allowed_updates or []) == set(used_update_types):
+            logger.info("Webhook уже установлен (%s), повторная установка пропущена.", webhook_url)
+            return
+    except Exception as e:
+        logger.warning("Не удалось получить информацию о webhook (%s), устанавливаем заново.", e)
+    await current_bot.set_webhook(webhook_url, allowed_updates=used_update_types)
+    logger.info("🚀 Webhook успешно установлен: %s", webhook_url)
+
 async def on_startup(app: web.Application):
     logger.info("Запуск приложения on_startup...")
     current_bot = app.get('bot') or bot
-    try: await init_pool()
-    except Exception as e:
-        logger.critical(f"❌ Не удалось инициализировать БД в on_startup: {e}. Завершение работы.")
-        raise web.GracefulExit() from e
-    try: admin_handlers.setup_scheduler(current_bot)
-    except Exception as e: logger.error(f"⚠️ Не удалось настроить или запустить планировщик в on_startup: {e}")
+    with _startup_phase("database"):
+        try: await init_pool()
+        except Exception as e:
+            logger.critical("❌ Не удалось инициализировать БД в on_startup: %s. Завершение работы.", e)
+            raise web.GracefulExit() from e
+    if spool:
+        # Досылка сообщений, оставшихся в локальном спуле (в т.ч. с прошлого запуска)
+        with _startup_phase("spool"):
+            try: await spool.start()
+            except Exception as e: logger.error("⚠️ Не удалось запустить досылку спула: %s", e)
+    with _startup_phase("chat settings"):
+        # Прогрев кэша настроек чатов: дальше чтение настроек не обращается к БД
+        try: await chat_settings.init()
+        except Exception as e: logger.error("⚠️ Не удалось загрузить настройки чатов: %s", e)
+    llm_usage.start()
+    chat_activity.start()
+    if FAST_COLD_START:
+        app['scheduler_setup_task'] = asyncio.create_task(_deferred_scheduler_setup(current_bot))
+    else:
+        with _startup_phase("scheduler"):
+            try: admin_handlers.setup_scheduler(current_bot)
+            except Exception as e: logger.error("⚠️ Не удалось настроить или запустить планировщик в on_startup: %s", e)
     webhook_host = os.getenv("RENDER_EXTERNAL_HOSTNAME") or WEBHOOK_HOST
     if not webhook_host:
         logger.critical("❌ Не задан хост для webhook (RENDER_EXTERNAL_HOSTNAME или WEBHOOK_HOST)")
         raise web.GracefulExit("Webhook host is not set")
     webhook_url = f"https://{webhook_host}{WEBHOOK_PATH}"
-    logger.info(f"▶ Установка WEBHOOK_URL: {webhook_url}")
-    try:
-        used_update_types = dp.resolve_used_update_types()
-        logger.info(f"Типы обновлений, используемые диспетчером: {used_update_types}")
-        await current_bot.set_webhook(webhook_url, allowed_updates=used_update_types)
-        logger.info(f"🚀 Webhook успешно установлен: {webhook_url}")
-    except Exception as e:
-        logger.critical(f"❌ Не удалось установить webhook ({webhook_url}): {e}")
-        raise web.GracefulExit() from e
-    logger.info("Функция on_startup завершена.")
-
-async def on_shutdown(app: web.Application):
-    logger.info("🏁 Завершение работы приложения on_shutdown...")
-    current_bot = app.get('bot') or bot
+    logger.info("▶ Проверка WEBHOOK_URL: %s", webhook_url)
+    with _startup_phase("webhook"):
+        try: await _ensure_webhook(current_bot, webhook_url)
+        except Exception as e:
+            logger.critical("❌ Не удалось установить webhook (%s): %s", webhook_url, e)
+            raise web.GracefulExit() from e
+    logger.info("⏱ Функция on_startup завершена, готовность через %.1f мс после старта процесса.",
+                (time.perf_counter() - _PROCESS_STARTED) * 1000)
+
+async def _delete_webhook(current_bot: Bot):
     logger.info("Удаление вебхука...")
     try:
         webhook_info = await current_bot.get_webhook_info()
@@ -121,7 +185,25 @@ async def on_shutdown(app: web.Application):
             logger.info("Webhook удален.")
         else:
             logger.info("Вебхук не был установлен, удаление не требуется.")
-    except Exception as e: logger.error(f"❌ Ошибка при удалении webhook: {e}")
+    except Exception as e: logger.error("❌ Ошибка при удалении webhook: %s", e)
+
+async def on_shutdown(app: web.Application):
+    logger.info("🏁 Завершение работы приложения on_shutdown...")
+    current_bot = app.get('bot') or bot
+    scheduler_setup_task = app.get('scheduler_setup_task')
+    if scheduler_setup_task and not scheduler_setup_task.done():
+        scheduler_setup_task.cancel()
+    if FAST_COLD_START:
+        # Вебхук оставляем: Telegram должен разбудить сервис следующим обновлением
+        logger.info("FAST_COLD_START: вебхук не удаляется при остановке.")
+    else:
+        await _delete_webhook(current_bot)
+    # Сохраняем накопленный учет запросов к LLM до закрытия хранилища
+    await llm_usage.stop()
+    if spool:
+        await spool.stop()
+    # Накопленная активность чатов - после остановки спула (досылка тоже ее пополняет)
+    await chat_activity.stop()
     await close_pool()
     logger.info("Закрытие сессии бота...")
     await current_bot.session.close()
@@ -132,20 +214,25 @@ async def on_shutdown(app: web.Application):
 def main():
     app = web.Application()
     app.router.add_get("/", health_check)
+    # Метрики раскрывают активность чатов и расход токенов - эндпоинт только при заданном токене
+    if METRICS_TOKEN:
+        app.router.add_get("/metrics", metrics_handler)
+    else:
+        logger.info("METRICS_TOKEN не задан, эндпоинт /metrics отключен.")
     webhook_request_handler = SimpleRequestHandler(dispatcher=dp, bot=bot)
     webhook_request_handler.register(app, path=WEBHOOK_PATH)
-    logger.info(f"Обработчик вебхуков Telegram зарегистрирован по пути: {WEBHOOK_PATH}")
+    logger.info("Обработчик вебхуков Telegram зарегистрирован по пути: %s", WEBHOOK_PATH)
     app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
     listen_host = "0.0.0.0"
     listen_port = PORT
-    logger.info(f"Запуск веб-сервера на http://{listen_host}:{listen_port}")
+    logger.info("Запуск веб-сервера на http://%s:%s", listen_host, listen_port)
     try: web.run_app(app, host=listen_host, port=listen_port, print=None)
     except OSError as e:
-        logger.critical(f"Не удалось запустить веб-сервер на порту {listen_port}: {e}")
+        logger.critical("Не удалось запустить веб-сервер на порту %s: %s", listen_port, e)
         sys.exit(f"Порт {listen_port} занят.")
     except Exception as e:
-        logger.exception(f"Критическая ошибка при запуске веб-сервера: {e}")
+        logger.exception("Критическая ошибка при запуске веб-сервера: %s", e)
         sys.exit("Ошибка запуска веб-сервера.")
 
 if __name__ == "__main__":
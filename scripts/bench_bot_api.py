@@ -0,0 +1,116 @@
+# --- START OF FILE scripts/bench_bot_api.py ---
+"""
+Пропускная способность отправки сообщений через сессию Bot API (api_clients/telegram_session.py).
+
+Поднимает локальную заглушку Bot API (aiohttp, отвечает на sendMessage с искусственной задержкой)
+и отправляет через нее пачку сообщений с заданной параллельностью - как рассылка сводок.
+Сравниваются размеры пула соединений и работа с keep-alive / без него.
+Заглушку можно оставить запущенной (--serve) и направить на нее бота: TELEGRAM_API_URL=http://127.0.0.1:8081
+
+Запуск из корня репозитория:
+    python -m scripts.bench_bot_api [--requests 2000] [--concurrency 200] [--latency-ms 20] [--limits 10,100]
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from typing import List
+
+from aiohttp import web
+from aiogram import Bot
+
+from api_clients.telegram_session import create_bot_session
+
+TOKEN = "123456:bench"
+HOST = "127.0.0.1"
+
+
+def make_stub_app(latency_ms: float) -> web.Application:
+    """Минимальная заглушка Bot API: sendMessage возвращает сообщение, остальные методы - True."""
+    counter = iter(range(1, 1 << 62))
+
+    async def handle(request: web.Request) -> web.Response:
+        data = await request.post() if request.content_type != "application/json" else await request.json()
+        if latency_ms:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * latency_ms / 1000)
+        if request.match_info["method"].lower() != "sendmessage":
+            return web.json_response({"ok": True, "result": True})
+        chat_id = int(data["chat_id"])
+        return web.json_response({"ok": True, "result": {
+            "message_id": next(counter), "date": int(time.time()), "text": data.get("text", ""),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+        }})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle)
+    return app
+
+
+async def run_burst(api_url: str, requests: int, concurrency: int, limit: int, keepalive: bool) -> dict:
+    # Без keep-alive - новое соединение на каждый запрос, как без переиспользования пула
+    session = create_bot_session(api_url, limit=limit, timeout=30, keepalive_timeout=60 if keepalive else 0)
+    bot = Bot(TOKEN, session=session)
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await bot.send_message(-1000 - i % 50, f"Сводка номер {i}")
+            latencies.append(time.perf_counter() - started)
+
+    try:
+        await bot.send_message(-1, "warmup")
+        started = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await session.close()
+    latencies.sort()
+    return {
+        "rps": requests / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main_async(args) -> None:
+    runner = web.AppRunner(make_stub_app(args.latency_ms))
+    await runner.setup()
+    site = web.TCPSite(runner, HOST, args.port)
+    await site.start()
+    api_url = f"http://{HOST}:{args.port}"
+    try:
+        if args.serve:
+            print(f"Заглушка Bot API слушает {api_url} (Ctrl+C - остановить)")
+            await asyncio.Event().wait()
+        print(f"== {args.requests} запросов, параллельность {args.concurrency}, задержка сервера ~{args.latency_ms} мс")
+        for limit in (int(value) for value in args.limits.split(",")):
+            for keepalive in (True, False):
+                result = await run_burst(api_url, args.requests, args.concurrency, limit, keepalive)
+                print(f"  пул {limit:4}, keep-alive {'да ' if keepalive else 'нет'}: {result['rps']:8,.0f} запр./с, "
+                      f"p50 {result['p50_ms']:6.1f} мс, p99 {result['p99_ms']:6.1f} мс")
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--limits", default="10,100")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--serve", action="store_true", help="только запустить заглушку")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE scripts/bench_bot_api.py ---
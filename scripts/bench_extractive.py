@@ -0,0 +1,116 @@
+# --- START OF FILE scripts/bench_extractive.py ---
+"""
+Скорость и качество экстрактивного отбора сообщений (bot/utils/extractive.py) по сравнению
+с обрезкой по хвосту (поведение summarize_chat без отбора).
+
+Синтетический день: TOPICS тем со своим словарем, каждая обсуждается в основном в своем
+отрезке дня, плюс общие слова и короткие реплики-шум ("ок", "+1"). Метрики качества:
+  - покрытие тем: доля тем, из которых в выборку попало хотя бы одно сообщение;
+  - отклонение распределения: полная вариация между долями тем в выборке и за весь день (меньше - лучше);
+  - покрытие словаря: доля вхождений тематических слов дня, чьи слова есть в выборке.
+
+Запуск из корня репозитория:
+    python -m scripts.bench_extractive [--sizes 1000,10000,50000] [--budget 15000]
+"""
+
+import argparse
+import random
+import re
+import time
+from collections import Counter
+from typing import List, Tuple
+
+from bot.utils.extractive import select_representative
+
+TOPICS = 12
+WORDS_PER_TOPIC = 40
+SYLLABLES = ["ка", "ро", "ми", "ту", "ле", "на", "во", "пи", "зе", "ша", "до", "лю", "гра", "сти", "мо", "бер"]
+NOISE = ["ок", "+1", "да", "ага", "лол", "👍", "понял", "спасибо"]
+TOKEN_RE = re.compile(r"[^\W\d_]{2,}")
+
+
+def _word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def make_day(n: int, seed: int = 1) -> Tuple[List[str], List[str], List[int], List[set]]:
+    """
+    Возвращает (блоки "[HH:MM] user: text", тексты сообщений, тема каждого сообщения или -1 для шума,
+    словари тем).
+    """
+    rng = random.Random(seed)
+    vocab = [{_word(rng) for _ in range(WORDS_PER_TOPIC)} for _ in range(TOPICS)]
+    vocab_lists = [sorted(words) for words in vocab]
+    common = [_word(rng) for _ in range(60)]
+    blocks, texts, topics = [], [], []
+    for i in range(n):
+        minute = i * 24 * 60 // n
+        # Тема в основном "своего" отрезка дня, иногда - случайная
+        topic = minute * TOPICS // (24 * 60) if rng.random() < 0.8 else rng.randrange(TOPICS)
+        if rng.random() < 0.1:
+            text, topic = rng.choice(NOISE), -1
+        else:
+            words = [rng.choice(vocab_lists[topic]) if rng.random() < 0.7 else rng.choice(common)
+                     for _ in range(rng.randint(3, 15))]
+            text = " ".join(words)
+        blocks.append(f"[{minute // 60:02d}:{minute % 60:02d}] user_{rng.randrange(40)}: {text}")
+        texts.append(text)
+        topics.append(topic)
+    return blocks, texts, topics, vocab
+
+
+def tail_selection(blocks: List[str], max_chars: int) -> List[int]:
+    """Как в summarize_chat без отбора: самые свежие сообщения, пока влезают."""
+    used, chosen = 0, []
+    for index in range(len(blocks) - 1, -1, -1):
+        size = len(blocks[index]) + 1
+        if used + size > max_chars:
+            break
+        chosen.append(index)
+        used += size
+    return chosen[::-1]
+
+
+def quality(blocks: List[str], topics: List[int], vocab: List[set], chosen: List[int]) -> dict:
+    day = Counter(t for t in topics if t >= 0)
+    picked = Counter(topics[i] for i in chosen if topics[i] >= 0)
+    day_total, picked_total = sum(day.values()), max(1, sum(picked.values()))
+    tv = 0.5 * sum(abs(day[t] / day_total - picked[t] / picked_total) for t in range(TOPICS))
+    topic_words = set().union(*vocab)
+    day_words = Counter(w for b in blocks for w in TOKEN_RE.findall(b.lower()) if w in topic_words)
+    picked_words = {w for i in chosen for w in TOKEN_RE.findall(blocks[i].lower())}
+    covered = sum(c for w, c in day_words.items() if w in picked_words)
+    return {
+        "topics": sum(1 for t in day if picked[t]) / len(day),
+        "tv": tv,
+        "vocab": covered / sum(day_words.values()),
+        "messages": len(chosen),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,50000")
+    parser.add_argument("--budget", type=int, default=15000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for n in (int(size) for size in args.sizes.split(",")):
+        blocks, texts, topics, vocab = make_day(n)
+        best = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            chosen = select_representative(blocks, args.budget, texts)
+            best = min(best, time.perf_counter() - started)
+        assert sum(len(blocks[i]) + 1 for i in chosen) <= args.budget
+        print(f"== {n} сообщений, бюджет {args.budget} символов: отбор {best * 1000:.0f} мс")
+        for name, selection in (("хвост", tail_selection(blocks, args.budget)), ("отбор", chosen)):
+            q = quality(blocks, topics, vocab, selection)
+            print(f"  {name:6} сообщений {q['messages']:4}  темы {q['topics']:.0%}  "
+                  f"отклонение {q['tv']:.2f}  словарь {q['vocab']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE scripts/bench_extractive.py ---
@@ -0,0 +1,72 @@
+# --- START OF FILE scripts/bench_logging.py ---
+"""
+Бенчмарк накладных расходов логирования на одно обновление (на вызывающем потоке / event loop).
+
+Сравнивает:
+  - "before": прежнюю схему (basicConfig DEBUG, синхронный StreamHandler, f-строки);
+  - "after": QueueHandler + QueueListener, JSON, ленивое форматирование, уровень INFO, выборка.
+
+Запуск из корня репозитория:
+    python -m scripts.bench_logging [--updates 20000]
+"""
+
+import argparse
+import logging
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from bot.utils.logging_setup import TEXT_DATEFMT, TEXT_FORMAT, setup_logging, stop_logging
+
+
+def _update_before(log: logging.Logger, event_log: logging.Logger, i: int, now: datetime):
+    # Примерно тот набор строк, что раньше писался на каждое сообщение (f-строки, DEBUG диспетчера)
+    chat_id = -1001234567890 - (i % 50)
+    event_log.debug(f"Received update id={i} chat_id={chat_id}")
+    log.debug(f"Сохранение сообщения чата {chat_id} от user_{i % 300} ({now.isoformat()})")
+    log.debug(f"Регистрация чата {chat_id}")
+    event_log.info(f"Update id={i} is handled. Duration {i % 17} ms by bot id=42")
+
+
+def _update_after(log: logging.Logger, event_log: logging.Logger, i: int, now: datetime):
+    chat_id = -1001234567890 - (i % 50)
+    event_log.debug("Received update id=%s chat_id=%s", i, chat_id)
+    log.debug("Сохранение сообщения чата %s от user_%s (%s)", chat_id, i % 300, now)
+    log.debug("Регистрация чата %s", chat_id)
+    event_log.info("Update id=%s is handled. Duration %d ms by bot id=%d", i, i % 17, 42)
+
+
+def _run(update_fn, updates: int) -> float:
+    log = logging.getLogger("bench.app")
+    event_log = logging.getLogger("aiogram.event")
+    now = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    for i in range(updates):
+        update_fn(log, event_log, i, now)
+    return (time.perf_counter() - started) / updates * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as sink_before, \
+         tempfile.TemporaryFile("w+", encoding="utf-8") as sink_after:
+        logging.basicConfig(level=logging.DEBUG, format=TEXT_FORMAT, datefmt=TEXT_DATEFMT, stream=sink_before, force=True)
+        before_us = _run(_update_before, args.updates)
+
+        setup_logging(level="INFO", fmt="json", sample_rate=0.1, sampled_loggers=["aiogram.event"], stream=sink_after)
+        after_us = _run(_update_after, args.updates)
+        stop_logging()
+
+    print(f"updates:          {args.updates}")
+    print(f"before (sync):    {before_us:8.2f} мкс/обновление")
+    print(f"after (queue):    {after_us:8.2f} мкс/обновление")
+    print(f"ускорение:        {before_us / after_us:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE scripts/bench_logging.py ---
@@ -0,0 +1,343 @@
+# --- START OF FILE scripts/bench_storage.py ---
+"""
+Проверка соответствия (conformance) и пропускной способности бэкендов хранилища.
+
+Один и тот же набор проверок и замеров прогоняется против каждого бэкенда:
+memory, sqlite (временный файл, WAL) и - если задан --postgres-dsn - PostgreSQL.
+Внимание: для PostgreSQL используйте отдельную пустую тестовую базу.
+
+Запуск из корня репозитория:
+    python -m scripts.bench_storage [--messages 20000] [--postgres-dsn postgresql://...]
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List
+
+from db.base import StorageBackend, LLMUsageRecord, MessageRecord, SUMMARY_BLOCK_OVERHEAD, SUMMARY_MAX_MESSAGE_CHARS, SUMMARY_EMPTY_TEXT
+from db.memory import InMemoryStorage
+from db.sqlite import SQLiteStorage
+
+CHAT_A = -1001
+CHAT_B = -1002
+
+# --- Проверки соответствия интерфейсу ---
+Check = Callable[[StorageBackend], Awaitable[None]]
+CHECKS: List[Check] = []
+
+
+def check(fn: Check) -> Check:
+    CHECKS.append(fn)
+    return fn
+
+
+@check
+async def register_chat_is_idempotent(storage: StorageBackend):
+    assert await storage.register_chat(CHAT_A) is True
+    assert await storage.register_chat(CHAT_A) is False
+    assert await storage.register_chat(CHAT_B) is True
+    assert sorted(await storage.get_registered_chats()) == sorted([CHAT_A, CHAT_B])
+    # Бота удалили из чата - чат пропадает из списка, возвращение снова его активирует
+    assert await storage.deactivate_chat(CHAT_B) is True
+    assert await storage.deactivate_chat(CHAT_B) is False
+    assert await storage.get_registered_chats() == [CHAT_A]
+    assert await storage.register_chat(CHAT_B) is True
+    assert sorted(await storage.get_registered_chats()) == sorted([CHAT_A, CHAT_B])
+
+
+@check
+async def chat_activity_selects_eligible(storage: StorageBackend):
+    day = datetime(2024, 3, 10, tzinfo=timezone.utc)
+    quiet, busy, gone = -2001, -2002, -2003
+    await storage.register_chat(quiet)
+    await storage.record_chat_activity(quiet, day - timedelta(days=3))
+    await storage.record_chat_activity(busy, day - timedelta(hours=3), 4)     # вчера
+    await storage.record_chat_activity(busy, day + timedelta(hours=5))        # сегодня: сдвиг дня
+    await storage.record_chat_activity(busy, day + timedelta(hours=6), 2)
+    await storage.record_chat_activity(busy, day - timedelta(hours=1))        # опоздавшее вчерашнее
+    await storage.record_chat_activity(gone, day + timedelta(hours=1))
+    await storage.deactivate_chat(gone)
+    since = day + timedelta(hours=7) - timedelta(days=1)
+    # Оценка сверху: сегодня 3 + вчера 5 целиком (из них после since - только часть)
+    assert await storage.get_active_chats(since) == [(busy, 8)]
+    # Вчерашний бакет уже целиком вне окна - считается только сегодняшний
+    assert await storage.get_active_chats(day + timedelta(hours=1)) == [(busy, 3)]
+    assert await storage.get_active_chats(day + timedelta(days=1)) == []
+    # Запоздавшая запись активности (сброс буфера, досылка спула) не возвращает удаленный чат в рассылки -
+    # это делает только register_chat при возвращении бота
+    await storage.record_chat_activity(gone, day + timedelta(hours=7))
+    assert sorted(await storage.get_registered_chats()) == sorted([quiet, busy])
+    assert await storage.get_active_chats(since) == [(busy, 8)]
+    assert await storage.register_chat(gone) is True
+    assert sorted(await storage.get_registered_chats()) == sorted([quiet, busy, gone])
+
+
+@check
+async def messages_are_filtered_and_ordered(storage: StorageBackend):
+    base = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+    # Намеренно не по порядку
+    await storage.save_message(CHAT_A, "bob", "second", base + timedelta(minutes=2))
+    await storage.save_message(CHAT_A, "alice", "first", base + timedelta(minutes=1))
+    await storage.save_message(CHAT_A, "old", "too old", base - timedelta(days=1))
+    await storage.save_message(CHAT_B, "carol", "other chat", base + timedelta(minutes=1))
+    rows = await storage.get_messages_for_summary(CHAT_A, base)
+    assert [r["text"] for r in rows] == ["first", "second"], rows
+    assert rows[0]["username"] == "alice"
+    assert rows[0]["timestamp"] == base + timedelta(minutes=1)
+    assert rows[0]["timestamp"].utcoffset() == timedelta(0), "timestamp должен быть aware UTC"
+    assert await storage.get_messages_for_summary(CHAT_A, base + timedelta(hours=1)) == []
+
+
+@check
+async def since_is_inclusive(storage: StorageBackend):
+    ts = datetime(2024, 2, 1, tzinfo=timezone.utc)
+    await storage.save_message(CHAT_B, "dave", "exact", ts)
+    rows = await storage.get_messages_for_summary(CHAT_B, ts)
+    assert [r["text"] for r in rows] == ["exact"], rows
+
+
+@check
+async def ingestion_is_idempotent_and_edits_in_place(storage: StorageBackend):
+    ts = datetime(2024, 4, 1, tzinfo=timezone.utc)
+    assert await storage.save_message(CHAT_A, "erin", "hello", ts, telegram_message_id=10) is True
+    assert await storage.save_message(CHAT_A, "erin", "hello", ts, telegram_message_id=10) is False
+    # Тот же message_id в другом чате - другое сообщение
+    assert await storage.save_message(CHAT_B, "erin", "hello", ts, telegram_message_id=10) is True
+    # Сообщения без message_id (старые данные) не дедуплицируются
+    assert await storage.save_message(CHAT_A, "erin", "legacy", ts) is True
+    assert await storage.save_message(CHAT_A, "erin", "legacy", ts) is True
+    assert await storage.update_message_text(CHAT_A, 10, "hello (edited)", ts + timedelta(minutes=1)) is True
+    assert await storage.update_message_text(CHAT_A, 999, "missing", ts) is False
+    rows = await storage.get_messages_for_summary(CHAT_A, ts)
+    assert sorted(r["text"] for r in rows) == ["hello (edited)", "legacy", "legacy"], rows
+
+
+@check
+async def bulk_insert_skips_duplicates(storage: StorageBackend):
+    # Пакетная вставка (досылка спула) идемпотентна так же, как save_message
+    ts = datetime(2024, 4, 15, tzinfo=timezone.utc)
+    await storage.save_message(CHAT_B, "heidi", "already saved", ts, telegram_message_id=20)
+    batch = [MessageRecord(CHAT_B, "heidi", "already saved", ts, 20),
+             MessageRecord(CHAT_B, "ivan", "new", ts + timedelta(seconds=1), 21),
+             MessageRecord(CHAT_B, "ivan", "no id", ts + timedelta(seconds=2), None)]
+    assert await storage.save_messages(batch) == batch[1:]
+    assert await storage.save_messages(batch[:2]) == []
+    rows = await storage.get_messages_for_summary(CHAT_B, ts)
+    assert [r["text"] for r in rows] == ["already saved", "new", "no id"], rows
+    assert rows[1]["timestamp"] == ts + timedelta(seconds=1)
+
+
+@check
+async def recent_messages_fit_budget(storage: StorageBackend):
+    base = datetime(2024, 4, 20, tzinfo=timezone.utc)
+    chat = -1003
+    for i in range(10):
+        await storage.save_message(chat, "kate", f"message {i}", base + timedelta(minutes=i))
+    await storage.save_message(chat, "kate", "x" * 3000, base - timedelta(minutes=1))
+    await storage.save_message(chat, "kate", "before since", base - timedelta(days=1))
+    size = len("kate") + len("message 0") + SUMMARY_BLOCK_OVERHEAD
+    # Бюджет на 3 блока (с запасом меньше четвертого) - самые свежие, по возрастанию времени
+    rows, complete = await storage.get_recent_messages(chat, base, size * 4 - 1)
+    assert [t for _, _, t in rows] == ["message 7", "message 8", "message 9"] and not complete, rows
+    assert rows[0][0] == base + timedelta(minutes=7) and rows[0][0].utcoffset() == timedelta(0), rows
+    rows, complete = await storage.get_recent_messages(chat, base - timedelta(hours=1), 10 ** 6)
+    assert complete and len(rows) == 11, rows
+    # Длинный текст обрезается хранилищем
+    assert rows[0][2] == "x" * SUMMARY_MAX_MESSAGE_CHARS, len(rows[0][2])
+    assert await storage.get_recent_messages(chat, base + timedelta(hours=1), 10 ** 6) == ([], True)
+    # Пустой текст в блоке заменяется на SUMMARY_EMPTY_TEXT - и в бюджете считается его длина
+    await storage.save_message(chat, "kate", "", base + timedelta(hours=2))
+    empty_size = len("kate") + len(SUMMARY_EMPTY_TEXT) + SUMMARY_BLOCK_OVERHEAD
+    assert await storage.get_recent_messages(chat, base + timedelta(hours=1), empty_size - 1) == ([], False)
+    assert len((await storage.get_recent_messages(chat, base + timedelta(hours=1), empty_size))[0]) == 1
+
+
+@check
+async def export_streams_csv_and_jsonl(storage: StorageBackend):
+    base = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    await storage.save_message(CHAT_A, "frank", 'quote " and, comma', base, telegram_message_id=1)
+    await storage.save_message(CHAT_A, "grace", "multi\nline", base + timedelta(minutes=1))
+    await storage.save_message(CHAT_A, "late", "outside", base + timedelta(days=1))
+    for fmt in ("csv", "jsonl"):
+        chunks: List[bytes] = []
+
+        async def write(chunk: bytes):
+            chunks.append(chunk)
+
+        rows = await storage.export_messages(CHAT_A, base, base + timedelta(days=1), fmt, write)
+        assert rows == 2, (fmt, rows)
+        data = b"".join(chunks).decode("utf-8")
+        if fmt == "csv":
+            parsed = list(csv.reader(io.StringIO(data)))
+            assert parsed[0] == ["timestamp", "username", "text", "telegram_message_id"], parsed
+            assert [(r[1], r[2], r[3]) for r in parsed[1:]] == [
+                ("frank", 'quote " and, comma', "1"), ("grace", "multi\nline", "")], parsed
+        else:
+            parsed = [json.loads(line) for line in data.splitlines()]
+            assert [(r["username"], r["text"], r["telegram_message_id"]) for r in parsed] == [
+                ("frank", 'quote " and, comma', 1), ("grace", "multi\nline", None)], parsed
+            assert datetime.fromisoformat(parsed[0]["timestamp"]).replace(tzinfo=timezone.utc) == base, parsed
+
+
+@check
+async def settings_roundtrip(storage: StorageBackend):
+    assert await storage.get_setting("missing") is None
+    await storage.set_setting("k", "v1")
+    await storage.set_setting("k", "v2")
+    assert await storage.get_setting("k") == "v2"
+    await storage.set_setting("chat:1:a", "x")
+    await storage.set_setting("chat:1:b", "y")
+    await storage.set_setting("chat:10:a", "z")
+    await storage.set_setting("chat_1", "not a prefix match")
+    assert await storage.get_settings_by_prefix("chat:1:") == {"chat:1:a": "x", "chat:1:b": "y"}
+    await storage.delete_setting("chat:1:a")
+    await storage.delete_setting("missing")
+    assert await storage.get_settings_by_prefix("chat:1:") == {"chat:1:b": "y"}
+    assert len(await storage.get_settings_by_prefix("chat:")) == 2
+
+
+@check
+async def summaries_roundtrip(storage: StorageBackend):
+    day = timedelta(days=1)
+    base = datetime(2024, 3, 1, 21, 0, tzinfo=timezone.utc)
+    for i in (2, 0, 1): # Намеренно не по порядку
+        await storage.save_summary(CHAT_A, "day", base + day * (i - 1), base + day * i, "model-x", f"day {i}")
+    await storage.save_summary(CHAT_A, "week", base - day * 7, base, "model-x", "week")
+    await storage.save_summary(CHAT_B, "day", base - day, base, "model-x", "other chat")
+    rows = await storage.get_summaries(CHAT_A, "day", base - day, base + day * 2)
+    assert [r["text"] for r in rows] == ["day 0", "day 1", "day 2"], rows
+    assert rows[0]["window_start"] == base - day and rows[0]["model"] == "model-x"
+    # Отбор по концу окна: (since, until]
+    rows = await storage.get_summaries(CHAT_A, "day", base - day, base + day)
+    assert [r["text"] for r in rows] == ["day 0", "day 1"], rows
+
+
+@check
+async def llm_usage_aggregates(storage: StorageBackend):
+    day = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+
+    def usage(created_at, chat_id, outcome, tokens, cost, latency_ms):
+        return LLMUsageRecord(created_at, chat_id, "model-x", "summary", outcome,
+                              tokens and tokens - 100, tokens and 100, tokens, cost, latency_ms, 20000, 15000)
+
+    await storage.save_llm_usage([
+        usage(day, CHAT_A, "ok", 1000, 0.5, 1000),
+        usage(day, CHAT_A, "ok", 3000, 1.5, 3000),
+        usage(day + timedelta(days=1), CHAT_B, "ok", 5000, None, 2000),
+        usage(day + timedelta(days=1), CHAT_B, "rejected", None, None, None),
+        usage(day - timedelta(days=10), CHAT_A, "ok", 9999, 9.0, 100),
+    ])
+    by_chat = await storage.get_llm_usage_stats(day - timedelta(days=1), "chat")
+    assert [s["key"] for s in by_chat] == [CHAT_B, CHAT_A], by_chat
+    b, a = by_chat
+    assert (a["calls"], a["failures"], a["total_tokens"], a["prompt_tokens"]) == (2, 0, 4000, 3800), a
+    assert abs(a["cost"] - 2.0) < 1e-9 and abs(a["avg_latency_ms"] - 2000) < 1e-9, a
+    assert (b["calls"], b["failures"], b["total_tokens"], b["cost"]) == (2, 1, 5000, 0), b
+    assert (b["source_chars"], b["sent_chars"]) == (40000, 30000), b
+    by_day = await storage.get_llm_usage_stats(day - timedelta(days=1), "day")
+    assert [(s["key"], s["calls"]) for s in by_day] == [("2024-06-01", 2), ("2024-06-02", 2)], by_day
+
+
+# --- Замеры пропускной способности ---
+async def measure_throughput(storage: StorageBackend, messages: int) -> dict:
+    chat_id = -2000
+    base = datetime.now(timezone.utc) - timedelta(hours=12)
+    step = timedelta(hours=12) / messages
+    started = time.perf_counter()
+    for i in range(messages):
+        await storage.save_message(chat_id, f"user_{i % 100}", f"сообщение номер {i} " * 3, base + step * i)
+    insert_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    rows = await storage.get_messages_for_summary(chat_id, base)
+    fetch_seconds = time.perf_counter() - started
+    assert len(rows) == messages, (len(rows), messages)
+
+    # Выборка для сводки с бюджетом контекста модели (15000 символов) - читаются только последние строки
+    started = time.perf_counter()
+    recent, _ = await storage.get_recent_messages(chat_id, base, 15000)
+    budget_fetch_seconds = time.perf_counter() - started
+    assert recent and recent[-1][2] == rows[-1]["text"]
+    return {"insert_per_sec": messages / insert_seconds, "fetch_ms": fetch_seconds * 1000,
+            "budget_fetch_ms": budget_fetch_seconds * 1000, "budget_rows": len(recent)}
+
+
+async def run_backend(name: str, factory: Callable[[], StorageBackend], messages: int) -> bool:
+    ok = True
+    for check_fn in CHECKS:
+        storage = factory()
+        await storage.init()
+        try:
+            await check_fn(storage)
+            print(f"  [{name}] ✔ {check_fn.__name__}")
+        except AssertionError as e:
+            ok = False
+            print(f"  [{name}] ✘ {check_fn.__name__}: {e}")
+        finally:
+            await storage.close()
+
+    storage = factory()
+    await storage.init()
+    try:
+        result = await measure_throughput(storage, messages)
+        print(f"  [{name}] вставка: {result['insert_per_sec']:,.0f} сообщ./с, "
+              f"выборка {messages} сообщений: {result['fetch_ms']:.1f} мс, "
+              f"выборка с бюджетом ({result['budget_rows']} сообщений): {result['budget_fetch_ms']:.1f} мс")
+    finally:
+        await storage.close()
+    return ok
+
+
+async def main_async(args, tmpdir: str) -> bool:
+    counter = iter(range(1_000_000))
+    backends = {
+        "memory": InMemoryStorage,
+        "sqlite": lambda: SQLiteStorage(os.path.join(tmpdir, f"db_{next(counter)}.sqlite3")),
+    }
+    if args.postgres_dsn:
+        from db.postgres import PostgresStorage
+
+        async def _truncate():
+            import asyncpg
+            conn = await asyncpg.connect(args.postgres_dsn)
+            try:
+                await conn.execute("DROP TABLE IF EXISTS messages, settings, chats, summaries, llm_usage, schema_migrations CASCADE")
+            finally:
+                await conn.close()
+
+        class _FreshPostgres(PostgresStorage):
+            async def init(self):
+                await _truncate()
+                await super().init()
+
+        backends["postgres"] = lambda: _FreshPostgres(args.postgres_dsn)
+
+    all_ok = True
+    for name, factory in backends.items():
+        print(f"== {name}")
+        all_ok &= await run_backend(name, factory, args.messages)
+    return all_ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--postgres-dsn", default=os.getenv("BENCH_POSTGRES_DSN"))
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="bench_storage_") as tmpdir:
+        ok = asyncio.run(main_async(args, tmpdir))
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE scripts/bench_storage.py ---
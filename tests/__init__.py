@@ -0,0 +1,13 @@
+# --- START OF FILE tests/__init__.py ---
+
+import os
+
+# Тесты работают без внешних сервисов: хранилище в памяти, без спула на диске.
+# Переменные задаются до первого импорта config.config (load_dotenv их не перезаписывает).
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ["SPOOL_ENABLED"] = "0"
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("OPENROUTER_API_KEY", "test-key")
+os.environ.setdefault("WEBHOOK_PATH", "/webhook")
+
+# --- END OF FILE tests/__init__.py ---
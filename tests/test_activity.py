@@ -0,0 +1,85 @@
+# --- START OF FILE tests/test_activity.py ---
+
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from db import db
+from db.activity import ChatActivityRecorder
+
+DAY = datetime(2024, 3, 10, 9, 0, tzinfo=timezone.utc)
+
+
+class ChatActivityRecorderTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.written = []
+        self.fail = False
+
+        async def flush(chat_id: int, at: datetime, count: int):
+            if self.fail:
+                raise ConnectionError("database is down")
+            self.written.append((chat_id, at, count))
+
+        self.recorder = ChatActivityRecorder(flush)
+
+    async def test_records_are_coalesced_per_chat_and_day(self):
+        self.recorder.record(1, DAY)
+        self.recorder.record(1, DAY + timedelta(hours=2), 3)
+        self.recorder.record(1, DAY + timedelta(hours=1))
+        self.recorder.record(1, DAY - timedelta(days=1))
+        self.recorder.record(2, DAY)
+        self.assertEqual(await self.recorder.flush(), 3)
+        # Одна запись на (чат, день), дни - по возрастанию
+        self.assertEqual(self.written, [
+            (1, DAY - timedelta(days=1), 1),
+            (1, DAY + timedelta(hours=2), 5),
+            (2, DAY, 1),
+        ])
+        self.assertEqual(await self.recorder.flush(), 0)
+
+    async def test_failed_flush_merges_back(self):
+        self.recorder.record(1, DAY, 2)
+        self.fail = True
+        self.assertEqual(await self.recorder.flush(), 0)
+        # Пока БД недоступна, новая активность складывается с отложенной
+        self.recorder.record(1, DAY + timedelta(hours=1))
+        self.fail = False
+        self.assertEqual(await self.recorder.flush(), 1)
+        self.assertEqual(self.written, [(1, DAY + timedelta(hours=1), 3)])
+
+    async def test_discard_drops_pending_chat(self):
+        self.recorder.record(1, DAY)
+        self.recorder.record(1, DAY + timedelta(days=1))
+        self.recorder.record(2, DAY)
+        self.recorder.discard(1)
+        await self.recorder.flush()
+        self.assertEqual(self.written, [(2, DAY, 1)])
+
+
+class DeactivateThenFlushTest(unittest.IsolatedAsyncioTestCase):
+    """Фасад db поверх хранилища в памяти: удаленный чат не возвращается в рассылки."""
+
+    async def asyncSetUp(self):
+        await db.init_pool()
+
+    async def asyncTearDown(self):
+        await db.chat_activity.stop()
+        await db.close_pool()
+
+    async def test_pending_activity_does_not_reactivate_chat(self):
+        chat_id = -1001
+        await db.register_chat(chat_id)
+        await db.save_message(chat_id, "user", "hello", DAY, 1)
+        await db.deactivate_chat(chat_id)
+        # Сообщение, сохраненное уже после удаления бота (обработчик в полете), тоже не возвращает чат
+        await db.save_message(chat_id, "user", "late", DAY + timedelta(minutes=1), 2)
+        self.assertEqual(await db.get_active_chats(DAY - timedelta(hours=1)), [])
+        self.assertEqual(await db.get_registered_chats(), [])
+        await db.register_chat(chat_id)
+        self.assertEqual(await db.get_registered_chats(), [chat_id])
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# --- END OF FILE tests/test_activity.py ---
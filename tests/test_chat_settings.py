@@ -0,0 +1,54 @@
+# --- START OF FILE tests/test_chat_settings.py ---
+
+import unittest
+from unittest import mock
+
+from db import chat_settings, db
+
+CHAT_ID = -1002
+
+
+class ChatSettingsCacheTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        await db.init_pool()
+        await chat_settings.reload_all()
+
+    async def asyncTearDown(self):
+        if chat_settings._retry_task:
+            chat_settings._retry_task.cancel()
+        chat_settings._cache.clear()
+        await db.close_pool()
+
+    async def test_set_updates_cache_without_reading_db(self):
+        await chat_settings.set_chat_setting(CHAT_ID, "summary_hour", "7")
+        with mock.patch.object(db, "storage", None):
+            self.assertEqual(chat_settings.get_chat_settings(CHAT_ID).summary_hour, 7)
+
+    async def test_invalidation_rereads_key(self):
+        # Другой инстанс изменил настройку в БД и прислал уведомление
+        await db.set_setting(chat_settings._setting_key(CHAT_ID, "language"), "en")
+        await chat_settings._reload_key(chat_settings._setting_key(CHAT_ID, "language"))
+        self.assertEqual(chat_settings.get_chat_settings(CHAT_ID).language, "en")
+        await db.delete_setting(chat_settings._setting_key(CHAT_ID, "language"))
+        await chat_settings._reload_key(chat_settings._setting_key(CHAT_ID, "language"))
+        self.assertEqual(chat_settings.get_chat_settings(CHAT_ID), chat_settings.DEFAULTS)
+
+    async def test_db_error_keeps_cached_value_and_schedules_reload(self):
+        await chat_settings.set_chat_setting(CHAT_ID, "min_messages", "50")
+        with mock.patch.object(db, "storage", None):
+            await chat_settings._reload_key(chat_settings._setting_key(CHAT_ID, "min_messages"))
+        self.assertEqual(chat_settings.get_chat_settings(CHAT_ID).min_messages, 50)
+        self.assertIsNotNone(chat_settings._retry_task)
+
+    async def test_full_reload_replaces_cache(self):
+        await chat_settings.set_chat_setting(CHAT_ID, "model", "some/model")
+        await db.delete_setting(chat_settings._setting_key(CHAT_ID, "model"))
+        await chat_settings._reload_key(None)
+        self.assertIsNone(chat_settings.get_chat_settings(CHAT_ID).model)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# --- END OF FILE tests/test_chat_settings.py ---
@@ -0,0 +1,82 @@
+# --- START OF FILE tests/test_llm_scheduler.py ---
+
+import asyncio
+import unittest
+
+from api_clients.llm_scheduler import LLMScheduler, PRIORITY_BATCH, PRIORITY_INTERACTIVE, SchedulerRejected
+
+
+class LLMSchedulerTest(unittest.IsolatedAsyncioTestCase):
+
+    def make(self, max_in_flight: int = 1, max_queue: int = 100, max_wait: float = 0) -> LLMScheduler:
+        return LLMScheduler(max_in_flight, 0, max_queue, {PRIORITY_INTERACTIVE: max_wait, PRIORITY_BATCH: max_wait})
+
+    async def run_queued(self, scheduler: LLMScheduler, requests):
+        """Ставит запросы (chat_id, priority) в очередь за занятым слотом и возвращает порядок выдачи."""
+        order = []
+        blocker = await scheduler.acquire(0)
+
+        async def request(chat_id: int, priority: int):
+            async with scheduler.slot(chat_id, priority):
+                order.append((chat_id, priority))
+                await asyncio.sleep(0)
+
+        tasks = []
+        for chat_id, priority in requests:
+            tasks.append(asyncio.create_task(request(chat_id, priority)))
+            await asyncio.sleep(0) # порядок постановки в очередь = порядок списка
+        scheduler.release(blocker)
+        await asyncio.gather(*tasks)
+        return order
+
+    async def test_interactive_is_served_before_batch(self):
+        order = await self.run_queued(self.make(), [(1, PRIORITY_BATCH), (2, PRIORITY_BATCH), (3, PRIORITY_INTERACTIVE)])
+        self.assertEqual(order, [(3, PRIORITY_INTERACTIVE), (1, PRIORITY_BATCH), (2, PRIORITY_BATCH)])
+
+    async def test_chats_are_served_round_robin(self):
+        requests = [(1, PRIORITY_BATCH)] * 3 + [(2, PRIORITY_BATCH)]
+        order = await self.run_queued(self.make(), requests)
+        self.assertEqual([chat_id for chat_id, _ in order], [1, 2, 1, 1])
+
+    async def test_in_flight_limit(self):
+        scheduler = self.make(max_in_flight=2)
+        peak = running = 0
+
+        async def request(chat_id: int):
+            nonlocal peak, running
+            async with scheduler.slot(chat_id):
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(request(chat_id) for chat_id in range(6)))
+        self.assertEqual(peak, 2)
+        self.assertEqual(scheduler.get_stats()["in_flight"], 0)
+
+    async def test_full_queue_rejects(self):
+        scheduler = self.make(max_queue=1)
+        blocker = await scheduler.acquire(0)
+        waiting = asyncio.create_task(scheduler.acquire(1))
+        await asyncio.sleep(0)
+        with self.assertRaises(SchedulerRejected) as ctx:
+            await scheduler.acquire(2)
+        self.assertEqual(ctx.exception.reason, "queue_full")
+        scheduler.release(blocker)
+        scheduler.release(await waiting)
+
+    async def test_wait_timeout_rejects_and_leaves_queue(self):
+        scheduler = self.make(max_wait=0.01)
+        blocker = await scheduler.acquire(0)
+        with self.assertRaises(SchedulerRejected) as ctx:
+            await scheduler.acquire(1, PRIORITY_BATCH)
+        self.assertEqual(ctx.exception.reason, "timeout")
+        self.assertEqual(scheduler.get_stats()["queued"], 0)
+        scheduler.release(blocker)
+        self.assertEqual(scheduler.get_stats()["in_flight"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# --- END OF FILE tests/test_llm_scheduler.py ---
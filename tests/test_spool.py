@@ -0,0 +1,134 @@
+# --- START OF FILE tests/test_spool.py ---
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from db.base import MessageRecord
+from db.spool import MessageSpool, QUARANTINE_FILE, is_transient_error
+
+T0 = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def message(message_id: int, text: str = "text") -> MessageRecord:
+    return MessageRecord(-100, "user", text, T0 + timedelta(seconds=message_id), message_id)
+
+
+class FakeDB:
+    """БД для досылки: down - недоступна (ConnectionError), строки с текстом "bad" отвергаются."""
+
+    def __init__(self):
+        self.down = False
+        self.rows = {}
+        self.pings = 0
+
+    async def save(self, batch: List[MessageRecord]) -> int:
+        if self.down:
+            raise ConnectionError("database is down")
+        if any(m.text == "bad" for m in batch):
+            raise ValueError("rejected row")
+        new = [m for m in batch if m.telegram_message_id not in self.rows]
+        for m in new:
+            self.rows[m.telegram_message_id] = m.text
+        return len(new)
+
+    async def apply_edit(self, m: MessageRecord, edited_at: datetime) -> int:
+        if self.down:
+            raise ConnectionError("database is down")
+        if m.telegram_message_id in self.rows:
+            self.rows[m.telegram_message_id] = m.text
+            return 0
+        return await self.save([m])
+
+    async def ping(self):
+        self.pings += 1
+        if self.down:
+            raise ConnectionError("database is down")
+
+
+class MessageSpoolTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.db = FakeDB()
+        self.spool = MessageSpool(self._dir.name, self.db.save, self.db.apply_edit, probe=self.db.ping,
+                                  fsync_interval=0.001, replay_interval=0.01, replay_batch=2)
+
+    async def asyncTearDown(self):
+        await self.spool.stop()
+        self._dir.cleanup()
+
+    async def test_replay_applies_inserts_and_edits_in_order(self):
+        for i in range(3):
+            await self.spool.append(message(i), "error")
+        await self.spool.append(message(1, "edited"), "edit", edited_at=T0 + timedelta(minutes=1))
+        self.assertEqual(self.spool.pending, 4)
+        self.assertEqual(await self.spool.replay(), 3)
+        self.assertEqual(self.db.rows, {0: "text", 1: "edited", 2: "text"})
+        self.assertEqual(self.spool.pending, 0)
+        self.assertEqual(self.spool._segments(), [])
+
+    async def test_replay_keeps_segments_while_db_is_down(self):
+        await self.spool.append(message(1), "error")
+        self.db.down = True
+        with self.assertRaises(ConnectionError):
+            await self.spool.replay()
+        self.assertEqual(self.spool.pending, 1)
+        self.db.down = False
+        self.assertEqual(await self.spool.replay(), 1)
+        self.assertEqual(self.spool.pending, 0)
+
+    async def test_rejected_records_are_quarantined(self):
+        for i, text in enumerate(["a", "bad", "c"]):
+            await self.spool.append(message(i, text), "error")
+        self.assertEqual(await self.spool.replay(), 2)
+        self.assertEqual(self.db.rows, {0: "a", 2: "c"})
+        self.assertEqual(self.spool.pending, 0)
+        with open(os.path.join(self._dir.name, QUARANTINE_FILE), encoding="utf-8") as f:
+            quarantined = [json.loads(line) for line in f]
+        self.assertEqual([(r["telegram_message_id"], r["text"]) for r in quarantined], [(1, "bad")])
+        self.assertIn("rejected row", quarantined[0]["error"])
+
+    async def test_degraded_mode_clears_only_after_probe(self):
+        self.spool.degraded = True
+        self.db.down = True
+        await self.spool.start()
+        await self.spool.append(message(1), "degraded")
+        await asyncio.sleep(0.05)
+        self.assertTrue(self.spool.degraded)
+        self.assertEqual(self.spool.pending, 1)
+        self.db.down = False
+        for _ in range(50):
+            if not self.spool.degraded:
+                break
+            await asyncio.sleep(0.01)
+        self.assertFalse(self.spool.degraded)
+        self.assertEqual(self.spool.pending, 0)
+        self.assertEqual(self.db.rows, {1: "text"})
+
+    async def test_empty_degraded_spool_waits_for_probe(self):
+        self.spool.degraded = True
+        self.db.down = True
+        await self.spool.start()
+        await asyncio.sleep(0.05)
+        # Проход без сегментов к БД не обращается - снять деградацию может только probe
+        self.assertTrue(self.spool.degraded)
+        self.assertGreater(self.db.pings, 0)
+        self.db.down = False
+        await asyncio.sleep(0.05)
+        self.assertFalse(self.spool.degraded)
+
+    def test_transient_errors(self):
+        self.assertTrue(is_transient_error(ConnectionError()))
+        self.assertTrue(is_transient_error(asyncio.TimeoutError()))
+        self.assertFalse(is_transient_error(ValueError()))
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# --- END OF FILE tests/test_spool.py ---